@@ -32,7 +32,7 @@ def cropYield(shapefile, name, startdate="", enddate="", crop="maize", dbname="r
     if len(enddate) > 0:
         try:
             edt = datetime.strptime(enddate, "%Y-%m-%d")
-            datesql += "and fdate<=date'{0}'".format(edt.strftime("%y-%m-%d"))
+            datesql += " and fdate<=date'{0}'".format(edt.strftime("%Y-%m-%d"))
         except ValueError:
             log.warning("End date is invalid and will be ignored.")
     fsql = "with f as (select gid,geom,gwad,ensemble,fdate from (select gid,geom,gwad,ensemble,fdate,row_number() over (partition by gid,ensemble order by gwad desc) as rn from {0}.dssat) gwadtable where rn=1 {1})".format(name, datesql)
@@ -107,7 +107,7 @@ def _saveTimeSeriesFromShapefile(filepath, name, varname, startdate, enddate, db
     try:
         sdt = datetime.strptime(startdate, "%Y-%m-%d")
         edt = datetime.strptime(enddate, "%Y-%m-%d")
-        sql += " and fdate>=date'{0}' and fdate<=date'{1} group by gid,fdate,rast order by gid,fdate".format(sdt.strftime("%Y-%m-%d"), edt.strftime("%Y-%m-%d"))
+        sql += " and fdate>=date'{0}' and fdate<=date'{1}' group by gid,fdate,rast order by gid,fdate".format(sdt.strftime("%Y-%m-%d"), edt.strftime("%Y-%m-%d"))
     except ValueError:
         sql += " group by gid,fdate,rast order by fdate,gid"
         log.warning("Start and/or end dates were invalid. Ignoring...")
@@ -137,7 +137,7 @@ def _saveRasters(filepath, name, varname, startdate, enddate, dbname):
         try:
             sdt = datetime.strptime(startdate, "%Y-%m-%d")
             edt = datetime.strptime(enddate, "%Y-%m-%d")
-            sql += " where fdate>=date'{0}' and fdate<=date'{1} group by fdate".format(sdt.strftime("%Y-%m-%d"), edt.strftime("%Y-%m-%d"))
+            sql += " where fdate>=date'{0}' and fdate<=date'{1}' group by fdate".format(sdt.strftime("%Y-%m-%d"), edt.strftime("%Y-%m-%d"))
         except ValueError:
             sql += " group by fdate"
             log.warning("Start and/or end dates were invalid. Ignoring...")
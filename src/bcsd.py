@@ -0,0 +1,238 @@
+""" RHEAS module for bias-corrected and spatially disaggregated forecasts
+
+.. module:: bcsd
+   :synopsis: Generate meteorological forecast ensembles by bias-correcting and disaggregating NMME forecasts
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import numpy as np
+import hashlib
+from datetime import date, timedelta
+from dateutil.relativedelta import relativedelta
+import climatology
+import dbio
+import tempfile
+import shutil
+import sys
+import logging
+
+
+nquantiles = 20
+sources = {"precip": "precip.nmme", "temp": "tmax.nmme"}
+
+
+def _weights(georef, shape, lat, lon):
+    """Bilinear interpolation weights from the pixel centers of a raster with upper-left
+    corner and pixel size *georef* and *shape* (rows, columns) to the cells at *lat* and
+    *lon*. Returns the flat pixel indices and the weights of the four neighbours of each
+    cell as arrays with dimensions (4, cell)."""
+    ulx, uly, scalex, scaley = georef
+    nrows, ncols = shape
+    x = np.clip((lon - ulx) / scalex - 0.5, 0, ncols - 1)
+    y = np.clip((lat - uly) / scaley - 0.5, 0, nrows - 1)
+    j0 = np.minimum(np.floor(x).astype(int), max(ncols - 2, 0))
+    i0 = np.minimum(np.floor(y).astype(int), max(nrows - 2, 0))
+    j1 = np.minimum(j0 + 1, ncols - 1)
+    i1 = np.minimum(i0 + 1, nrows - 1)
+    fx = x - j0
+    fy = y - i0
+    index = np.array([i0 * ncols + j0, i0 * ncols + j1, i1 * ncols + j0, i1 * ncols + j1])
+    weights = np.array([(1 - fy) * (1 - fx), (1 - fy) * fx, fy * (1 - fx), fy * fx])
+    return index, weights
+
+
+def _interpolate(data, georef, lat, lon, weights):
+    """Interpolate raster *data* to the basin cells, computing the weights of each grid
+    only once. Missing pixels are left out and cells without any valid neighbour are NaN."""
+    key = tuple(georef) + data.shape
+    if key not in weights:
+        weights[key] = _weights(georef, data.shape, lat, lon)
+    index, w = weights[key]
+    values = np.ma.filled(data.astype("f8"), np.nan).ravel()[index]
+    valid = ~np.isnan(values)
+    w = np.where(valid, w, 0.0)
+    wsum = w.sum(axis=0)
+    out = (np.where(valid, values, 0.0) * w).sum(axis=0) / np.where(wsum > 0, wsum, 1.0)
+    return np.where(wsum > 0, out, np.nan)
+
+
+def quantileMap(x, qfcst, qobs, ratio=False):
+    """Map forecasts *x* with dimensions (member, lead, cell) onto the observed
+    distribution, given the forecast and observed quantiles of each lead and cell as
+    arrays with dimensions (lead, quantile, cell). Values beyond the forecast quantiles
+    are extrapolated with the ratio (e.g. for precipitation) or the difference of the
+    extreme quantiles."""
+    nq = qfcst.shape[1]
+    k = (qfcst[None] < x[:, :, None, :]).sum(axis=2)
+    lo = np.clip(k - 1, 0, nq - 2)
+    leads = np.arange(x.shape[1])[None, :, None]
+    cells = np.arange(x.shape[2])[None, None, :]
+    f0, f1 = qfcst[leads, lo, cells], qfcst[leads, lo + 1, cells]
+    o0, o1 = qobs[leads, lo, cells], qobs[leads, lo + 1, cells]
+    out = o0 + np.clip((x - f0) / np.where(f1 > f0, f1 - f0, 1.0), 0.0, 1.0) * (o1 - o0)
+    for q, outside in [(0, k == 0), (nq - 1, k == nq)]:
+        fq, oq = qfcst[None, :, q], qobs[None, :, q]
+        if ratio:
+            extra = x * np.where(fq > 0, oq / np.where(fq > 0, fq, 1.0), 1.0)
+        else:
+            extra = x + (oq - fq)
+        out = np.where(outside, extra, out)
+    return out
+
+
+def _monthlyMeans(dbname, name, tablename, squery):
+    """Retrieve the monthly means of each NMME member over the basin for the dates
+    selected by *squery*, as a list of (ensemble, year, month, data, georef) records."""
+    db = dbio.connect(dbname)
+    cur = db.cursor()
+    sql = "select ensemble,date_part('year',fdate) as yr,date_part('month',fdate) as mon,st_asbinary(st_union(st_clip(rast,b.geom),'MEAN')) from {0},(select st_setsrid(st_expand(st_extent(geom),2.0)::geometry,4326) as geom from {1}.basin) as b where st_intersects(rast,b.geom) and {2} group by ensemble,yr,mon order by ensemble,yr,mon".format(
+        tablename, name, squery)
+    cur.execute(sql)
+    records = []
+    for ens, yr, mon, wkb in cur.fetchall():
+        data, georef = dbio.rasterFromWKB(str(wkb))
+        records.append((int(ens), int(yr), int(mon), data[0], georef))
+    cur.close()
+    db.close()
+    return records
+
+
+def _observed(clim, var, month):
+    """Returns the years with observations of *month* in the climatology, along with
+    the observed monthly means of each year and basin cell."""
+    if var == "precip":
+        return clim.monthly("precip", month)
+    ytmax, tmax = clim.monthly("tmax", month)
+    ytmin, tmin = clim.monthly("tmin", month)
+    years = [y for y in ytmax if y in ytmin]
+    return years, 0.5 * (tmax[[ytmax.index(y) for y in years]] + tmin[[ytmin.index(y) for y in years]])
+
+
+def _stamp(dbname, clim, var, month, dt0):
+    """Identifier of the data that the quantile table of *var* and *month* is computed
+    from, i.e. the years of the NMME hindcasts of the month before the month of the
+    forecast and the years of the month in the climatology."""
+    db = dbio.connect(dbname)
+    cur = db.cursor()
+    cur.execute("select distinct date_part('year',fdate)::int as yr from {0} where date_part('month',fdate)={1} and fdate<date'{2}' order by yr".format(
+        sources[var], month, date(dt0.year, dt0.month, 1).strftime("%Y-%m-%d")))
+    hyears = [r[0] for r in cur.fetchall()]
+    cur.close()
+    db.close()
+    oyears = _observed(clim, var, month)[0]
+    key = "{0}_{1}_{2}_{3}".format(nquantiles, len(clim.gids), hyears, oyears)
+    return hashlib.sha1(key).hexdigest()
+
+
+def _readQuantiles(dbname, name, stamps):
+    """Retrieve the quantile tables of each variable and month that are stored in the
+    database for the same data, as identified by *stamps*."""
+    tables = {}
+    if dbio.tableExists(dbname, name, "bcsd"):
+        db = dbio.connect(dbname)
+        cur = db.cursor()
+        cur.execute("select variable,month,stamp,obs,fcst from {0}.bcsd".format(name))
+        for var, month, stamp, qobs, qfcst in cur.fetchall():
+            if stamps.get((var, month)) == stamp:
+                tables[(var, month)] = (np.array(qobs, dtype="f8").reshape((nquantiles, -1)), np.array(qfcst, dtype="f8").reshape((nquantiles, -1)))
+        cur.close()
+        db.close()
+    return tables
+
+
+def _writeQuantiles(dbname, name, stamps, tables):
+    """Store the quantile tables of each variable and month in the database."""
+    db = dbio.connect(dbname)
+    cur = db.cursor()
+    if not dbio.tableExists(dbname, name, "bcsd"):
+        cur.execute("create table {0}.bcsd (variable text, month int, stamp text, obs real[], fcst real[])".format(name))
+    for (var, month), (qobs, qfcst) in tables.items():
+        cur.execute("delete from {0}.bcsd where variable='{1}' and month={2}".format(name, var, month))
+        cur.execute("insert into {0}.bcsd (variable,month,stamp,obs,fcst) values (%s,%s,%s,%s,%s)".format(name),
+                    (var, month, stamps[(var, month)], qobs.ravel().tolist(), qfcst.ravel().tolist()))
+    db.commit()
+    cur.close()
+    db.close()
+
+
+def generate(options, models):
+    """Generate meteorological forecast forcings by bias-correcting and spatially
+    disaggregating NMME forecasts, yielding each ensemble member once its forcings
+    are written."""
+    log = logging.getLogger(__name__)
+    dt0 = date(models.startyear, models.startmonth, models.startday)
+    dt1 = date(models.endyear, models.endmonth, models.endday)
+    ndays = (dt1 - dt0).days + 1
+    directory = models.climatology
+    if directory is None:
+        directory = tempfile.mkdtemp()
+    clim = climatology.Climatology(models[0], options['vic'], directory)
+    clim.refresh()
+    years = [y for y in range(dt0.year - 100, dt0.year) if clim.covers(date(y, dt0.month, dt0.day), ndays)]
+    if len(years) < 1:
+        log.error("No climatology found to generate VIC forcings for BCSD forecast. Exiting...")
+        sys.exit()
+    lat = np.array([models[0].gid[g][0] for g in clim.gids])
+    lon = np.array([models[0].gid[g][1] for g in clim.gids])
+    # lead month of each forecast day
+    leads = []
+    t = date(dt0.year, dt0.month, 1)
+    while t <= dt1:
+        leads.append((t.year, t.month))
+        t += relativedelta(months=1)
+    lead = np.array([leads.index(((dt0 + timedelta(k)).year, (dt0 + timedelta(k)).month)) for k in range(ndays)])
+    stamps = dict(((var, m), _stamp(models.dbname, clim, var, m, dt0)) for var in sources for m in set(m for _, m in leads))
+    tables = _readQuantiles(models.dbname, models.name, stamps)
+    probs = 100.0 * (np.arange(nquantiles) + 0.5) / nquantiles
+    weights = {}
+    fcst = {}
+    for var in ["precip", "temp"]:
+        records = _monthlyMeans(models.dbname, models.name, sources[var], "fdate>=date'{0}' and fdate<=date'{1}'".format(
+            dt0.strftime("%Y-%m-%d"), dt1.strftime("%Y-%m-%d")))
+        members = sorted(set(r[0] for r in records))
+        if len(members) < 1 or len(records) != len(members) * len(leads):
+            log.error("Not enough NMME data found for requested forecast period! Exiting...")
+            sys.exit()
+        fcst[var] = np.array([_interpolate(r[3], r[4], lat, lon, weights) for r in records]).reshape((len(members), len(leads), -1))
+        # quantile tables are computed from the hindcasts before the forecast and stored for reuse
+        missing = sorted(set(m for _, m in leads if (var, m) not in tables))
+        if len(missing) > 0:
+            hindcasts = _monthlyMeans(models.dbname, models.name, sources[var], "fdate<date'{0}'".format(date(dt0.year, dt0.month, 1).strftime("%Y-%m-%d")))
+            computed = {}
+            for month in missing:
+                hist = np.array([_interpolate(r[3], r[4], lat, lon, weights) for r in hindcasts if r[2] == month])
+                obs = _observed(clim, var, month)[1]
+                if len(hist) < 2 or len(obs) < 2:
+                    log.warning("Not enough NMME hindcasts or observations to bias-correct {0} for month {1}.".format(var, month))
+                    continue
+                computed[(var, month)] = (np.percentile(obs, probs, axis=0), np.percentile(hist, probs, axis=0))
+            _writeQuantiles(models.dbname, models.name, stamps, computed)
+            tables.update(computed)
+        # lead months without quantile tables are mapped onto themselves
+        qobs = np.zeros((len(leads), nquantiles, len(lat)))
+        qfcst = np.zeros((len(leads), nquantiles, len(lat)))
+        for i, (_, m) in enumerate(leads):
+            if (var, m) in tables:
+                qobs[i], qfcst[i] = tables[(var, m)]
+            else:
+                qobs[i] = qfcst[i] = np.percentile(fcst[var][:, i], probs, axis=0)
+        fcst[var] = quantileMap(fcst[var], qfcst, qobs, ratio=(var == "precip"))
+    # daily forcings come from a climatological year, with precipitation scaled and
+    # temperature shifted to match the bias-corrected monthly forecast of the member
+    starts = np.searchsorted(lead, np.arange(len(leads)))
+    counts = np.bincount(lead)[:, None].astype("f8")
+    nmembers = fcst["precip"].shape[0]
+    for e, year in enumerate(np.random.choice(years, models.nens)):
+        data = clim.trace(date(year, dt0.month, dt0.day), ndays)
+        pmean = np.add.reduceat(data['precip'], starts, axis=0) / counts
+        tmean = np.add.reduceat(data['tmax'] + data['tmin'], starts, axis=0) / (2.0 * counts)
+        pfcst = fcst["precip"][e % nmembers]
+        scale = np.where(pmean > 0, pfcst / np.where(pmean > 0, pmean, 1.0), 1.0)
+        prec = np.maximum(np.where(pmean[lead] > 0, data['precip'] * scale[lead], pfcst[lead]), 0.0)
+        shift = (fcst["temp"][e % nmembers] - tmean)[lead]
+        models[e].writeForcings(prec, data['tmax'] + shift, data['tmin'] + shift, data['wind'])
+        yield e
+    if models.climatology is None:
+        shutil.rmtree(directory)
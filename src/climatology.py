@@ -0,0 +1,192 @@
+""" RHEAS module for basin climatologies
+
+.. module:: climatology
+   :synopsis: Memory-mapped cube of the historical meteorological forcings of a basin
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import numpy as np
+from datetime import date, timedelta
+import calendar
+import json
+import shutil
+import os
+import dbio
+import rpath
+import logging
+
+
+variables = ["precip", "tmax", "tmin", "wind"]
+
+
+class Climatology:
+    """Cube of the historical meteorological forcings of the basin simulated by
+    *model*, stored as a memory-mapped file per variable and year that holds an array
+    with dimensions (day of year, cell). Days without data are NaN."""
+
+    def __init__(self, model, options, directory=None):
+        if directory is None:
+            directory = "{0}/climatology".format(os.path.dirname(rpath.data))
+        self.model = model
+        self.datasets = {"precip": options["precip"], "tmax": options["temperature"],
+                         "tmin": options["temperature"], "wind": options["wind"]}
+        self.path = "{0}/{1}_{2}_{3}_{4}_{5}".format(directory, model.name, model.res,
+                                                     options["precip"], options["temperature"], options["wind"])
+        self.gids = list(model.gid.keys())
+        self.end = None
+        self.signatures = {}
+        meta = self._readMeta()
+        if meta is not None and meta["gids"] == self.gids:
+            if meta["end"] is not None:
+                self.end = date(*meta["end"])
+            self.signatures = meta.get("signatures", {})
+        else:
+            # the basin has changed, so the cube is rebuilt
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            os.makedirs(self.path)
+
+    def _readMeta(self):
+        """Returns the cells and last date of the cube, if it exists."""
+        filename = self.path + "/meta.json"
+        if os.path.isfile(filename):
+            with open(filename) as fin:
+                return json.load(fin)
+        else:
+            return None
+
+    def _writeMeta(self):
+        meta = {"gids": self.gids, "end": None if self.end is None else [self.end.year, self.end.month, self.end.day],
+                "signatures": self.signatures}
+        with open(self.path + "/meta.json", "w") as fout:
+            json.dump(meta, fout)
+
+    def _year(self, var, year, mode="r"):
+        """Returns the memory-mapped array of variable *var* for *year*, creating it if needed."""
+        filename = "{0}/{1}_{2:04d}.f4".format(self.path, var, year)
+        shape = (366, len(self.gids))
+        if not os.path.isfile(filename):
+            data = np.memmap(filename, dtype="f4", mode="w+", shape=shape)
+            data[:] = np.nan
+            data.flush()
+        return np.memmap(filename, dtype="f4", mode=mode, shape=shape)
+
+    def _available(self):
+        """Returns the period for which all forcing datasets have data."""
+        db = dbio.connect(self.model.dbname)
+        cur = db.cursor()
+        t0, t1 = None, None
+        for var in variables:
+            cur.execute("select min(fdate), max(fdate) from {0}.{1}".format(var, self.datasets[var]))
+            v0, v1 = cur.fetchone()
+            t0 = v0 if t0 is None or v0 is None else max(t0, v0)
+            t1 = v1 if t1 is None or v1 is None else min(t1, v1)
+        cur.close()
+        db.close()
+        return t0, t1
+
+    def _signature(self, year, end):
+        """Returns the number of rasters and the largest raster identifier of each forcing
+        dataset for the dates of *year* up to *end*, which change whenever any of these
+        dates are ingested again."""
+        db = dbio.connect(self.model.dbname)
+        cur = db.cursor()
+        signature = {}
+        for var in variables:
+            cur.execute("select count(*),max(rid) from {0}.{1} where fdate>=date'{2}-1-1' and fdate<=date'{3}'".format(
+                var, self.datasets[var], year, min(end, date(year, 12, 31)).strftime("%Y-%m-%d")))
+            n, rid = cur.fetchone()
+            signature[var] = [int(n), None if rid is None else int(rid)]
+        cur.close()
+        db.close()
+        return signature
+
+    def _extract(self, t0, t1):
+        """Extracts the forcings between *t0* and *t1* from the database."""
+        model = self.model
+        dates = (model.startyear, model.startmonth, model.startday, model.endyear, model.endmonth, model.endday)
+        model.setDates(t0.year, t0.month, t0.day, t1.year, t1.month, t1.day)
+        try:
+            options = {"precip": self.datasets["precip"], "temperature": self.datasets["tmax"], "wind": self.datasets["wind"]}
+            data = dict(zip(variables, model.getForcings(options)))
+        finally:
+            model.setDates(*dates)
+        return data
+
+    def refresh(self):
+        """Adds the dates that were ingested into the database since the cube was last
+        updated, one year at a time. Years whose rasters were ingested again (e.g. when
+        preliminary data are replaced) are extracted anew."""
+        log = logging.getLogger(__name__)
+        t0, t1 = self._available()
+        if t0 is None or t1 is None:
+            log.warning("No forcing data found in the database for the climatology of {0}.".format(self.model.name))
+            return
+        index = dict((gid, c) for c, gid in enumerate(self.gids))
+        for year in range(t0.year, t1.year + 1):
+            s, e = max(t0, date(year, 1, 1)), min(t1, date(year, 12, 31))
+            if s > e:
+                continue
+            if self.end is not None and s <= self.end:
+                if self._signature(year, self.end) != self.signatures.get(str(year)):
+                    log.info("Forcings of {0} have changed, replacing them in the climatology of {1}.".format(year, self.model.name))
+                    for var in variables:
+                        out = self._year(var, year, mode="r+")
+                        out[:] = np.nan
+                        out.flush()
+                elif e <= self.end:
+                    continue
+                else:
+                    s = self.end + timedelta(1)
+            log.info("Adding {0} to {1} to the climatology of {2}.".format(s.strftime("%Y-%m-%d"), e.strftime("%Y-%m-%d"), self.model.name))
+            data = self._extract(s, e)
+            for var in variables:
+                if len(data[var]) > 0:
+                    out = self._year(var, year, mode="r+")
+                    days = [(r[1] - date(year, 1, 1)).days for r in data[var]]
+                    cells = [index[r[0]] for r in data[var]]
+                    out[days, cells] = [r[2] for r in data[var]]
+                    out.flush()
+            self.end = e if self.end is None else max(self.end, e)
+            self.signatures[str(year)] = self._signature(year, self.end)
+            self._writeMeta()
+
+    def covers(self, startdate, ndays):
+        """Checks whether the cube has data for *ndays* days from *startdate*."""
+        t1 = startdate + timedelta(ndays - 1)
+        if self.end is None or t1 > self.end:
+            return False
+        data = self.trace(startdate, ndays)
+        return not any(np.isnan(data[var]).any() for var in variables)
+
+    def trace(self, startdate, ndays):
+        """Returns the forcings of each variable for *ndays* days from *startdate* as
+        arrays with dimensions (day, cell)."""
+        dates = [startdate + timedelta(k) for k in range(ndays)]
+        years = sorted(set(t.year for t in dates))
+        out = {}
+        for var in variables:
+            out[var] = np.zeros((ndays, len(self.gids)), dtype="f4") + np.nan
+            for year in years:
+                if os.path.isfile("{0}/{1}_{2:04d}.f4".format(self.path, var, year)):
+                    k = [i for i, t in enumerate(dates) if t.year == year]
+                    days = [(dates[i] - date(year, 1, 1)).days for i in k]
+                    out[var][k] = self._year(var, year)[days]
+        return out
+
+    def monthly(self, var, month):
+        """Returns the years for which the cube has all days of *month*, along with the
+        monthly mean of variable *var* of each year as an array with dimensions (year, cell)."""
+        years, means = [], []
+        prefix = "{0}_".format(var)
+        for filename in sorted(os.listdir(self.path)):
+            if filename.startswith(prefix) and filename.endswith(".f4"):
+                year = int(filename[len(prefix):-3])
+                d0 = (date(year, month, 1) - date(year, 1, 1)).days
+                data = self._year(var, year)[d0:d0 + calendar.monthrange(year, month)[1]]
+                if not np.isnan(data).any():
+                    years.append(year)
+                    means.append(data.mean(axis=0))
+        return years, np.array(means)
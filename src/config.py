@@ -13,6 +13,8 @@ import os
 import re
 import StringIO
 import logging
+from multiprocessing import cpu_count
+import rpath
 
 
 def _readFromFile(config_filename):
@@ -142,6 +144,157 @@ def getBasinFile(options):
     return basin
 
 
+def getEnsembleStorage(options):
+    """Get storage layout of ensemble outputs, either with each member in its
+    own rows or with the members as raster bands."""
+    log = logging.getLogger(__name__)
+    storage = "rows"
+    if 'ensemble storage' in options['vic']:
+        storage = str(options['vic']['ensemble storage']).lower()
+        if storage not in ["rows", "bands"]:
+            log.warning("Unknown ensemble storage {0}, storing members in rows.".format(storage))
+            storage = "rows"
+    return storage
+
+
+def getSaveChunk(options):
+    """Get number of days of VIC output that are read and saved at a time."""
+    log = logging.getLogger(__name__)
+    chunk = None
+    if 'save chunk' in options['vic']:
+        try:
+            chunk = int(options['vic']['save chunk'])
+        except ValueError:
+            log.warning("Invalid save chunk {0}, saving entire simulation period at once.".format(options['vic']['save chunk']))
+    return chunk
+
+
+def getProcesses(options):
+    """Get maximum number of processes used to run VIC and read its output."""
+    log = logging.getLogger(__name__)
+    nprocs = cpu_count()
+    if 'processes' in options['vic']:
+        try:
+            nprocs = max(1, int(options['vic']['processes']))
+        except ValueError:
+            log.warning("Invalid number of processes {0}, using {1}.".format(options['vic']['processes'], nprocs))
+    return nprocs
+
+
+def getSubdomains(options):
+    """Get number of sub-domains that a VIC simulation is split into."""
+    log = logging.getLogger(__name__)
+    nsub = 1
+    if 'subdomains' in options['vic']:
+        try:
+            nsub = max(1, int(options['vic']['subdomains']))
+        except ValueError:
+            log.warning("Invalid number of sub-domains {0}, simulating the entire domain at once.".format(options['vic']['subdomains']))
+    return nsub
+
+
+def getPartition(options):
+    """Get the interval (year or month) by which VIC output tables are partitioned.
+    Tables are not partitioned by default."""
+    log = logging.getLogger(__name__)
+    partition = None
+    if 'partition' in options['vic']:
+        value = str(options['vic']['partition']).lower()
+        if value in ["year", "month"]:
+            partition = value
+        elif value not in ["off", "false", "no"]:
+            log.warning("Invalid partition interval {0}, output tables will not be partitioned.".format(options['vic']['partition']))
+    return partition
+
+
+def getRunCache(options):
+    """Get directory and maximum size in bytes of the VIC run cache. The cache
+    is on by default and can be turned off for a simulation."""
+    log = logging.getLogger(__name__)
+    directory = "{0}/cache".format(os.path.dirname(rpath.data))
+    maxsize = 10 * 1024 ** 3
+    if 'cache' in options['vic']:
+        if str(options['vic']['cache']).lower() in ["off", "false", "no"]:
+            directory = None
+        elif str(options['vic']['cache']).lower() not in ["on", "true", "yes"]:
+            directory = options['vic']['cache']
+    if 'cache size' in options['vic']:
+        try:
+            maxsize = int(float(options['vic']['cache size']) * 1024 ** 3)
+        except ValueError:
+            log.warning("Invalid cache size {0}, using 10 GB.".format(options['vic']['cache size']))
+    return directory, maxsize
+
+
+def getStateCheckpoints(options):
+    """Get interval ("dekad", "month" or number of days) at which VIC states are
+    saved during a simulation, and number of days that all of them are retained."""
+    log = logging.getLogger(__name__)
+    interval = None
+    retention = None
+    if 'state interval' in options['vic']:
+        interval = str(options['vic']['state interval']).lower()
+        if interval not in ["dekad", "month"] and not interval.isdigit():
+            log.warning("Unknown state interval {0}, saving state only at the end of the simulation.".format(interval))
+            interval = None
+    if 'state retention' in options['vic']:
+        try:
+            retention = int(options['vic']['state retention'])
+        except ValueError:
+            log.warning("Invalid state retention {0}, keeping all state files.".format(options['vic']['state retention']))
+    return interval, retention
+
+
+def getChunkYears(options):
+    """Get number of years of each segment that a long simulation is split into."""
+    log = logging.getLogger(__name__)
+    years = None
+    if 'chunk years' in options['vic']:
+        try:
+            years = max(1, int(options['vic']['chunk years']))
+        except ValueError:
+            log.warning("Invalid chunk years {0}, simulating the entire period at once.".format(options['vic']['chunk years']))
+    return years
+
+
+def getClimatology(options):
+    """Get directory of the basin climatology cubes used to generate ensemble
+    forcings. The cubes are used by default and can be turned off."""
+    directory = "{0}/climatology".format(os.path.dirname(rpath.data))
+    if 'climatology' in options['vic']:
+        if str(options['vic']['climatology']).lower() in ["off", "false", "no"]:
+            directory = None
+        elif str(options['vic']['climatology']).lower() not in ["on", "true", "yes"]:
+            directory = options['vic']['climatology']
+    return directory
+
+
+def getEnsembleProducts(options):
+    """Get the ensemble percentiles and the exceedance threshold of each variable
+    that are saved for a forecast. A threshold starting with < gives the
+    probability of falling below it."""
+    log = logging.getLogger(__name__)
+    quantiles = []
+    exceedance = {}
+    if 'quantiles' in options['forecast']:
+        for item in str(options['forecast']['quantiles']).split(","):
+            try:
+                q = int(item.strip())
+                if q < 0 or q > 100:
+                    raise ValueError
+                quantiles.append(q)
+            except ValueError:
+                log.warning("Invalid ensemble percentile {0}, ignoring it.".format(item))
+    if 'exceedance' in options['forecast']:
+        for item in str(options['forecast']['exceedance']).split(","):
+            try:
+                varname, threshold = [v.strip() for v in item.split(":")]
+                exceedance[varname] = (float(threshold.lstrip("<")), threshold.startswith("<"))
+            except ValueError:
+                log.warning("Invalid exceedance threshold {0}, ignoring it.".format(item))
+    return quantiles, exceedance
+
+
 def getVICvariables(options):
     """Get list of VIC variables and format to save."""
     if 'save to' in options['vic']:
@@ -7,12 +7,12 @@
 
 """
 
-import os
 import ConfigParser
 import sys
 import dbio
 from datetime import datetime, timedelta
 import numpy as np
+import itertools
 import gzip
 import zipfile
 from decorators import geotiff, path
@@ -103,21 +103,48 @@ def download(dbname, dts, bbox, conf, name):
     def fetch(dbname, dt, bbox):
         return url, bbox, dt
     if url is not None and res is not None and table is not None:
-        for dt in [dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)]:
-            data, lat, lon, t = fetch(dbname, dt, bbox)
-            ingest(dbname, table, data, lat, lon, res, t)
+        ingestMany(dbname, table, (fetch(dbname, dt, bbox) for dt in [dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)]), res)
     else:
         log.warning("Missing options for local dataset {0}. Nothing ingested!".format(name))
 
 
+def _item(data, lat, lon, res, t):
+    """Returns the (date, array, geotransform) item that is ingested into the
+    database, gridding data that are given as a list of points."""
+    if len(data.shape) > 2:
+        data = data[0, :, :]
+    if len(data.shape) < 2:
+        nrows = int((max(lat) - min(lat)) / res) + 1
+        ncols = int((max(lon) - min(lon)) / res) + 1
+        out = np.ma.masked_all((nrows, ncols))
+        out[((max(lat) - np.asarray(lat)) / res).astype(int), ((np.asarray(lon) - min(lon)) / res).astype(int)] = data
+        data = out
+    return t, data, (min(lon) - res / 2.0, res, 0, max(lat) + res / 2.0, 0, -res)
+
+
 def ingest(dbname, table, data, lat, lon, res, t, resample=True, overwrite=True):
     """Import data into RHEAS database."""
     log = logging.getLogger(__name__)
     if data is not None:
-        if len(data.shape) > 2:
-            data = data[0, :, :]
-        filename = dbio.writeGeotif(lat, lon, res, data)
-        dbio.ingest(dbname, filename, t, table, resample, overwrite)
-        os.remove(filename)
+        dbio.ingestArrays(dbname, table, [_item(data, lat, lon, res, t)], resample, overwrite)
     else:
         log.warning("No data were available to import into {0} for {1}.".format(table, t.strftime("%Y-%m-%d")))
+
+
+def ingestMany(dbname, table, fetched, res, resample=True, overwrite=True, batchsize=31):
+    """Import the (data, lat, lon, date) rasters returned by the fetch function of a
+    dataset into RHEAS database, loading *batchsize* dates at a time so that memory
+    use is bounded and each batch is committed as soon as it has been fetched."""
+    log = logging.getLogger(__name__)
+    fetched = iter(fetched)
+    while True:
+        batch = list(itertools.islice(fetched, batchsize))
+        if len(batch) < 1:
+            break
+        items = []
+        for data, lat, lon, t in batch:
+            if data is not None:
+                items.append(_item(data, lat, lon, res, t))
+            else:
+                log.warning("No data were available to import into {0} for {1}.".format(table, t.strftime("%Y-%m-%d")))
+        dbio.ingestArrays(dbname, table, items, resample, overwrite)
@@ -30,8 +30,8 @@ def download(dbname, dts, bbox=None):
     res = 0.25
     data, lat, lon, dts = fetch(dbname, dts, bbox)
     data *= 24.0  # convert from mm/hr to mm
-    for t, dt in enumerate([dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)]):
-        datasets.ingest(dbname, table, data[t, :, :], lat, lon, res, dt)
+    fetched = [(data[t, :, :], lat, lon, dt) for t, dt in enumerate([dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)])]
+    datasets.ingestMany(dbname, table, fetched, res)
 
 
 def dates(dbname):
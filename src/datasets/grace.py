@@ -36,13 +36,15 @@ def fetchScalingGrid(dbname, dt, bbox):
 def download(dbname, dts, bbox=None):
     res = 1.0
     sdata, _, _, _ = fetchScalingGrid(dbname, dts[0], bbox)
+    fetched = []
     for dt in [dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)]:
         try:
             data, lat, lon, t = fetch(dbname, dt, bbox)
             data *= sdata
-            datasets.ingest(dbname, table, data, lat, lon, res, t, False)
+            fetched.append((data, lat, lon, t))
         except:
             pass
+    datasets.ingestMany(dbname, table, fetched, res, False)
 
 
 def dates(dbname):
@@ -10,12 +10,14 @@ from the IRI FD Seasonal Forecast Tercile Probabilities.
 
 import datasets
 import dbio
+import climatology
 import netCDF4 as netcdf
 import os
-import random
-import string
+import sys
+import shutil
+import tempfile
 import numpy as np
-from datetime import date
+from datetime import date, timedelta
 from dateutil.relativedelta import relativedelta
 import logging
 
@@ -82,158 +84,95 @@ def download(dbname, dts, bbox=None):
                     os.remove(filename)
 
 
-def _getResampledTables(dbname, options, res):
-    """Find names of resampled raster tables."""
-    rtables = {}
+def _probabilities(dbname, dt):
+    """Retrieve the tercile probabilities (below, normal, above) of the first lead
+    time of the forecast for *dt*, as an array with dimensions (tercile, row,
+    column) along with the raster's upper-left corner and pixel size."""
     db = dbio.connect(dbname)
     cur = db.cursor()
-    for v in ['precip', 'tmax', 'tmin', 'wind']:
-        tname = options['vic'][v]
-        cur.execute(
-            "select * from raster_resampled where sname='{0}' and tname like '{1}%' and resolution={2}".format(v, tname, res))
-        rtables[v] = cur.fetchone()[1]
+    probs = []
+    georef = None
+    for tercile in ["below", "normal", "above"]:
+        cur.execute("select st_asbinary(st_union(rast)) from precip.iri where fdate=date'{0}' and tercile='{1}' and leadtime=1".format(dt.strftime("%Y-%m-%d"), tercile))
+        wkb = cur.fetchone()[0]
+        if wkb is None:
+            probs = None
+            break
+        data, georef = dbio.rasterFromWKB(str(wkb))
+        probs.append(data[0])
     cur.close()
     db.close()
-    return rtables
-
-
-def _deleteTableIfExists(dbname, sname, tname):
-    """Check if table exists and delete it."""
-    db = dbio.connect(dbname)
-    cur = db.cursor()
-    cur.execute(
-        "select * from information_schema.tables where table_schema='{0}' and table_name='{1}'".format(sname, tname))
-    if bool(cur.rowcount):
-        cur.execute("drop table {0}.{1}".format(sname, tname))
-        db.commit()
-    cur.close()
-    db.close()
-
-
-def _resampleClimatology(dbname, ptable, name, dt0):
-    """Resample finer scale climatology to IRI spatial resolution."""
-    tilesize = 10
-    res = 2.5
-    db = dbio.connect(dbname)
-    cur = db.cursor()
-    cur.execute(
-        "select * from pg_catalog.pg_class c inner join pg_catalog.pg_namespace n on c.relnamespace=n.oid where n.nspname='precip' and c.relname='{0}_iri'".format(ptable))
-    if not bool(cur.rowcount):
-        sql = "create table precip.{1}_iri as (with f as (select fdate,st_tile(st_rescale(rast,{0},'average'),{2},{2}) as rast from precip.{1}) select fdate,rast,dense_rank() over (order by st_upperleftx(rast),st_upperlefty(rast)) as rid from f)".format(
-            res, ptable, tilesize)
-        cur.execute(sql)
-        cur.execute(
-            "create index {0}_iri_r on precip.{0}_iri(rid)".format(ptable))
-        cur.execute(
-            "create index {0}_iri_t on precip.{0}_iri(fdate)".format(ptable))
-        db.commit()
-    _deleteTableIfExists(dbname, 'precip', "{0}_iri_xy".format(ptable))
-    sql = "create table precip.{0}_iri_xy as (select gid,st_worldtorastercoordx(rast,geom) as x,st_worldtorastercoordy(rast,geom) as y,rid as tile from precip.{0}_iri,{1}.basin where fdate=date'{2}-{3}-{4}' and st_intersects(rast,geom))".format(
-        ptable, name, dt0.year, dt0.month, dt0.day)
-    cur.execute(sql)
-    db.commit()
-    cur.execute(
-        "create index {0}_iri_xy_r on precip.{0}_iri_xy(tile)".format(ptable))
-    db.commit()
-    cur.close()
-    db.close()
-
-
-def _getForcings(e, dbname, ptable, rtables, name, dt0, dt1):
-    """Extract meteorological forcings for ensemble member."""
-    db = dbio.connect(dbname)
-    cur = db.cursor()
-    data = {}
-    for v in ['precip', 'tmax', 'tmin', 'wind']:
-        temptable = ''.join(random.SystemRandom().choice(
-            string.ascii_letters) for _ in range(8))
-        sql = "create table {7} as (with f as (select gid,st_worldtorastercoordx(rast,geom) as xf,st_worldtorastercoordy(rast,geom) as yf,rid as ftile from {6}.{0},{1}.basin where fdate=date'{2}-{3}-{4}' and st_intersects(rast,geom)) select c.gid,xf,yf,x,y,ftile as tile from f inner join precip.{5}_iri_xy as c on c.gid=f.gid)".format(
-            rtables[v], name, dt0.year, dt0.month, dt0.day, ptable, v, temptable)
-        cur.execute(sql)
-        db.commit()
-        cur.execute("create index {0}_r on {0}(tile)".format(temptable))
-        db.commit()
-        sql = "select gid,fdate,st_value(rast,xf,yf) from {6}.{0},{7} as xy inner join iri_years as i on xy.x=i.x and xy.y=i.y where ens={2} and rid=tile and fdate>=date(concat_ws('-',yr,'{3}-{4}')) and fdate<=(date(concat_ws('-',yr,'{3}-{4}'))+interval'{5} days') order by gid,fdate".format(
-            rtables[v], ptable, e + 1, dt0.month, dt0.day, (dt1 - dt0).days, v, temptable)
-        cur.execute(sql)
-        data[v] = cur.fetchall()
-        cur.execute("drop table {0}".format(temptable))
-        db.commit()
-    cur.close()
-    db.close()
-    return data
+    if probs is None:
+        return None, None
+    return np.ma.array(probs), georef
+
+
+def _sampleYears(psum, probs, nens):
+    """Sample a climatological year for each ensemble member and IRI pixel, with
+    *psum* being the seasonal precipitation of each pixel and year and *probs* the
+    tercile probabilities of each pixel. Years are ranked by their precipitation and
+    weighted by the probability of their tercile, while each member uses the same
+    random number for all pixels so that the sampled fields stay spatially coherent."""
+    npix, nyears = psum.shape
+    order = np.argsort(psum, axis=1)
+    tercile = np.minimum(np.arange(nyears) * 3 // nyears, 2)
+    weights = probs[:, tercile]
+    # pixels without a forecast sample the climatology uniformly
+    weights[~np.isfinite(weights).all(axis=1) | (weights.sum(axis=1) <= 0)] = 1.0
+    cum = np.cumsum(weights, axis=1)
+    cum /= cum[:, -1:]
+    s = np.random.random(nens)
+    k = np.minimum((cum[None, :, :] < s[:, None, None]).sum(axis=2), nyears - 1)
+    return order[np.arange(npix)[None, :], k]
 
 
 def generate(options, models):
-    """Generate meteorological forecast forcings by resampling fine-scale climatology."""
+    """Generate meteorological forecast forcings by resampling fine-scale climatology,
+    yielding each ensemble member once its forcings are written."""
     log = logging.getLogger(__name__)
-    options['vic']['tmax'] = options['vic']['temperature']
-    options['vic']['tmin'] = options['vic']['temperature']
     leadtime = 3
-    db = dbio.connect(models.dbname)
-    cur = db.cursor()
-    name = models.name
     dt0 = date(models.startyear, models.startmonth, models.startday)
     dt1 = date(models.endyear, models.endmonth, models.endday)
-    dtf = dt0 - relativedelta(months=1)  # forecast initialization date
-    months = [(dt0 + relativedelta(months=t)).month for t in range(leadtime)]
-    # check if forecast date exists in IRI data
-    sql = "select count(*) from precip.iri where fdate=date '{0}-{1}-{2}'".format(
-        dtf.year, dtf.month, dtf.day)
-    cur.execute(sql)
-    if bool(cur.rowcount):
-        ptable = options['vic']['precip']
-        # find resampled raster tables
-        rtables = _getResampledTables(models.dbname, options, models.res)
-        # resample climatology to IRI spatial resolution as a table
-        _resampleClimatology(models.dbname, ptable, name, dt0)
-        # calculate the annual accumulated precipitation using only the months
-        # within the forecast period
-        _deleteTableIfExists(models.dbname, 'public', 'iri_psum')
-        sql = "create table iri_psum as (with f as (select distinct x,y,tile from precip.{0}_iri_xy) select x,y,date_part('year',fdate) as yr,sum(st_value(rast,x,y)) as psum,row_number() over (partition by x,y) as rid from f,precip.{0}_iri where rid=tile and ({1}) group by x,y,yr order by x,y,psum)".format(
-            ptable, " or ".join(["date_part('month',fdate)={0}".format(m) for m in months]))
-        cur.execute(sql)
-        db.commit()
-        # retrieve probabilities from IRI seasonal forecast
-        _deleteTableIfExists(models.dbname, 'public', 'iri_probs')
-        sql = "create table iri_probs as (with f as (select x,y,st_pixelaspoint(rast,x,y) as geom from precip.{0}_iri_xy,precip.{0}_iri where rid=tile and fdate=date'{1}-{2}-{3}') select x,y,st_value(rast,geom) as prob,tercile,leadtime from f,precip.iri where fdate=date'{1}-{2}-{3}')".format(
-            ptable, dt0.year, dt0.month, dt0.day)
-            # ptable, dt0.year, dt0.month, dt0.day, dtf.year, dtf.month, dtf.day)
-        cur.execute(sql)
-        cur.execute("alter table iri_probs add column pg int")
-        for ti, t in enumerate(['below', 'normal', 'above']):
-            cur.execute(
-                "update iri_probs set pg={0} where tercile='{1}'".format(ti + 1, t))
-        db.commit()
-        # get number of years in climatology
-        cur.execute("select count(distinct(yr)) from iri_psum")
-        nyears = int(cur.fetchone()[0])
-        # assign probability weights to each year
-        # FIXME: It seems like the IRI NetCDFs have null values for lead times
-        # > 1 month. Just using lead time of 1 month for now
-        _deleteTableIfExists(models.dbname, 'public', 'iri_pw')
-        sql = "create table iri_pw as (with s as (select x,y,yr,psum,rid/({0}/3+1)+1 as pg from iri_psum) select s.x,s.y,s.yr,psum,1.0/{1}*prob/100.0 as weight from s inner join iri_probs as p on p.x=s.x and p.y=s.y and s.pg=p.pg where leadtime=1)".format(
-            nyears, nyears / 3.0)
-        cur.execute(sql)
-        db.commit()
-        # sample years based on probability weights
-        _deleteTableIfExists(models.dbname, 'public', 'iri_years')
-        sql = "create table iri_years as (with f as (select x,y,yr,sum(weight) over (partition by x,y order by psum) as w1, sum(weight) over (partition by x,y order by psum) - weight as w2 from iri_pw), r as (select n as ens,random() as s from generate_series(1,{0}) as x(n)) select x,y,yr,ens from f,r where s>=w2 and s<w1)".format(
-            models.nens)
-        cur.execute(sql)
-        db.commit()
-        # retrieve and write forcing data
-        for e in range(models.nens):
-            data = _getForcings(e, models.dbname, ptable,
-                                rtables, name, dt0, dt1)
-            models[e].writeForcings(data['precip'], data['tmax'], data[
-                                    'tmin'], data['wind'])
-    else:
+    ndays = (dt1 - dt0).days + 1
+    # FIXME: It seems like the IRI NetCDFs have null values for lead times
+    # > 1 month. Just using lead time of 1 month for now
+    probs, georef = _probabilities(models.dbname, dt0)
+    if probs is None:
         log.warning("IRI forecast was not issued for requested date {0}.".format(dt0))
-    # Clean-up temporary tables
-    cur.execute("drop table precip.{0}_iri_xy".format(ptable))
-    cur.execute("drop table iri_psum")
-    cur.execute("drop table iri_probs")
-    cur.execute("drop table iri_years")
-    cur.close()
-    db.close()
+        return
+    # all members are sliced from the climatology of the basin, using a temporary one if the
+    # shared climatology is turned off
+    directory = models.climatology
+    if directory is None:
+        directory = tempfile.mkdtemp()
+    clim = climatology.Climatology(models[0], options['vic'], directory)
+    clim.refresh()
+    years = [y for y in range(dt0.year - 100, dt0.year) if clim.covers(date(y, dt0.month, dt0.day), ndays)]
+    if len(years) < 1:
+        log.error("No climatology found to generate VIC forcings for IRI forecast. Exiting...")
+        sys.exit()
+    traces = [clim.trace(date(y, dt0.month, dt0.day), ndays) for y in years]
+    # IRI pixel of each basin cell
+    ulx, uly, scalex, scaley = georef
+    lat = np.array([models[0].gid[g][0] for g in clim.gids])
+    lon = np.array([models[0].gid[g][1] for g in clim.gids])
+    i = np.clip(((lat - uly) / scaley).astype(int), 0, probs.shape[1] - 1)
+    j = np.clip(((lon - ulx) / scalex).astype(int), 0, probs.shape[2] - 1)
+    pixels, cpix = np.unique(i * probs.shape[2] + j, return_inverse=True)
+    # seasonal precipitation of each pixel over the lead time months of the forecast
+    season = np.array([dt0 + timedelta(k) < dt0 + relativedelta(months=leadtime) for k in range(ndays)])
+    psum = np.array([[tr['precip'][season][:, cpix == p].mean() for tr in traces] for p in range(len(pixels))])
+    pprobs = probs.reshape((3, -1))[:, pixels].filled(np.nan).T / 100.0
+    sampled = _sampleYears(psum, pprobs, models.nens)
+    for e in range(models.nens):
+        # each cell takes the year sampled for its IRI pixel
+        cyears = sampled[e, cpix]
+        data = {}
+        for v in climatology.variables:
+            data[v] = np.zeros((ndays, len(clim.gids)), dtype="f4")
+            for y in np.unique(cyears):
+                data[v][:, cyears == y] = traces[y][v][:, cyears == y]
+        models[e].writeForcings(data['precip'], data['tmax'], data['tmin'], data['wind'])
+        yield e
+    if models.climatology is None:
+        shutil.rmtree(directory)
@@ -10,10 +10,9 @@ and wind speed from the MERRA Reanalysis.
 
 import netCDF4 as netcdf
 import numpy as np
-import os
 from datetime import timedelta
-import dbio
 import datasets
+import regrid
 import logging
 
 
@@ -24,7 +23,6 @@ def dates(dbname):
 
 def _downloadVariable(varname, dbname, dt, bbox):
     """Download specific variable from the MERRA Reanalysis dataset."""
-    # FIXME: Grid is not rectangular, but 0.5 x 0.625 degrees
     log = logging.getLogger(__name__)
     res = 0.5
     try:
@@ -51,19 +49,19 @@ def _downloadVariable(varname, dbname, dt, bbox):
             data = np.mean(hdata, axis=0)
         lat = np.sort(lat)[::-1][i1:i2]
         lon = np.sort(lon)[j1:j2]
-        filename = dbio.writeGeotif(lat, lon, res, data)
-        table = "{0}.merra".format(varname)
-        dbio.ingest(dbname, filename, dt, table)
-        log.info("Imported {0} in {1}".format(tt[ti].strftime("%Y-%m-%d"), table))
-        os.remove(filename)
+        # grid is not square, but 0.5 x 0.625 degrees
+        data, lat, lon = regrid.regular(data, lat, lon, res, "bilinear")
     except:
         log.warning("Cannot import MERRA dataset for {0}!".format(dt.strftime("%Y-%m-%d")))
+        data = lat = lon = None
+    return data, lat, lon, dt
 
 
 def download(dbname, dts, bbox=None):
     """Downloads MERRA Reanalysis data from the NASA data server,
     and imports them into the database *dbname*. Optionally uses a bounding box to
     limit the region with [minlon, minlat, maxlon, maxlat]."""
-    for dt in [dts[0] + timedelta(dti) for dti in range((dts[-1] - dts[0]).days + 1)]:
-        for varname in ["tmax", "tmin", "wind"]:
-            _downloadVariable(varname, dbname, dt, bbox)
+    res = 0.5
+    for varname in ["tmax", "tmin", "wind"]:
+        fetched = [_downloadVariable(varname, dbname, dt, bbox) for dt in [dts[0] + timedelta(dti) for dti in range((dts[-1] - dts[0]).days + 1)]]
+        datasets.ingestMany(dbname, "{0}.merra".format(varname), fetched, res)
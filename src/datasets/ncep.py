@@ -61,7 +61,6 @@ def download(dbname, dts, bbox=None):
     wnd = np.sqrt(uwnd**2 + vwnd**2)
     tmax -= 273.15
     tmin -= 273.15
-    for t, dt in enumerate([dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)]):
-        datasets.ingest(dbname, "tmax.ncep", tmax[t, :, :], lat, lon, res, dt)
-        datasets.ingest(dbname, "tmin.ncep", tmin[t, :, :], lat, lon, res, dt)
-        datasets.ingest(dbname, "wind.ncep", wnd[t, :, :], lat, lon, res, dt)
+    dts = [dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)]
+    for table, data in [("tmax.ncep", tmax), ("tmin.ncep", tmin), ("wind.ncep", wnd)]:
+        datasets.ingestMany(dbname, table, [(data[t, :, :], lat, lon, dt) for t, dt in enumerate(dts)], res)
@@ -130,69 +130,91 @@ def download(dbname, dts, bbox=None):
     shutil.rmtree(outpath)
 
 
-def _queryDataset(dbname, tablename, name, startyear, startmonth, startday, endyear, endmonth, endday, ens=None):
-    """Retrieve meteorological forcing dataset from database."""
+def _queryDataset(dbname, tablename, name, gids, startdate, enddate, ensemble=False):
+    """Retrieve meteorological forcing dataset from database for the cells *gids*, as an
+    array with dimensions (member, day, cell) that holds a single member unless the table
+    contains an *ensemble*."""
     temptable = ''.join(random.SystemRandom().choice(string.ascii_letters) for _ in range(8))
-    if ens is None:
-        sql = "create table {0}_xy as (select gid,st_worldtorastercoordx(rast,geom) as x,st_worldtorastercoordy(rast,geom) as y,rid as tile from {4},{5}.basin where fdate=date'{1}-{2}-{3}' and st_intersects(rast,geom))".format(temptable, startyear, startmonth, startday, tablename, name)
-    else:
-        sql = "create table {0}_xy as (select gid,st_worldtorastercoordx(rast,geom) as x,st_worldtorastercoordy(rast,geom) as y,rid as tile from {4},{5}.basin where fdate=date'{1}-{2}-{3}' and st_intersects(rast,geom) and ensemble={6})".format(temptable, startyear, startmonth, startday, tablename, name, ens)
     db = dbio.connect(dbname)
     cur = db.cursor()
+    # the pixel of each cell is the same for all members and dates, so it is found once and
+    # tiles are matched by their upper-left corner
+    members = "and ensemble=(select min(ensemble) from {0} where fdate=date'{1}')".format(tablename, startdate.strftime("%Y-%m-%d")) if ensemble else ""
+    sql = "create table {0}_xy as (select gid,st_worldtorastercoordx(rast,geom) as x,st_worldtorastercoordy(rast,geom) as y,st_upperleftx(rast) as ulx,st_upperlefty(rast) as uly from {1},{2}.basin where fdate=date'{3}' and st_intersects(rast,geom) {4})".format(temptable, tablename, name, startdate.strftime("%Y-%m-%d"), members)
     cur.execute(sql)
-    cur.execute("create index {0}_xy_r on {0}_xy(tile)".format(temptable))
     db.commit()
-    if ens is None:
-        sql = "select gid,fdate,st_nearestvalue(rast,x,y) from {0},{1}_xy where rid=tile and fdate>=date'{2}-{3}-{4}' and fdate<=date'{5}-{6}-{7}' order by gid,fdate".format(tablename, temptable, startyear, startmonth, startday, endyear, endmonth, endday)
-    else:
-        sql = "select gid,fdate,st_nearestvalue(rast,x,y) from {0},{1}_xy where rid=tile and fdate>=date'{2}-{3}-{4}' and fdate<=date'{5}-{6}-{7}' and ensemble={8} order by gid,fdate".format(tablename, temptable, startyear, startmonth, startday, endyear, endmonth, endday, ens)
+    sql = "select {0},gid,fdate,st_nearestvalue(rast,x,y) from {1},{2}_xy where fdate>=date'{3}' and fdate<=date'{4}' and st_upperleftx(rast)=ulx and st_upperlefty(rast)=uly order by {5}gid,fdate".format(
+        "ensemble" if ensemble else "1", tablename, temptable, startdate.strftime("%Y-%m-%d"), enddate.strftime("%Y-%m-%d"), "ensemble," if ensemble else "")
     cur.execute(sql)
-    data = [r for r in cur.fetchall()]
+    cells = set(gids)
+    rows = [r for r in cur.fetchall() if r[1] in cells]
     cur.execute("drop table {0}_xy".format(temptable))
     db.commit()
     cur.close()
     db.close()
+    ndays = (enddate - startdate).days + 1
+    ensembles = sorted(set(r[0] for r in rows))
+    data = np.zeros((len(ensembles), ndays, len(gids)), dtype="f4") + np.nan
+    if len(rows) > 0:
+        index = dict((g, i) for i, g in enumerate(gids))
+        e = np.searchsorted(ensembles, [r[0] for r in rows])
+        c = [index[r[1]] for r in rows]
+        t = [(r[2] - startdate.date()).days for r in rows]
+        data[e, t, c] = [np.nan if r[3] is None else r[3] for r in rows]
     return data
 
 
 def _getForcings(options, models, res):
-    """Retrieve meteorological forcings for ensemble."""
+    """Retrieve meteorological forcings for ensemble as arrays with dimensions (member,
+    day, cell), except for wind which is the same for all members."""
+    log = logging.getLogger(__name__)
     nens = len(models)
+    gids = list(models[0].gid.keys())
     db = dbio.connect(models.dbname)
     cur = db.cursor()
     rtables = dbio.getResampledTables(models.dbname, options, res)
     rsmp = rtables['precip'].split("_")[1]
-    prec = [None] * nens
-    tmax = [None] * nens
-    tmin = [None] * nens
-    temp = [None] * nens
-    for e in range(nens):
-        prec[e] = _queryDataset(models.dbname, "precip.nmme_{0}".format(rsmp), models.name, models.startyear, models.startmonth, models.startday, models.endyear, models.endmonth, models.endday, e+1)
-        temp[e] = _queryDataset(models.dbname, "tmax.nmme_{0}".format(rsmp), models.name, models.startyear, models.startmonth, models.startday, models.endyear, models.endmonth, models.endday, e+1)
+    dt0 = datetime(models.startyear, models.startmonth, models.startday)
+    dt1 = datetime(models.endyear, models.endmonth, models.endday)
+    prec = _queryDataset(models.dbname, "precip.nmme_{0}".format(rsmp), models.name, gids, dt0, dt1, True)
+    temp = _queryDataset(models.dbname, "tmax.nmme_{0}".format(rsmp), models.name, gids, dt0, dt1, True)
+    if prec.shape[0] < nens or temp.shape[0] < nens:
+        log.error("NMME forecast only has {0} ensemble members. Exiting...".format(min(prec.shape[0], temp.shape[0])))
+        sys.exit()
     sql = "select distinct(date_part('year',fdate)) from tmax.{0}".format(rtables['tmax'])
     cur.execute(sql)
     years = [r[0] for r in cur.fetchall()]
+    cur.close()
+    db.close()
     if len(years) > 2:
         years.remove(min(years))
         years.remove(max(years))
     if len(years) > 0:
-        ndays = (datetime(models.endyear, models.endmonth, models.endday) - datetime(models.startyear, models.startmonth, models.startday)).days
+        ndays = (dt1 - dt0).days
         yr = int(np.random.choice(years))
         t0 = datetime(yr, models.startmonth, models.startday)
         t1 = t0 + timedelta(ndays)
-        vtmax = _queryDataset(models.dbname, "tmax.{0}".format(rtables['tmax']), models.name, t0.year, t0.month, t0.day, t1.year, t1.month, t1.day)
-        vtmin = _queryDataset(models.dbname, "tmin.{0}".format(rtables['tmin']), models.name, t0.year, t0.month, t0.day, t1.year, t1.month, t1.day)
-        wind = _queryDataset(models.dbname, "wind.{0}".format(rtables['wind']), models.name, t0.year, t0.month, t0.day, t1.year, t1.month, t1.day)
-        for e in range(nens):
-            tmax[e] = [(vtmax[i][0], vtmax[i][1], temp[e][i][2] + 0.5 * (vtmax[i][2] - vtmin[i][2])) for i in range(len(vtmax))]
-            tmin[e] = [(vtmin[i][0], vtmin[i][1], temp[e][i][2] - 0.5 * (vtmax[i][2] - vtmin[i][2])) for i in range(len(vtmin))]
+        clim = models._climatology(options['vic'])
+        if clim is not None and clim.covers(t0.date(), ndays + 1):
+            data = clim.trace(t0.date(), ndays + 1)
+            vtmax, vtmin, wind = data['tmax'], data['tmin'], data['wind']
+        else:
+            vtmax = _queryDataset(models.dbname, "tmax.{0}".format(rtables['tmax']), models.name, gids, t0, t1)[0]
+            vtmin = _queryDataset(models.dbname, "tmin.{0}".format(rtables['tmin']), models.name, gids, t0, t1)[0]
+            wind = _queryDataset(models.dbname, "wind.{0}".format(rtables['wind']), models.name, gids, t0, t1)[0]
+        # NMME mean temperature with the diurnal temperature range of the climatological year
+        dtr = 0.5 * (vtmax - vtmin)
+        tmax = temp[:nens] + dtr
+        tmin = temp[:nens] - dtr
+        prec = prec[:nens]
     else:
         prec = tmax = tmin = wind = None
     return prec, tmax, tmin, wind
 
 
 def generate(options, models):
-    """Generate meteorological forecast forcings from downscaled NMME data."""
+    """Generate meteorological forecast forcings from downscaled NMME data, yielding
+    each ensemble member once its forcings are written."""
     log = logging.getLogger(__name__)
     options['vic']['tmax'] = options['vic']['temperature']
     options['vic']['tmin'] = options['vic']['temperature']
@@ -212,6 +234,7 @@ def generate(options, models):
         else:
             for e in range(len(models)):
                 models[e].writeForcings(prec[e], tmax[e], tmin[e], wind)
+                yield e
     else:
         log.error("Not enough data found for requested forecast period! Exiting...")
         sys.exit()
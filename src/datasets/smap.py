@@ -10,7 +10,7 @@
 from soilmoist import Soilmoist
 import h5py
 import numpy as np
-import dbio
+import regrid
 import datasets
 from datetime import timedelta
 import logging
@@ -36,6 +36,7 @@ def download(dbname, dts, bbox=None, enhanced=False):
     else:
         res = 0.36
         url = "https://n5eil01u.ecs.nsidc.org/DP4/SMAP/SPL3SMP.004"
+    fetched = []
     for dt in [dts[0] + timedelta(tt) for tt in range((dts[-1] - dts[0]).days + 1)]:
         try:
             outpath, fname = earthdata.download("{0}/{1}".format(url, dt.strftime("%Y.%m.%d")), "SMAP_L3_SM_P_\S*.h5")
@@ -48,7 +49,6 @@ def download(dbname, dts, bbox=None, enhanced=False):
             lat = f[varname]['latitude'][:, 0]
             lon = f[varname]['longitude'][0, :]
             lon[lon > 180] -= 360.0
-            # FIXME: Need to add reprojection from EASE grid
             i1, i2, j1, j2 = datasets.spatialSubset(np.sort(lat)[::-1], np.sort(lon), res, bbox)
             lati = np.argsort(lat)[::-1][i1:i2]
             loni = np.argsort(lon)[j1:j2]
@@ -60,10 +60,12 @@ def download(dbname, dts, bbox=None, enhanced=False):
             # sme = f[varname]['soil_moisture_error'][i1:i2, j1:j2]
             lat = np.sort(lat)[::-1][i1:i2]
             lon = np.sort(lon)[j1:j2]
-            filename = dbio.writeGeotif(lat, lon, res, sm)
-            dbio.ingest(dbname, filename, dt, table, False)
+            # latitudes of the EASE grid are not equally spaced
+            sm, lat, lon = regrid.regular(np.ma.masked_equal(sm, -9999.0), lat, lon, res, "nearest")
+            fetched.append((sm, lat, lon, dt))
         except:
             log.warning("No SMAP data available for {0}.".format(dt.strftime("%Y-%m-%d")))
+    datasets.ingestMany(dbname, table, fetched, res, False)
 
 
 class Smap(Soilmoist):
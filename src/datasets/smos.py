@@ -8,10 +8,8 @@
 """
 
 from soilmoist import Soilmoist
-import dbio
-import os
+import regrid
 import netCDF4 as netcdf
-from scipy.spatial import KDTree
 import numpy as np
 from datetime import datetime, timedelta
 import datasets
@@ -26,18 +24,6 @@ def dates(dbname):
     return dts
 
 
-def regridNearestNeighbor(lat, lon, res):
-    """Generate grid of nearest neighbor locations from *lat*, *lon*
-    arrays for specified resolution *res*."""
-    x, y = np.meshgrid(lon, lat)
-    tree = KDTree(zip(x.ravel(), y.ravel()))
-    grid_lat = np.arange(round(lat[0], 1), round(lat[-1], 1)-res, -res)
-    grid_lon = np.arange(round(lon[0], 1), round(lon[-1], 1)+res, res)
-    grid_x, grid_y = np.meshgrid(grid_lon, grid_lat)
-    _, pos = tree.query(zip(grid_x.ravel(), grid_y.ravel()))
-    return pos, grid_lat, grid_lon
-
-
 def download(dbname, dt, bbox=None):
     """Downloads SMOS soil mositure data for a set of dates *dt*
     and imports them into the PostGIS database *dbname*. Optionally
@@ -68,13 +54,9 @@ def download(dbname, dt, bbox=None):
     sm = sm[:, ::-1, :]  # flip latitude dimension in data array
     # FIXME: Use spatially variable observation error
     # smv = f.variables['VARIANCE_SM'][ti, i1:i2, j1:j2][:, ::-1, :]
-    pos, smlat, smlon = regridNearestNeighbor(lat, lon, res)
-    for tj in range(sm.shape[0]):
-        smdata = sm[tj, :, :].ravel()[pos].reshape((len(smlat), len(smlon)))
-        filename = dbio.writeGeotif(smlat, smlon, res, smdata)
-        t = t0 + timedelta(ti[tj])
-        dbio.ingest(dbname, filename, t, table, False)
-        os.remove(filename)
+    smdata, smlat, smlon = regrid.regular(sm, lat, lon, res, "nearest")
+    fetched = [(smdata[tj, :, :], smlat, smlon, t0 + timedelta(ti[tj])) for tj in range(sm.shape[0])]
+    datasets.ingestMany(dbname, table, fetched, res, False)
 
 
 class Smos(Soilmoist):
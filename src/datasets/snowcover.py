@@ -26,8 +26,13 @@ class Snowcover(object):
         db = dbio.connect(models.dbname)
         cur = db.cursor()
         for s in self.statevar:
-            sql = "select ensemble,st_x(geom),st_y(geom),val from (select ensemble,(ST_PixelAsCentroids(rast)).* from {0}.{1} where fdate=date '{2}-{3}-{4}') foo group by ensemble,geom order by ensemble".format(
-                models.name, s, dt.year, dt.month, dt.day)
+            if dbio.columnExists(models.dbname, models.name, s, "ensemble"):
+                sql = "select ensemble,st_x(geom),st_y(geom),val from (select ensemble,(ST_PixelAsCentroids(rast)).* from {0}.{1} where fdate=date '{2}-{3}-{4}') foo group by ensemble,geom order by ensemble".format(
+                    models.name, s, dt.year, dt.month, dt.day)
+            else:
+                # ensemble members are stored as the bands of each raster
+                sql = "select band,st_x(geom),st_y(geom),val from (select band,(ST_PixelAsCentroids(rast,band)).* from {0}.{1},generate_series(1,st_numbands(rast)) as band where fdate=date '{2}-{3}-{4}') foo order by band".format(
+                    models.name, s, dt.year, dt.month, dt.day)
             cur.execute(sql)
             e, lon, lat, vals = zip(*cur.fetchall())
             gid = [models[0].lgid[(l[0], l[1])] for l in zip(lat, lon)]
@@ -26,8 +26,13 @@ class Soilmoist(object):
         db = dbio.connect(models.dbname)
         cur = db.cursor()
         for s in self.statevar:
-            sql = "select ensemble,st_x(geom),st_y(geom),sum(val) from (select ensemble,layer,(ST_PixelAsCentroids(rast)).* from {0}.{1} where fdate=date '{2}-{3}-{4}') foo group by ensemble,geom order by ensemble".format(
-                models.name, s, dt.year, dt.month, dt.day)
+            if dbio.columnExists(models.dbname, models.name, s, "ensemble"):
+                sql = "select ensemble,st_x(geom),st_y(geom),sum(val) from (select ensemble,layer,(ST_PixelAsCentroids(rast)).* from {0}.{1} where fdate=date '{2}-{3}-{4}') foo group by ensemble,geom order by ensemble".format(
+                    models.name, s, dt.year, dt.month, dt.day)
+            else:
+                # ensemble members are stored as the bands of each raster
+                sql = "select band,st_x(geom),st_y(geom),sum(val) from (select band,layer,(ST_PixelAsCentroids(rast,band)).* from {0}.{1},generate_series(1,st_numbands(rast)) as band where fdate=date '{2}-{3}-{4}') foo group by band,geom order by band".format(
+                    models.name, s, dt.year, dt.month, dt.day)
             cur.execute(sql)
             e, lon, lat, vals = zip(*cur.fetchall())
             gid = [models[0].lgid[(l[0], l[1])] for l in zip(lat, lon)]
@@ -63,8 +68,13 @@ class Soilmoist(object):
         """Retrieve observed variable from database and resample to observation resolution."""
         db = dbio.connect(models.dbname)
         cur = db.cursor()
-        sql = "with f as (select st_union(st_clip(rast,geom)) as rast from {0},{1}.basin where st_intersects(rast,geom) and fdate=date '{2}-{3}-{4}') select ensemble,st_x(geom),st_y(geom),val from (select ensemble,(st_pixelascentroids(st_resample(b.rast,f.rast,'average'))).* from f,{1}.{5} as b where layer=1 and fdate=date '{2}-{3}-{4}') foo order by ensemble".format(
-            self.tablename, models.name, dt.year, dt.month, dt.day, self.obsvar)
+        if dbio.columnExists(models.dbname, models.name, self.obsvar, "ensemble"):
+            sql = "with f as (select st_union(st_clip(rast,geom)) as rast from {0},{1}.basin where st_intersects(rast,geom) and fdate=date '{2}-{3}-{4}') select ensemble,st_x(geom),st_y(geom),val from (select ensemble,(st_pixelascentroids(st_resample(b.rast,f.rast,'average'))).* from f,{1}.{5} as b where layer=1 and fdate=date '{2}-{3}-{4}') foo order by ensemble".format(
+                self.tablename, models.name, dt.year, dt.month, dt.day, self.obsvar)
+        else:
+            # resample all ensemble members at once when they are stored as bands
+            sql = "with f as (select st_union(st_clip(rast,geom)) as rast from {0},{1}.basin where st_intersects(rast,geom) and fdate=date '{2}-{3}-{4}'), r as (select st_resample(b.rast,f.rast,'average') as rast from f,{1}.{5} as b where layer=1 and fdate=date '{2}-{3}-{4}') select band,st_x(geom),st_y(geom),val from (select band,(st_pixelascentroids(r.rast,band)).* from r,generate_series(1,st_numbands(r.rast)) as band) foo order by band".format(
+                self.tablename, models.name, dt.year, dt.month, dt.day, self.obsvar)
         cur.execute(sql)
         e, lon, lat, data = zip(*cur.fetchall())
         nens = max(e)
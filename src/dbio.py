@@ -9,13 +9,17 @@
 
 import numpy as np
 import tempfile
+import struct
+import binascii
+from StringIO import StringIO
 from osgeo import gdal, osr
-import subprocess
-import random
 import psycopg2 as pg
-import string
 import rpath
+import regrid
 import sys
+import re
+from datetime import date, timedelta
+from dateutil.relativedelta import relativedelta
 import logging
 
 
@@ -104,6 +108,90 @@ def writeGeotif(lat, lon, res, data, filename=None):
     return filename
 
 
+def rasterToWKB(data, ulx, uly, res, nodata, srid=4326):
+    """Encodes *data* array with shape (nrows, ncols) or (nbands, nrows, ncols)
+    into the well-known binary representation of a PostGIS raster with 32-bit
+    floating point pixels, whose upper-left corner is at (*ulx*, *uly*)."""
+    if data.ndim < 3:
+        data = data[np.newaxis, :, :]
+    nbands, nrows, ncols = data.shape
+    # little-endian, version, bands, scale, upper-left corner, skew, srid, width, height
+    wkb = [struct.pack("<BHHddddddiHH", 1, 0, nbands, res, -res, ulx, uly, 0.0, 0.0, srid, ncols, nrows)]
+    for b in range(nbands):
+        # pixel type 10 is 32-bit float and flag 64 indicates a nodata value
+        wkb.append(struct.pack("<Bf", 10 | 64, nodata))
+        wkb.append(np.ascontiguousarray(data[b], dtype="<f4").tostring())
+    return "".join(wkb)
+
+
+def rasterFromWKB(wkb):
+    """Decodes the well-known binary representation of a PostGIS raster into a
+    masked array with shape (nbands, nrows, ncols) and the raster's upper-left
+    corner and pixel size."""
+    endian = "<" if struct.unpack("B", wkb[0])[0] == 1 else ">"
+    _, _, nbands, scalex, scaley, ulx, uly, _, _, _, ncols, nrows = struct.unpack(endian + "BHHddddddiHH", wkb[:61])
+    # numpy types of the PostGIS pixel types, with sub-byte types stored as bytes
+    pixtypes = {0: "u1", 1: "u1", 2: "u1", 3: "i1", 4: "u1", 5: "i2", 6: "u2", 7: "i4", 8: "u4", 10: "f4", 11: "f8"}
+    data = np.ma.zeros((nbands, nrows, ncols))
+    offset = 61
+    for b in range(nbands):
+        flags = struct.unpack("B", wkb[offset])[0]
+        dtype = np.dtype(endian + pixtypes[flags & 15])
+        nodata = np.frombuffer(wkb, dtype=dtype, count=1, offset=offset + 1)[0]
+        offset += 1 + dtype.itemsize
+        band = np.frombuffer(wkb, dtype=dtype, count=nrows * ncols, offset=offset).reshape((nrows, ncols))
+        offset += dtype.itemsize * nrows * ncols
+        if flags & 64:
+            data[b] = np.ma.masked_equal(band, nodata)
+        else:
+            data[b] = band
+    return data, (ulx, uly, scalex, scaley)
+
+
+def tiles(nrows, ncols, ulx, uly, res, tilesize=None):
+    """Returns the tile identifier, array slices and upper-left corner of each
+    tile that a raster with *nrows* and *ncols* is split into."""
+    if tilesize is None:
+        tilesize = (ncols, nrows)
+    out = []
+    for i in range(0, nrows, tilesize[1]):
+        for j in range(0, ncols, tilesize[0]):
+            out.append((len(out) + 1, (slice(i, i + tilesize[1]), slice(j, j + tilesize[0])),
+                        ulx + j * res, uly - i * res))
+    return out
+
+
+def resampledTiles(nrows, ncols, ulx, uly, res, srcres, tilesize=(10, 10)):
+    """Returns the tiles of a raster resampled to *res* from a raster of resolution
+    *srcres*, following the tables created with :func:`resampleRaster`: each tile
+    covers *tilesize* cells of the source raster, and tiles are numbered by their
+    upper-left corner in order of longitude and then latitude."""
+    tsize = tuple(max(int(round(t * srcres / res)), 1) for t in tilesize)
+    out = tiles(nrows, ncols, ulx, uly, res, tsize)
+    ranks = dict((t[0], r + 1) for r, t in enumerate(sorted(out, key=lambda t: (t[2], t[3]))))
+    return [(ranks[t[0]],) + t[1:] for t in out]
+
+
+def copyRasters(cur, tablename, columns, records, chunksize=500):
+    """Loads *records* of (column values, raster WKB) into *tablename* by streaming
+    them through COPY, with each raster encoded as hex WKB."""
+    sql = "copy {0} ({1}) from stdin".format(tablename, ",".join(columns + ["rast"]))
+    buf = StringIO()
+    n = 0
+    for values, wkb in records:
+        buf.write("\t".join([str(v) for v in values] + [binascii.hexlify(wkb)]))
+        buf.write("\n")
+        n += 1
+        if n % chunksize == 0:
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            buf = StringIO()
+    if n % chunksize > 0:
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+    return n
+
+
 def deleteRasters(dbname, tablename, dt, squery=""):
     """If date already exists delete associated rasters before
     ingesting, and optionally constrain with subquery."""
@@ -120,6 +208,214 @@ def deleteRasters(dbname, tablename, dt, squery=""):
     db.close()
 
 
+def partitionRanges(startdate, enddate, interval="year"):
+    """Returns the name suffix and date bounds of the yearly or monthly
+    partitions that cover the period from *startdate* to *enddate*."""
+    if interval == "month":
+        t = date(startdate.year, startdate.month, 1)
+        step = relativedelta(months=1)
+        fmt = "%Y%m"
+    else:
+        t = date(startdate.year, 1, 1)
+        step = relativedelta(years=1)
+        fmt = "%Y"
+    ranges = []
+    while t <= date(enddate.year, enddate.month, enddate.day):
+        ranges.append((t.strftime(fmt), t, t + step))
+        t += step
+    return ranges
+
+
+_serverVersions = {}
+
+
+def serverVersion(cur):
+    """Returns the version number of the database server (e.g. 90503 for 9.5.3),
+    which is only queried once per database."""
+    dsn = cur.connection.dsn
+    if dsn not in _serverVersions:
+        cur.execute("show server_version_num")
+        _serverVersions[dsn] = int(cur.fetchone()[0])
+    return _serverVersions[dsn]
+
+
+def supportsPartitions(cur):
+    """Check if the database server supports partitioned tables (PostgreSQL 10 or later)."""
+    return serverVersion(cur) >= 100000
+
+
+def _partitions(cur, schemaname, tablename):
+    """Returns name and date bounds of the existing partitions of a table."""
+    if not supportsPartitions(cur):
+        return []
+    sql = "select c.relname,pg_get_expr(c.relpartbound,c.oid) from pg_inherits as i inner join pg_class as c on c.oid=i.inhrelid inner join pg_class as p on p.oid=i.inhparent inner join pg_namespace as n on n.oid=p.relnamespace where n.nspname='{0}' and p.relname='{1}'".format(schemaname, tablename)
+    cur.execute(sql)
+    partitions = []
+    for pname, bounds in cur.fetchall():
+        dts = re.findall("'([0-9]+-[0-9]+-[0-9]+)'", bounds)
+        if len(dts) == 2:
+            lower, upper = [date(*map(int, dt.split("-"))) for dt in dts]
+            partitions.append((pname, lower, upper))
+    return partitions
+
+
+def isPartitioned(cur, schemaname, tablename):
+    """Check if table is partitioned."""
+    if not supportsPartitions(cur):
+        return False
+    cur.execute("select * from pg_partitioned_table as p inner join pg_class as c on c.oid=p.partrelid inner join pg_namespace as n on n.oid=c.relnamespace where n.nspname='{0}' and c.relname='{1}'".format(schemaname, tablename))
+    return bool(cur.rowcount)
+
+
+def createPartitions(cur, schemaname, tablename, startdate, enddate, interval="year"):
+    """Create the partitions of table that are needed to hold rasters from
+    *startdate* to *enddate*, if the table is partitioned. Tables that already
+    have partitions keep the interval of their existing partitions."""
+    if isPartitioned(cur, schemaname, tablename):
+        partitions = _partitions(cur, schemaname, tablename)
+        if len(partitions) > 0:
+            interval = "month" if any((upper - lower).days < 32 for _, lower, upper in partitions) else "year"
+        existing = [p[0] for p in partitions]
+        for suffix, lower, upper in partitionRanges(startdate, enddate, interval):
+            pname = "{0}_{1}".format(tablename, suffix)
+            if pname not in existing:
+                cur.execute("create table {0}.{1} partition of {0}.{2} for values from ('{3}') to ('{4}')".format(
+                    schemaname, pname, tablename, lower.strftime("%Y-%m-%d"), upper.strftime("%Y-%m-%d")))
+
+
+def deleteRasterRange(cur, schemaname, tablename, startdate, enddate):
+    """Delete rasters between *startdate* and *enddate* with a single ranged
+    delete, after truncating any partitions that lie entirely inside the range."""
+    log = logging.getLogger(__name__)
+    t0 = date(startdate.year, startdate.month, startdate.day)
+    t1 = date(enddate.year, enddate.month, enddate.day)
+    for pname, lower, upper in _partitions(cur, schemaname, tablename):
+        if lower >= t0 and upper - timedelta(1) <= t1:
+            cur.execute("truncate {0}.{1}".format(schemaname, pname))
+    cur.execute("delete from {0}.{1} where fdate>=date'{2}' and fdate<=date'{3}'".format(
+        schemaname, tablename, t0.strftime("%Y-%m-%d"), t1.strftime("%Y-%m-%d")))
+    log.info("Overwriting rasters in {0}.{1} from {2} to {3}".format(schemaname, tablename, t0.strftime("%Y-%m-%d"), t1.strftime("%Y-%m-%d")))
+
+
+def _indexedTables(cur, schemaname, tablename):
+    """Returns the tables that hold the indexes of a raster table, which are the
+    partitions of a partitioned table on PostgreSQL 10 as it cannot index the
+    partitioned table itself."""
+    if serverVersion(cur) < 110000 and isPartitioned(cur, schemaname, tablename):
+        return [p[0] for p in _partitions(cur, schemaname, tablename)]
+    return [tablename]
+
+
+def createIndex(cur, schemaname, indexname, definition):
+    """Create index *indexname* with *definition* (e.g. "on schema.table(fdate)")
+    if it does not exist."""
+    cur.execute("select * from pg_indexes where schemaname='{0}' and indexname='{1}'".format(schemaname, indexname))
+    if not bool(cur.rowcount):
+        cur.execute("create index {0} {1}".format(indexname, definition))
+
+
+def dropRasterIndexes(cur, schemaname, tablename):
+    """Drop the date and spatial indexes of a raster table."""
+    for table in _indexedTables(cur, schemaname, tablename):
+        cur.execute("drop index if exists {0}.{1}_dtidx".format(schemaname, table))
+        cur.execute("drop index if exists {0}.{1}_spidx".format(schemaname, table))
+
+
+def createRasterIndexes(cur, schemaname, tablename):
+    """Create the date and spatial indexes of a raster table if they do not exist."""
+    for table in _indexedTables(cur, schemaname, tablename):
+        createIndex(cur, schemaname, "{0}_dtidx".format(table), "on {0}.{1}(fdate)".format(schemaname, table))
+        createIndex(cur, schemaname, "{0}_spidx".format(table), "on {0}.{1} using gist(st_convexhull(rast))".format(schemaname, table))
+
+
+class BulkWrite:
+    """Session for loading many rasters into output tables. The indexes of each
+    table are dropped before its first load and rebuilt once, followed by
+    an analysis of the table, when the session is committed."""
+
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.tables = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.commit()
+        return False
+
+    def add(self, cur, schemaname, tablename):
+        """Register table that is about to be loaded within the session."""
+        if (schemaname, tablename) not in self.tables:
+            dropRasterIndexes(cur, schemaname, tablename)
+            self.tables.append((schemaname, tablename))
+
+    def commit(self):
+        """Rebuild indexes and update the planner statistics of loaded tables."""
+        log = logging.getLogger(__name__)
+        db = connect(self.dbname)
+        cur = db.cursor()
+        for schemaname, tablename in self.tables:
+            createRasterIndexes(cur, schemaname, tablename)
+            db.commit()
+            cur.execute("analyze {0}.{1}".format(schemaname, tablename))
+            db.commit()
+            log.debug("Rebuilt indexes of {0}.{1}".format(schemaname, tablename))
+        self.tables = []
+        cur.close()
+        db.close()
+
+
+def stackedTable(tablename):
+    """Returns the name of the table holding the time-stacked rasters of *tablename*."""
+    return "stack_{0}".format(tablename)
+
+
+def stackRasters(dbname, schemaname, tablename, startdate, enddate, interval="year"):
+    """Pack the daily rasters of a table into multi-band rasters that hold each
+    tile for a block of consecutive days, with the date of each band kept in
+    an array column. Only the blocks between *startdate* and *enddate* that are
+    complete (i.e. the table holds a later date) and missing or out of date are
+    rebuilt, so that the block of the current year is not repacked after every
+    daily ingest."""
+    log = logging.getLogger(__name__)
+    stname = stackedTable(tablename)
+    db = connect(dbname)
+    cur = db.cursor()
+    if not tableExists(dbname, schemaname, stname):
+        cur.execute("create table {0}.{1} (rid int not null, fdate date not null, dates date[] not null, rast raster)".format(schemaname, stname))
+        cur.execute("create index {1}_r on {0}.{1}(rid,fdate)".format(schemaname, stname))
+        # view with a row per tile and date, that also serves as the date to band lookup
+        cur.execute("create view {0}.{1}_days as (select rid,d.fdate,d.band::int as band,st_band(rast,d.band::int) as rast from {0}.{1},unnest(dates) with ordinality as d(fdate,band))".format(schemaname, stname))
+        db.commit()
+    cur.execute("select max(fdate) from {0}.{1}".format(schemaname, tablename))
+    latest = cur.fetchone()[0]
+    for _, lower, upper in partitionRanges(startdate, enddate, interval):
+        if latest is None or latest < upper - timedelta(1):
+            continue
+        t0, t1 = lower.strftime("%Y-%m-%d"), upper.strftime("%Y-%m-%d")
+        cur.execute("select count(distinct fdate) from {0}.{1} where fdate>=date'{2}' and fdate<date'{3}'".format(schemaname, tablename, t0, t1))
+        ndays = cur.fetchone()[0]
+        cur.execute("select coalesce(max(array_length(dates,1)),0) from {0}.{1} where fdate=date'{2}'".format(schemaname, stname, t0))
+        if ndays > 0 and cur.fetchone()[0] != ndays:
+            cur.execute("delete from {0}.{1} where fdate=date'{2}'".format(schemaname, stname, t0))
+            cur.execute("insert into {0}.{1} (rid,fdate,dates,rast) select rid,date'{3}',array_agg(fdate order by fdate),st_addband(null::raster,array_agg(rast order by fdate)) from {0}.{2} where fdate>=date'{3}' and fdate<date'{4}' group by rid".format(
+                schemaname, stname, tablename, t0, t1))
+            db.commit()
+            log.info("Stacked {0} days of {1}.{2} starting on {3}".format(ndays, schemaname, tablename, t0))
+    cur.close()
+    db.close()
+
+
+def _unstackRasters(cur, schemaname, tablename, dt):
+    """Remove the stacked block that contains date *dt*, so that it is rebuilt
+    from the daily rasters when they are next stacked."""
+    cur.execute("select * from information_schema.tables where table_schema='{0}' and table_name='{1}'".format(schemaname, stackedTable(tablename)))
+    if bool(cur.rowcount):
+        cur.execute("delete from {0}.{1} where fdate<=date'{2}' and dates @> array[date'{2}']".format(
+            schemaname, stackedTable(tablename), dt.strftime("%Y-%m-%d")))
+
+
 def _getResamplingMethod(dbname, tablename, res):
     """Return a raster resampling method based on the resolution of the model and the requested datasets."""
     db = connect(dbname)
@@ -204,6 +500,7 @@ def resampleRaster(dbname, sname, tname, dt, res, method, tilesize, overwrite, s
         # check if date already exists and delete it before ingesting
         if overwrite:
             deleteRasters(dbname, "{0}.{1}_{2}".format(sname, tname, int(1.0 / res)), dt, squery)
+            _unstackRasters(cur, sname, "{0}_{1}".format(tname, int(1.0 / res)), dt)
         sql = "insert into {0}.{1}_{2} (with dt as (select max(fdate) as maxdate from {0}.{1}_{2}), f as (select fdate,st_rescale(st_tile(rast,{5},{6}),{3},'{4}') as rast from {0}.{1} where fdate=date'{7}' {8}) select fdate,rast,dense_rank() over (order by st_upperleftx(rast),st_upperlefty(rast)) as rid from f)".format(sname, tname, int(1.0 / res), res, method, tilesize[0], tilesize[1], dt.strftime("%Y-%m-%d"), squery)
         cur.execute(sql)
     else:
@@ -235,44 +532,120 @@ def createResampledTables(dbname, sname, tname, dt, tilesize, overwrite, squery=
     db.close()
 
 
-def ingest(dbname, filename, dt, stname, resample=True, overwrite=True):
-    """Imports Geotif *filename* into database *db*."""
+def _deleteDates(cur, schemaname, tablename, dts):
+    """Delete the rasters of sorted dates *dts* with a single delete, ranged if the dates
+    are contiguous."""
+    if len(set(dts)) == (dts[-1] - dts[0]).days + 1:
+        deleteRasterRange(cur, schemaname, tablename, dts[0], dts[-1])
+    else:
+        cur.execute("delete from {0}.{1} where fdate in ({2})".format(schemaname, tablename, ",".join("date'{0}'".format(dt.strftime("%Y-%m-%d")) for dt in dts)))
+
+
+def _northUp(data, geotransform, nodata):
+    """Returns array with rows from north to south and missing values set to *nodata*,
+    along with its upper-left corner and pixel size."""
+    ulx, res, _, uly, _, yres = geotransform
+    if np.ma.isMaskedArray(data):
+        data = data.filled(nodata)
+    data = np.where(np.isnan(data), nodata, data)
+    if yres > 0:
+        data = data[..., ::-1, :]
+        uly += yres * data.shape[-2]
+    return data, ulx, uly, res
+
+
+def resampleArrays(dbname, schemaname, tablename, items, overwrite, nodata=-9999.):
+    """Regrid the arrays of *items* of (date, array, geotransform) to each resolution
+    available to VIC with precomputed sparse weights, and load them as tiles into the
+    resampled tables of *tablename*."""
     log = logging.getLogger(__name__)
     tilesize = (10, 10)
+    createResampledCatalog(dbname)
     db = connect(dbname)
     cur = db.cursor()
-    # import temporary table
-    temptable = ''.join(random.SystemRandom().choice(
-        string.ascii_letters) for _ in range(8))
-    cmd = "{3}/raster2pgsql -d -s 4326 {0} {2} | {3}/psql -d {1}".format(filename, dbname, temptable, rpath.bins)
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    out, err = proc.communicate()
-    log.debug(out)
-    cur.execute("alter table {0} add column fdate date".format(temptable))
-    cur.execute(
-        "update {3} set fdate = date '{0}-{1}-{2}'".format(dt.year, dt.month, dt.day, temptable))
-    # check if table exists
-    schemaname, tablename = stname.split(".")
-    if not schemaExists(dbname, schemaname):
-        cur.execute("create schema {0}".format(schemaname))
+    cur.execute("select distinct(resolution) from vic.soils")
+    resolutions = [r[0] for r in cur.fetchall()]
+    if len(resolutions) > 0:
+        dts = [item[0] for item in items]
+        rtables = dict((res, "{0}_{1}".format(tablename, int(1.0 / res))) for res in resolutions)
+        for res in resolutions:
+            rtable = rtables[res]
+            cur.execute("create table if not exists {0}.{1} (fdate date, rast raster, rid bigint)".format(schemaname, rtable))
+            createIndex(cur, schemaname, "{0}_t".format(rtable), "on {0}.{1}(fdate)".format(schemaname, rtable))
+            createIndex(cur, schemaname, "{0}_r".format(rtable), "on {0}.{1}(rid)".format(schemaname, rtable))
+            if overwrite:
+                _deleteDates(cur, schemaname, rtable, dts)
+                for dt in dts:
+                    _unstackRasters(cur, schemaname, rtable, dt)
+        regridders = {}
+        for dt, data, geotransform in items:
+            data, ulx, uly, res = _northUp(data, geotransform, nodata)
+            data = np.ma.masked_equal(data, nodata)
+            key = (ulx, uly, res) + data.shape[-2:]
+            if key not in regridders:
+                lat = uly - res * (np.arange(data.shape[-2]) + 0.5)
+                lon = ulx + res * (np.arange(data.shape[-1]) + 0.5)
+                regridders[key] = regrid.Regridder(lat, lon, resolutions)
+            rg = regridders[key]
+            # a single sparse multiplication regrids the raster to all resolutions, whose
+            # tiles are streamed into the resampled tables one date at a time
+            for (tres, tulx, tuly, nrows, ncols), grid in zip(rg.targets, rg(data)):
+                grid = np.where(np.isnan(grid), nodata, grid)
+                records = (((dt.strftime("%Y-%m-%d"), tid), rasterToWKB(grid[..., si, sj], x, y, tres, nodata))
+                           for tid, (si, sj), x, y in resampledTiles(nrows, ncols, tulx, tuly, tres, res, tilesize))
+                copyRasters(cur, "{0}.{1}".format(schemaname, rtables[tres]), ["fdate", "rid"], records)
+        for res in resolutions:
+            log.info("Created resampled table {0}.{1}".format(schemaname, rtables[res]))
         db.commit()
-    if not tableExists(dbname, schemaname, tablename):
-        _createRasterTable(dbname, stname)
-        _createDateIndex(dbname, schemaname, tablename)
-    # check if date already exists and delete it before ingesting
+        # pack the years completed or changed by the ingested dates into time-stacked rasters
+        for res in resolutions:
+            stackRasters(dbname, schemaname, "{0}_{1}".format(tablename, int(1.0 / res)), min(dts), max(dts))
+    cur.close()
+    db.close()
+
+
+def ingestArrays(dbname, stname, items, resample=True, overwrite=True, nodata=-9999.):
+    """Imports *items* of (date, array, geotransform) into table *stname*, where each
+    array has shape (nrows, ncols) or (nbands, nrows, ncols) and a GDAL geotransform
+    with square pixels. Rasters are encoded in process and loaded through COPY with
+    their date in a single transaction, after the dates they cover are deleted if
+    *overwrite* is set. Masked and NaN values are stored as *nodata*."""
+    log = logging.getLogger(__name__)
+    items = sorted(items, key=lambda item: item[0])
+    if len(items) < 1:
+        return
+    schemaname, tablename = stname.split(".")
+    dts = [item[0] for item in items]
+    db = connect(dbname)
+    cur = db.cursor()
+    cur.execute("create schema if not exists {0}".format(schemaname))
+    cur.execute("create table if not exists {0} (rid serial primary key, rast raster, fdate date not null)".format(stname))
+    createIndex(cur, schemaname, "{0}_t".format(tablename), "on {0}.{1}(fdate)".format(schemaname, tablename))
     if overwrite:
-        deleteRasters(dbname, "{0}.{1}".format(schemaname, tablename), dt)
-    # create tiles from imported raster and insert into table
-    cur.execute("insert into {0}.{1} (fdate,rast) select fdate,rast from {2}".format(
-        schemaname, tablename, temptable))
-    db.commit()
-    # create materialized views for resampled rasters
-    if resample:
-        log.info("Creating resampled table for {0}.{1}".format(schemaname, tablename))
-        createResampledTables(dbname, schemaname, tablename, dt, tilesize, overwrite)
-    # delete temporary table
-    cur.execute("drop table {0}".format(temptable))
+        _deleteDates(cur, schemaname, tablename, dts)
+
+    def records():
+        for dt, data, geotransform in items:
+            data, ulx, uly, res = _northUp(data, geotransform, nodata)
+            yield (dt.strftime("%Y-%m-%d"),), rasterToWKB(data, ulx, uly, res, nodata)
+    copyRasters(cur, stname, ["fdate"], records())
     db.commit()
-    log.info("Imported {0} in {1}".format(dt.strftime("%Y-%m-%d"), stname))
     cur.close()
     db.close()
+    # regrid the arrays to the model resolutions before loading them, rather than
+    # resampling each date within the database
+    if resample:
+        log.info("Creating resampled table for {0}".format(stname))
+        resampleArrays(dbname, schemaname, tablename, items, overwrite, nodata)
+    log.info("Imported {0} to {1} in {2}".format(dts[0].strftime("%Y-%m-%d"), dts[-1].strftime("%Y-%m-%d"), stname))
+
+
+def ingest(dbname, filename, dt, stname, resample=True, overwrite=True):
+    """Imports Geotif *filename* into database *db*."""
+    f = gdal.Open(filename)
+    data = f.ReadAsArray().astype("f4")
+    nodata = f.GetRasterBand(1).GetNoDataValue()
+    if nodata is None:
+        nodata = -9999.
+    ingestArrays(dbname, stname, [(dt, data, f.GetGeoTransform())], resample, overwrite, nodata)
+    f = None
@@ -241,6 +241,23 @@ def calcDrySpells(model, droughtfun=np.mean, duration=14, recovduration=2):
     return np.cumsum(ndroughts, axis=0)
 
 
+def storedValues(model, varname, dt):
+    """Retrieve the values of a stored drought index on date *dt* for the cells with
+    data, in the order the indices are calculated."""
+    db = dbio.connect(model.dbname)
+    cur = db.cursor()
+    sql = "select (ST_DumpValues(rast)).valarray from {0}.{1} where fdate=date'{2}'".format(model.name, varname, dt.strftime("%Y-%m-%d"))
+    cur.execute(sql)
+    if bool(cur.rowcount):
+        data = np.array(cur.fetchone()[0]).ravel()
+        data = data[np.not_equal(data, None)].astype("f8")
+    else:
+        data = None
+    cur.close()
+    db.close()
+    return data
+
+
 def calcSMDI(model):
     """Calculate Soil Moisture Deficit Index (Narasimhan & Srinivasan, 2005)."""
     db = dbio.connect(model.dbname)
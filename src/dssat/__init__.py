@@ -162,15 +162,26 @@ class DSSAT(object):
             sql = "select column_name from information_schema.columns where table_schema='{0}' and table_name='{1}' and column_name='ensemble'".format(
                 self.name, varname)
             cur.execute(sql)
+            nbands = 1
             if bool(cur.rowcount):
                 sqlvars += ["ensemble"]
+            else:
+                # ensemble members can also be stored as the bands of each raster
+                cur.execute("select max(st_numbands(rast)) from {0}.{1} where {2}".format(self.name, varname, date_sql))
+                nbands = cur.fetchone()[0] or 1
+                if nbands > 1:
+                    sqlvars += ["ensemble"]
             sql = "select column_name from information_schema.columns where table_schema='{0}' and table_name='{1}' and column_name='layer'".format(
                 self.name, varname)
             cur.execute(sql)
             if bool(cur.rowcount):
                 sqlvars += ["layer"]
-            sql = "select {0}, avg((st_summarystats(rast)).mean) from {1}.{2}, {1}.agareas where st_intersects(rast,geom) and gid={3} and {4} group by gid,{0} order by fdate".format(
-                string.join(sqlvars, ","), self.name, varname, gid, date_sql)
+            if nbands > 1:
+                sql = "select {0}, avg((st_summarystats(rast,ensemble)).mean) from {1}.{2}, generate_series(1,{5}) as ensemble, {1}.agareas where st_intersects(rast,geom) and gid={3} and {4} group by gid,{0} order by fdate".format(
+                    string.join(sqlvars, ","), self.name, varname, gid, date_sql, nbands)
+            else:
+                sql = "select {0}, avg((st_summarystats(rast)).mean) from {1}.{2}, {1}.agareas where st_intersects(rast,geom) and gid={3} and {4} group by gid,{0} order by fdate".format(
+                    string.join(sqlvars, ","), self.name, varname, gid, date_sql)
             cur.execute(sql)
             if bool(cur.rowcount):
                 results = cur.fetchall()
@@ -9,28 +9,44 @@
 
 import vic
 from vic import state
+from vic import output as vicoutput
 import tempfile
+import time
 import sys
 import random
 from datetime import date, timedelta
-from multiprocessing import Process
+from collections import OrderedDict
+from multiprocessing import Process, cpu_count
 import numpy as np
 import shutil
 import os
 from dateutil.relativedelta import relativedelta
 import rpath
 import dbio
+import stats
+import climatology
+import bcsd
 import logging
 
 
 class Ensemble:
 
     def __init__(self, nens, dbname, resolution, startyear, startmonth, startday,
-                 endyear, endmonth, endday, name=""):
-        """Create an ensemble of models with size *nens*."""
+                 endyear, endmonth, endday, name="", storage="rows"):
+        """Create an ensemble of models with size *nens*. Simulation outputs
+        of the members are stored in separate rows of each table, or as the
+        bands of a single raster when *storage* is *bands*."""
         self.nens = nens
         self.models = []
         self.name = name
+        self.storage = storage
+        self.savechunk = None
+        self.statistics = []
+        self.quantiles = []
+        self.exceedance = {}
+        self.nprocs = cpu_count()
+        self.partition = None
+        self.climatology = None
         self.statefiles = []
         self.res = resolution
         self.startyear, self.startmonth, self.startday = startyear, startmonth, startday
@@ -42,10 +58,107 @@ class Ensemble:
                             endyear, endmonth, endday, name=name)
             self.models.append(model)
 
-    def _ensembleTable(self, write, e):
-        def write_wrapper(data, dates, tablename, initialize, skipsave):
-            return write(data, dates, tablename, initialize, e, skipsave=skipsave)
-        return write_wrapper
+    def _readMembers(self, models, var, start, end, accumulators):
+        """Yields the ensemble number and output of each member for variable *var* as
+        they are read in parallel, while adding them to the ensemble *accumulators*."""
+        for e, out in vic.readOutputParallel(models, [var], start, end, self.nprocs):
+            for acc in accumulators:
+                acc.add(out[var])
+            yield e + 1, out[var]
+
+    def _accumulators(self, var):
+        """Returns the accumulators of the ensemble products saved for variable *var*."""
+        acc = {}
+        if "mean" in self.statistics or "std" in self.statistics:
+            acc["moments"] = stats.Moments()
+        if len(self.quantiles) > 0:
+            acc["quantiles"] = stats.Quantiles()
+        if var in self.exceedance:
+            threshold, below = self.exceedance[var]
+            acc["exceedance"] = stats.Exceedance(threshold, below)
+        return acc
+
+    def _products(self, acc):
+        """Yields the name suffix and data of each ensemble product."""
+        if "moments" in acc:
+            if "mean" in self.statistics:
+                yield "mean", acc["moments"].mean
+            if "std" in self.statistics:
+                yield "std", acc["moments"].std()
+        if "quantiles" in acc:
+            for q in self.quantiles:
+                yield "q{0}".format(q), acc["quantiles"].quantile(q / 100.0)
+        if "exceedance" in acc:
+            yield "pexc", acc["exceedance"].probability()
+
+    def _saveStatistics(self, model, var, acc, initialize, skipsave, offset, saveto):
+        """Save the ensemble products of variable *var* for the dates of the current
+        simulation, leaving any other dates untouched."""
+        for suffix, data in self._products(acc):
+            tablename = "{0}_{1}".format(var, suffix)
+            if saveto == "db":
+                model.writeToDB(data.astype("f4"), None, tablename, initialize, skipsave=skipsave, offset=offset)
+            else:
+                model.writeToNetCDF(saveto.split(":", 1)[1], data.astype("f4"), tablename, skipsave=skipsave, offset=offset)
+
+    def _saveMembers(self, models, args, initialize=True, skipsave=0, saveto="db"):
+        """Save selected output variables of ensemble *models* into the database or a
+        NetCDF file. The output of the members is read in parallel and each variable
+        is written with a single bulk load."""
+        log = logging.getLogger(__name__)
+        if len(models[0].lat) < 1:
+            log.info("No pixels simulated, not saving any output!")
+            return
+        args = vicoutput.variableGroup(args)
+        outvars = models[0].getOutputStruct(models[0].model_path + "/global.txt")
+        varnames = []
+        for var in args:
+            if var in outvars:
+                varnames.append(var)
+            elif var not in vicoutput.droughtVariables:
+                log.warning("Variable {0} not found in output files. Skipping import.".format(var))
+        for var in self.exceedance:
+            if var not in varnames and var not in args:
+                log.warning("Variable {0} is not saved, so its exceedance probability is not calculated.".format(var))
+        nt = (date(models[0].endyear, models[0].endmonth, models[0].endday) -
+              date(models[0].startyear + models[0].skipyear, models[0].startmonth, models[0].startday)).days + 1
+        chunk = nt if self.savechunk is None else self.savechunk
+        for model in models:
+            model.partition = self.partition
+        # rebuild the indexes of the output tables once for the entire ensemble
+        with dbio.BulkWrite(self.dbname) as bulk:
+            models[0].bulk = bulk
+            for var in varnames:
+                for k in range(0, nt, chunk):
+                    acc = self._accumulators(var)
+                    members = self._readMembers(models, var, k, min(k + chunk, nt), acc.values())
+                    if saveto != "db" or self.storage == "bands":
+                        # members are read in any order, so stack them by ensemble number
+                        # along a band dimension after the layers
+                        data = np.concatenate([out[:, :, np.newaxis] for _, out in sorted(members, key=lambda m: m[0])], axis=2)
+                        if saveto != "db":
+                            models[0].writeToNetCDF(saveto.split(":", 1)[1], data, var, skipsave=skipsave, offset=k)
+                        else:
+                            models[0].writeToDB(data, None, var, initialize and k == 0, skipsave=skipsave, offset=k)
+                    else:
+                        # each member is loaded as soon as its output has been read
+                        models[0].writeMembersToDB(members, var, initialize and k == 0, skipsave=skipsave, offset=k)
+                    self._saveStatistics(models[0], var, acc, initialize and k == 0, skipsave, k, saveto)
+            models[0].bulk = None
+        if saveto != "db" or self.storage == "bands":
+            for var in [v for v in args if v in vicoutput.droughtVariables]:
+                log.warning("Cannot calculate {0} for an ensemble that is not stored in database rows. Skipping import.".format(var))
+        else:
+            # ensemble products of the drought indices are updated as each member is saved
+            accs = dict((var, self._accumulators(var)) for var in args if var in vicoutput.droughtVariables)
+            saved = set()
+            for e, model in enumerate(models):
+                for var, out in model.saveDrought(args, initialize and e == 0, skipsave, ensemble=e + 1).items():
+                    for acc in accs[var].values():
+                        acc.add(out)
+                    saved.add(var)
+            for var in [v for v in accs if v in saved]:
+                self._saveStatistics(models[0], var, accs[var], initialize, skipsave, 0, saveto)
 
     def setStateFiles(self, statefiles):
         """Set initial state files for each ensemble member."""
@@ -92,12 +205,7 @@ class Ensemble:
         self.startyear, self.startmonth, self.startday = startyear, startmonth, startday
         self.endyear, self.endmonth, self.endday = endyear, endmonth, endday
         for m in self.models:
-            m.startyear = startyear
-            m.startmonth = startmonth
-            m.startday = startday
-            m.endyear = endyear
-            m.endmonth = endmonth
-            m.endday = endday
+            m.setDates(startyear, startmonth, startday, endyear, endmonth, endday)
 
     def __getitem__(self, m):
         """Return a model instance."""
@@ -111,14 +219,14 @@ class Ensemble:
         """Return an iterator to model ensemble members."""
         return iter(self.models)
 
-    def writeParamFiles(self, savestate=""):
+    def writeParamFiles(self, savestate="", binary_output=False, save_vars=None):
         """Write model parameter file for each ensemble member."""
         for e, model in enumerate(self.models):
             if len(self.statefiles) > 0:
                 model.writeParamFile(state_file=self.statefiles[
-                                     e], save_state=savestate)
+                                     e], save_state=savestate, binary_output=binary_output, save_vars=save_vars)
             else:
-                model.writeParamFile(save_state=savestate)
+                model.writeParamFile(save_state=savestate, binary_output=binary_output, save_vars=save_vars)
 
     def writeSoilFiles(self, shapefile):
         """Write soil parameter files based on domain shapefile."""
@@ -133,25 +241,32 @@ class Ensemble:
             model.depths = self.models[0].depths
             model.elev = self.models[0].elev
 
-    def writeForcings(self, method, options):
-        """Write forcings for the ensemble based on method (ESP, BCSD)."""
+    def writeForcings(self, method, options, vicexe=None):
+        """Write forcings for the ensemble based on method (ESP, BCSD, IRI, NMME). If *vicexe*
+        is given, each member is run as soon as its forcings have been written."""
         log = logging.getLogger(__name__)
         if method.lower() == "esp":
-            self._ESP(options)
+            ready = self._ESP(options)
         elif method.lower() == "bcsd":
-            pass
+            ready = bcsd.generate(options, self)
         elif method.lower() == "iri":
-            self.__fromDataset("iri", options)
+            ready = self.__fromDataset("iri", options)
         elif method.lower() == "nmme":
-            self.__fromDataset("nmme", options)
+            ready = self.__fromDataset("nmme", options)
         else:
             log.error("No appropriate method for generating meteorological forecast ensemble, exiting!")
             sys.exit()
+        if vicexe is None:
+            for _ in ready:
+                pass
+        else:
+            self._pipeline(ready, self.models, vicexe)
 
     def __fromDataset(self, dataset, options):
-        """Generate and write forcings by using a dataset-specific function."""
+        """Generate and write forcings by using a dataset-specific function, which
+        yields each ensemble member once its forcings are written."""
         dsmod = __import__("datasets." + dataset, fromlist=[dataset])
-        dsmod.generate(options, self)
+        return dsmod.generate(options, self)
 
     def perturb(self, prec, tmax, tmin, wind, nens=None, perr=0.25, terr=2.0):
         """Perturb meteorological forcings."""
@@ -184,8 +299,31 @@ class Ensemble:
             enswind.append(w)
         return ensprec, enstmax, enstmin, enswind
 
+    def _climatology(self, forcings):
+        """Returns the climatology cube of the basin for the *forcings* datasets, updated
+        with any data ingested since it was last used, or None if it is not used."""
+        if self.climatology is None:
+            return None
+        clim = climatology.Climatology(self.models[0], forcings, self.climatology)
+        clim.refresh()
+        return clim
+
+    def _writeTrace(self, model, clim, forcings):
+        """Write the forcings of *model* for its simulation period, slicing them from
+        the climatology cube if there is one."""
+        if clim is not None:
+            ndays = (date(model.endyear, model.endmonth, model.endday) -
+                     date(model.startyear, model.startmonth, model.startday)).days + 1
+            data = clim.trace(date(model.startyear, model.startmonth, model.startday), ndays)
+            model.writeForcings(data['precip'], data['tmax'], data['tmin'], data['wind'])
+        else:
+            prec, tmax, tmin, wind = model.getForcings(forcings)
+            model.writeForcings(prec, tmax, tmin, wind)
+
     def _ESP(self, options):
-        """Generate meteorological forcings using the Ensemble Streamflow Prediction method."""
+        """Generate meteorological forcings using the Ensemble Streamflow Prediction method,
+        yielding each member once its forcings are written."""
+        log = logging.getLogger(__name__)
         ndays = (date(self.endyear, self.endmonth, self.endday) -
                  date(self.startyear, self.startmonth, self.startday)).days
         db = dbio.connect(self.models[0].dbname)
@@ -196,6 +334,15 @@ class Ensemble:
             sql = "select distinct (date_part('year', fdate)) as year from precip.{0} where date_part('month', fdate) >= {1} or date_part('month', fdate) <= {2}".format(options['vic']['precip'], self.startmonth, self.endmonth)
         cur.execute(sql)
         years = map(lambda y: int(y[0]), cur.fetchall())
+        clim = self._climatology(options['vic'])
+        if clim is not None:
+            # traces are sliced from the climatology for the years it fully covers
+            years = [y for y in years if clim.covers(date(y, self.startmonth, self.startday), ndays + 1)]
+            if len(years) < 1:
+                log.warning("Climatology does not cover any year of the forecast period, extracting forcings from the database.")
+                clim = None
+                cur.execute(sql)
+                years = map(lambda y: int(y[0]), cur.fetchall())
         random.shuffle(years)
         while len(years) < self.nens:
             years += years
@@ -205,19 +352,38 @@ class Ensemble:
             t = date(model.startyear, model.startmonth,
                      model.startday) + timedelta(ndays)
             model.endyear, model.endmonth, model.endday = t.year, t.month, t.day
-            prec, tmax, tmin, wind = model.getForcings(options['vic'])
-            model.writeForcings(prec, tmax, tmin, wind)
+            self._writeTrace(model, clim, options['vic'])
+            yield e
         cur.close()
         db.close()
 
-    def run(self, vicexe):
-        """Run ensemble of VIC models using multi-threading."""
-        procs = [Process(target=self.models[e].run, args=(vicexe,))
-                 for e in range(self.nens)]
-        for p in procs:
+    def _pipeline(self, ready, models, vicexe, finish=None):
+        """Run each of *models* in a separate process as soon as *ready* yields its
+        index, with at most *nprocs* running at a time. Preparing the next members
+        thus overlaps with the simulation of the previous ones, and *finish* is
+        called with the index of each member as soon as its simulation ends."""
+        running = OrderedDict()
+
+        def reap(n):
+            # wait until at most n members are running
+            while True:
+                for e in [k for k in running if not running[k].is_alive()]:
+                    running.pop(e).join()
+                    if finish is not None:
+                        finish(e)
+                if len(running) <= n:
+                    break
+                time.sleep(0.1)
+        for e in ready:
+            reap(self.nprocs - 1)
+            p = Process(target=models[e].run, args=(vicexe,))
             p.start()
-        for p in procs:
-            p.join()
+            running[e] = p
+        reap(0)
+
+    def run(self, vicexe):
+        """Run ensemble of VIC models using multi-processing."""
+        self._pipeline(range(self.nens), self.models, vicexe)
 
     def _initializeDeterm(self, basin, forcings, vicexe):
         """Initialize ensemble of VIC models deterministically."""
@@ -228,7 +394,8 @@ class Ensemble:
         cur.execute(
             "select * from information_schema.tables where table_schema='{0}' and table_name='state'".format(self.name))
         if bool(cur.rowcount):
-            sql = "select filename, fdate from {0}.state order by abs(date '{1}' - fdate)".format(
+            # start from the latest checkpoint so that only the gap to the forecast is simulated
+            sql = "select filename, fdate from {0}.state where fdate <= date '{1}' order by fdate desc limit 1".format(
                 self.name, dt)
             cur.execute(sql)
             if bool(cur.rowcount):
@@ -249,7 +416,7 @@ class Ensemble:
             model = vic.VIC(modelpath, self.dbname, self.res, t.year, t.month,
                             t.day, self.startyear, self.startmonth, self.startday, self.name)
             model.writeParamFile(save_state=modelpath,
-                                 init_state=bool(statefile))
+                                 init_state=bool(statefile), save_vars=[])
             model.writeSoilFile(basin)
             prec, tmax, tmin, wind = model.getForcings(forcings)
             model.writeForcings(prec, tmax, tmin, wind)
@@ -266,6 +433,26 @@ class Ensemble:
         db.close()
         return statefiles
 
+    def _runMembers(self, ready, pmodels, vicexe, t, saveindb, saveto, saveargs, overwrite, skipsave):
+        """Run initialization members starting on date *t* as soon as they are prepared,
+        and save their output if requested."""
+        if skipsave < 0:
+            skipdays = (date(self.startyear, self.startmonth,
+                             self.startday) - t).days + 1 + skipsave
+        else:
+            skipdays = skipsave
+        finish = None
+        if saveindb and not vicoutput.parsedTarget(saveto):
+            saved = []
+
+            def finish(e):
+                # each member is saved as soon as it finishes, in any order
+                pmodels[e].save(saveto, saveargs, overwrite and len(saved) == 0, skipsave=skipdays)
+                saved.append(e)
+        self._pipeline(ready, pmodels, vicexe, finish)
+        if saveindb and vicoutput.parsedTarget(saveto):
+            self._saveMembers(pmodels, saveargs, overwrite, skipsave=skipdays, saveto=saveto)
+
     def _initializeRandom(self, basin, forcings, vicexe, initdays=90, saveindb=False, saveto="db", saveargs=[], overwrite=True, skipsave=0):
         """Initialize ensemble of VIC models by sampling the meterological forcings
         and running them *initmonths* prior to simulation start date."""
@@ -286,47 +473,39 @@ class Ensemble:
         modelpath = tempfile.mkdtemp()  # (dir=".")
         model = vic.VIC(modelpath, self.dbname, self.res, t.year, t.month,
                         t.day, self.startyear, self.startmonth, self.startday, self.name)
+        clim = self._climatology(forcings)
+        if clim is not None:
+            # initialization periods are sliced from the climatology for the years it fully covers
+            covered = [y for y in years if clim.covers(date(y, t.month, t.day), ndays + 1)]
+            if len(covered) > 0:
+                years = covered
+            else:
+                clim = None
         years = np.random.choice(years, self.nens)
         pmodels = []
-        for e in range(self.nens):
-            modelpath = tempfile.mkdtemp()  # (dir=".")
-            model = vic.VIC(modelpath, self.dbname, self.res, t.year, t.month,
-                            t.day, self.startyear, self.startmonth, self.startday, self.name)
-            model.writeParamFile(save_state=modelpath, init_state=False)
-            model.writeSoilFile(basin)
-            model.startyear = years[e]
-            model.endyear = years[e] + (model.endyear - t.year)
-            ddays = (date(model.endyear, model.endmonth, model.endday) -
-                     date(model.startyear, model.startmonth, model.startday)).days - ndays
-            t1 = date(model.endyear, model.endmonth, model.endday) - \
-                relativedelta(days=ddays)
-            model.endyear, model.endmonth, model.endday = t1.year, t1.month, t1.day
-            prec, tmax, tmin, wind = model.getForcings(forcings)
-            model.writeForcings(prec, tmax, tmin, wind)
-            model.startyear, model.startmonth, model.startday = t.year, t.month, t.day
-            model.endyear, model.endmonth, model.endday = self.startyear, self.startmonth, self.startday
-            pmodels.append(model)
-        procs = [Process(target=pmodels[e].run, args=(vicexe,))
-                 for e in range(self.nens)]
-        for p in procs:
-            p.start()
-        for p in procs:
-            p.join()
-        if saveindb:
-            if skipsave < 0:
-                skipdays = (date(self.startyear, self.startmonth,
-                                 self.startday) - t).days + 1 + skipsave
-            else:
-                skipdays = skipsave
-            init = overwrite
-            for e in range(len(pmodels)):
-                model = pmodels[e]
-                if getattr(model.writeToDB, 'func_name') is not 'write_wrapper':
-                    model.writeToDB = self._ensembleTable(
-                        model.writeToDB, e + 1)
-                if e > 0:
-                    init = False
-                model.save(saveto, saveargs, init, skipsave=skipdays)
+
+        def prepare():
+            for e in range(self.nens):
+                modelpath = tempfile.mkdtemp()  # (dir=".")
+                model = vic.VIC(modelpath, self.dbname, self.res, t.year, t.month,
+                                t.day, self.startyear, self.startmonth, self.startday, self.name)
+                model.writeParamFile(save_state=modelpath, init_state=False,
+                                     binary_output=(saveindb and vicoutput.parsedTarget(saveto)),
+                                     save_vars=(saveargs if vicoutput.parsedTarget(saveto) else None))
+                model.writeSoilFile(basin)
+                model.startyear = years[e]
+                model.endyear = years[e] + (model.endyear - t.year)
+                ddays = (date(model.endyear, model.endmonth, model.endday) -
+                         date(model.startyear, model.startmonth, model.startday)).days - ndays
+                t1 = date(model.endyear, model.endmonth, model.endday) - \
+                    relativedelta(days=ddays)
+                model.endyear, model.endmonth, model.endday = t1.year, t1.month, t1.day
+                self._writeTrace(model, clim, forcings)
+                model.startyear, model.startmonth, model.startday = t.year, t.month, t.day
+                model.endyear, model.endmonth, model.endday = self.startyear, self.startmonth, self.startday
+                pmodels.append(model)
+                yield e
+        self._runMembers(prepare(), pmodels, vicexe, t, saveindb, saveto, saveargs, overwrite, skipsave)
         for e in range(self.nens):
             statefile = pmodels[e].model_path + "/vic.state_{0:04d}{1:02d}{2:02d}".format(
                 self.startyear, self.startmonth, self.startday)
@@ -345,35 +524,20 @@ class Ensemble:
         prec, tmax, tmin, wind = model.getForcings(forcings)
         eprec, etmax, etmin, ewind = self.perturb(prec, tmax, tmin, wind)
         pmodels = []
-        for e in range(self.nens):
-            modelpath = tempfile.mkdtemp()
-            model = vic.VIC(modelpath, self.dbname, self.res, t.year, t.month,
-                            t.day, self.startyear, self.startmonth, self.startday, self.name)
-            model.writeParamFile(save_state=modelpath, init_state=False)
-            model.writeSoilFile(basin)
-            model.writeForcings(eprec[e], etmax[e], etmin[e], ewind[e])
-            pmodels.append(model)
-        procs = [Process(target=pmodels[e].run, args=(vicexe,))
-                 for e in range(self.nens)]
-        for p in procs:
-            p.start()
-        for p in procs:
-            p.join()
-        if saveindb:
-            if skipsave < 0:
-                skipdays = (date(self.startyear, self.startmonth,
-                                 self.startday) - t).days + 1 + skipsave
-            else:
-                skipdays = skipsave
-            init = overwrite
-            for e in range(len(pmodels)):
-                model = pmodels[e]
-                if getattr(model.writeToDB, 'func_name') is not 'write_wrapper':
-                    model.writeToDB = self._ensembleTable(
-                        model.writeToDB, e + 1)
-                if e > 0:
-                    init = False
-                model.save(saveto, saveargs, init, skipsave=skipdays)
+
+        def prepare():
+            for e in range(self.nens):
+                modelpath = tempfile.mkdtemp()
+                model = vic.VIC(modelpath, self.dbname, self.res, t.year, t.month,
+                                t.day, self.startyear, self.startmonth, self.startday, self.name)
+                model.writeParamFile(save_state=modelpath, init_state=False,
+                                     binary_output=(saveindb and vicoutput.parsedTarget(saveto)),
+                                     save_vars=(saveargs if vicoutput.parsedTarget(saveto) else None))
+                model.writeSoilFile(basin)
+                model.writeForcings(eprec[e], etmax[e], etmin[e], ewind[e])
+                pmodels.append(model)
+                yield e
+        self._runMembers(prepare(), pmodels, vicexe, t, saveindb, saveto, saveargs, overwrite, skipsave)
         for e in range(self.nens):
             statefile = pmodels[e].model_path + "/vic.state_{0:04d}{1:02d}{2:02d}".format(
                 self.startyear, self.startmonth, self.startday)
@@ -403,8 +567,13 @@ class Ensemble:
             cur.execute(
                 "select * from information_schema.tables where table_name='state' and table_schema=%s", (self.name,))
             if bool(cur.rowcount):
-                cur.execute("select filename from {0}.state where date_part('month', fdate) = {1}".format(
-                    self.name, self.startmonth))
+                # checkpoint of each year that is closest to the day of year of the forecast start,
+                # with days counted across the end of the year and years centered on that day
+                doy = date(self.startyear, self.startmonth, self.startday).timetuple().tm_yday
+                ddoy = "least(abs(date_part('doy', fdate) - {0}), 366 - abs(date_part('doy', fdate) - {0}))".format(doy)
+                season = "date_part('year', fdate + {0})".format(183 - doy)
+                cur.execute("select distinct on ({1}) filename from {0}.state where {2} <= 31 order by {1}, {2}".format(
+                    self.name, season, ddoy))
                 statefiles = map(lambda q: q[0], cur.fetchall())
                 statefiles = list(np.random.choice(statefiles, self.nens))
             else:
@@ -424,26 +593,16 @@ class Ensemble:
         self.setStateFiles(statefiles)
 
     def save(self, saveto, args, initialize=True):
-        """Reads and saves selected output data variables from the ensemble into the database
-        or a user-defined directory."""
-        def ensembleTable(write, e):
-            def write_wrapper(data, dates, tablename, initialize, skipsave):
-                return write(data, dates, tablename, initialize, e)
-            return write_wrapper
-        for e in range(self.nens):
-            model = self.models[e]
-            if getattr(model.writeToDB, 'func_name') is not 'write_wrapper':
-                # decorate function to add ensemble information
-                model.writeToDB = ensembleTable(model.writeToDB, e + 1)
-            if saveto == "db":
-                if e > 0:
-                    initialize = False
-                model.save(saveto, args, initialize)
-            else:
+        """Reads and saves selected output data variables from the ensemble into the database,
+        a NetCDF file or a user-defined directory."""
+        if vicoutput.parsedTarget(saveto):
+            self._saveMembers(self.models, args, initialize, saveto=saveto)
+        else:
+            for e in range(self.nens):
                 if e < 1:
                     if os.path.isdir(saveto):
                         shutil.rmtree(saveto)
                     elif os.path.isfile(saveto):
                         os.remove(saveto)
                     os.makedirs(saveto)
-                model.save(saveto + "/{0}".format(e + 1), args, False)
+                self.models[e].save(saveto + "/{0}".format(e + 1), args, False)
@@ -8,6 +8,7 @@
 """
 
 import ensemble
+from vic import output as vicoutput
 import config
 import shutil
 import sys
@@ -15,7 +16,6 @@ from assimilation import assimilate
 from datetime import date
 import dssat
 import rpath
-import raster
 import logging
 
 
@@ -37,7 +37,15 @@ def runVIC(dbname, options):
     method = options['forecast']['method']
     name = options['forecast']['name'].lower()
     models = ensemble.Ensemble(nens, dbname, res, startyear,
-                               startmonth, startday, endyear, endmonth, endday, name)
+                               startmonth, startday, endyear, endmonth, endday, name,
+                               storage=config.getEnsembleStorage(options))
+    models.savechunk = config.getSaveChunk(options)
+    models.nprocs = config.getProcesses(options)
+    models.partition = config.getPartition(options)
+    models.climatology = config.getClimatology(options)
+    # ensemble mean and spread are calculated while the output is saved
+    models.statistics = ["mean", "std"]
+    models.quantiles, models.exceedance = config.getEnsembleProducts(options)
     if 'initialize' in options['vic'] and options['vic']['initialize'] in ['perturb', 'random']:
         init_method = options['vic']['initialize']
     else:
@@ -53,16 +61,12 @@ def runVIC(dbname, options):
     else:
         models.initialize(options, basin, init_method, vicexe,
                           saveindb=True, saveto=saveto, saveargs=savevars)
-    models.writeParamFiles()
-    models.writeForcings(method, options)
-    models.run(vicexe)
+    models.writeParamFiles(binary_output=vicoutput.parsedTarget(saveto),
+                           save_vars=(savevars if vicoutput.parsedTarget(saveto) else None))
+    # members are run as soon as their forcings are written
+    models.writeForcings(method, options, vicexe)
     models.setDates(startyear, startmonth, startday, endyear, endmonth, endday)
     models.save(saveto, savevars)
-    for varname in savevars:
-        raster.stddev(models.dbname, "{0}.{1}".format(
-            models.name, varname))
-        raster.mean(models.dbname, "{0}.{1}".format(
-            models.name, varname))
     for e in range(nens):
         shutil.rmtree(models[e].model_path)
 
@@ -8,6 +8,9 @@
 """
 
 import vic
+from vic import output as vicoutput
+from vic import cache as viccache
+from vic import state as vicstate
 import config
 import ensemble
 import sys
@@ -15,12 +18,16 @@ import tempfile
 import shutil
 from assimilation import assimilate, observationDates
 from datetime import date, timedelta
+from dateutil.relativedelta import relativedelta
 import rpath
-import raster
 import dbio
 import logging
 
 
+# days before the start of an extended simulation used to calculate drought indices
+droughtLookback = 3 * 365
+
+
 def runVIC(dbname, options):
     """Driver function for performing a VIC nowcast simulation"""
     if any(opt in options['vic'] for opt in ['ensemble size', 'observations']) or len(options['vic']['precip'].split(",")) > 1:
@@ -53,8 +60,23 @@ def _initialize(vicoptions):
     return init, statefile
 
 
+def _latestState(dbname, name, enddate):
+    """Returns the date and path of the latest state file saved before *enddate*."""
+    db = dbio.connect(dbname)
+    cur = db.cursor()
+    result = None
+    if dbio.tableExists(dbname, name, "state"):
+        cur.execute("select fdate, filename from {0}.state where fdate < date '{1}' order by fdate desc limit 1".format(name, enddate.strftime("%Y-%m-%d")))
+        result = cur.fetchone()
+    cur.close()
+    db.close()
+    return result
+
+
 def runDeterministicVIC(dbname, options):
-    """Driver function for performing a deterministic VIC nowcast simulation."""
+    """Driver function for performing a deterministic VIC nowcast simulation. In
+    *extend* mode the simulation continues from its latest saved state."""
+    log = logging.getLogger(__name__)
     res = config.getResolution(options['nowcast'])
     vicexe = "{0}/vicNl".format(rpath.bins)
     basin = config.getBasinFile(options['nowcast'])
@@ -64,18 +86,88 @@ def runDeterministicVIC(dbname, options):
     endyear, endmonth, endday = map(
         int, options['nowcast']['enddate'].split('-'))
     name = options['nowcast']['name'].lower()
+    savestate, dbsavestate = _saveState(options['vic'])
+    init, statefile = _initialize(options['vic'])
+    extend = 'extend' in options['nowcast'] and str(options['nowcast']['extend']).lower() in ["on", "true", "yes"]
+    if extend:
+        # continue the simulation from its latest saved state, so that only the new days are simulated
+        latest = _latestState(dbname, name, date(endyear, endmonth, endday))
+        if latest is None:
+            log.warning("No saved state found for {0}, simulating the entire period.".format(name))
+        else:
+            t, statefile = latest
+            startyear, startmonth, startday = t.year, t.month, t.day
+            log.info("Extending {0} from {1}.".format(name, t.strftime("%Y-%m-%d")))
+        if not dbsavestate:
+            log.warning("State is not saved, so the simulation cannot be extended again.")
     path = tempfile.mkdtemp(dir=".")
     model = vic.VIC(path, dbname, res, startyear, startmonth,
                     startday, endyear, endmonth, endday, name)
-    savestate, dbsavestate = _saveState(options['vic'])
-    init, statefile = _initialize(options['vic'])
-    model.writeParamFile(save_state=savestate, init_state=init,
-                         save_state_to_db=dbsavestate, state_file=statefile)
+    if extend:
+        # drought indices are updated for the new days using the stored output
+        model.droughtlookback = droughtLookback
+    model.savechunk = config.getSaveChunk(options)
+    model.nprocs = config.getProcesses(options)
+    model.subdomains = config.getSubdomains(options)
+    model.partition = config.getPartition(options)
+    cachedir, cachesize = config.getRunCache(options)
+    if cachedir is not None:
+        model.cache = viccache.RunCache(cachedir, cachesize)
+    t0, t1 = date(startyear, startmonth, startday), date(endyear, endmonth, endday)
+    segments = [(t0, t1)]
+    interval, retention = config.getStateCheckpoints(options)
+    if interval is not None and not dbsavestate:
+        log.warning("State checkpoints need the save state option to be set, so they will not be saved.")
+        interval = None
+    chunkyears = config.getChunkYears(options)
+    if interval is not None or chunkyears is not None:
+        if vicoutput.parsedTarget(saveto):
+            # run the simulation in segments that end on each checkpoint and every
+            # few years, so that memory use is bounded by the length of a segment
+            bounds = []
+            if interval is not None:
+                bounds += vicstate.checkpoints(t0, t1, interval)
+            if chunkyears is not None:
+                k = 1
+                while t0 + relativedelta(years=k * chunkyears) < t1:
+                    bounds.append(t0 + relativedelta(years=k * chunkyears))
+                    k += 1
+            bounds = [t0] + sorted(set(bounds)) + [t1]
+            segments = zip(bounds[:-1], bounds[1:])
+        else:
+            log.warning("Simulation segments need output to be saved in the database or a NetCDF file. Simulating the entire period at once.")
     model.writeSoilFile(basin)
-    prec, tmax, tmin, wind = model.getForcings(options['vic'])
-    model.writeForcings(prec, tmax, tmin, wind)
-    model.run(vicexe)
-    model.save(saveto, savevars)
+    if len(segments) > 1:
+        # the output of each segment is saved before the next one starts, while drought
+        # indices are calculated from the stored output once all segments are saved
+        segvars = [v for v in vicoutput.variableGroup(list(savevars)) if v not in vicoutput.droughtVariables]
+        with dbio.BulkWrite(dbname) as bulk:
+            model.bulk = bulk
+            for k, (st, et) in enumerate(segments):
+                model.setDates(st.year, st.month, st.day, et.year, et.month, et.day)
+                model.writeParamFile(save_state=(savestate or path), init_state=(init and k == 0),
+                                     save_state_to_db=dbsavestate, state_file=statefile, binary_output=True, save_vars=savevars)
+                prec, tmax, tmin, wind = model.getForcings(options['vic'])
+                model.writeForcings(prec, tmax, tmin, wind)
+                model.run(vicexe)
+                model.save(saveto, segvars)
+                # each segment starts from the state saved at the end of the previous one,
+                # which is only kept in the temporary directory if states are not saved
+                statefile = model.stateFilePath()
+            model.bulk = None
+        model.setDates(startyear, startmonth, startday, endyear, endmonth, endday)
+        if saveto == "db":
+            model.saveDrought(vicoutput.variableGroup(list(savevars)))
+    else:
+        model.writeParamFile(save_state=savestate, init_state=init,
+                             save_state_to_db=dbsavestate, state_file=statefile, binary_output=vicoutput.parsedTarget(saveto),
+                             save_vars=(savevars if vicoutput.parsedTarget(saveto) else None))
+        prec, tmax, tmin, wind = model.getForcings(options['vic'])
+        model.writeForcings(prec, tmax, tmin, wind)
+        model.run(vicexe)
+        model.save(saveto, savevars)
+    if retention is not None:
+        vicstate.pruneStates(dbname, name, retention)
     shutil.rmtree(path)
 
 
@@ -99,7 +191,14 @@ def runEnsembleVIC(dbname, options):
     else:
         nens = len(precipdatasets)
     models = ensemble.Ensemble(nens, dbname, res, startyear,
-                               startmonth, startday, endyear, endmonth, endday, name)
+                               startmonth, startday, endyear, endmonth, endday, name,
+                               storage=config.getEnsembleStorage(options))
+    models.savechunk = config.getSaveChunk(options)
+    models.nprocs = config.getProcesses(options)
+    models.partition = config.getPartition(options)
+    models.climatology = config.getClimatology(options)
+    # ensemble spread is calculated while the output is saved
+    models.statistics = ["std"]
     if 'initialize' in options['vic'] and options['vic']['initialize']:
         init_method = options['vic']['initialize']
         if isinstance(init_method, bool):
@@ -152,9 +251,6 @@ def runEnsembleVIC(dbname, options):
         ndays = (t - date(startyear, startmonth, startday)).days
         models.initialize(options, basin, method, vicexe, saveindb=True,
                           saveto=saveto, saveargs=savevars, initdays=ndays)
-    for varname in savevars:
-        raster.stddev(models.dbname, "{0}.{1}".format(
-            models.name, varname))
     for model in models:
         shutil.rmtree(model.model_path)
 
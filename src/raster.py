@@ -7,12 +7,15 @@
 
 """
 
+import numpy as np
+from datetime import date, timedelta
 import dbio
-import logging
 
 
 class TileReader:
-    """Helper class to retrieve raster tile from database."""
+    """Helper class to retrieve raster tile from database. Dates that have been
+    packed into time-stacked rasters are read from a few multi-band rows, and any
+    remaining dates from the daily rasters."""
 
     def __init__(self, dbname, rtable, startyear, startmonth, startday, endyear, endmonth, endday):
         self.dbname = dbname
@@ -24,71 +27,68 @@ class TileReader:
         self.endmonth = endmonth
         self.endday = endday
 
-    def __call__(self, t):
-        db = dbio.connect(self.dbname)
-        cur = db.cursor()
+    def _nearestValue(self, band, i, j):
+        """Returns the value of pixel (*i*, *j*) or of its nearest valid pixel."""
+        if not np.ma.is_masked(band[i, j]):
+            return float(band[i, j])
+        valid = np.argwhere(~np.ma.getmaskarray(band))
+        if len(valid) < 1:
+            return None
+        k = np.argmin((valid[:, 0] - i) ** 2 + (valid[:, 1] - j) ** 2)
+        return float(band[valid[k, 0], valid[k, 1]])
+
+    def _readStacked(self, cur, t):
+        """Retrieve data for tile *t* from the time-stacked rasters, together with
+        the date range covered by each stacked block."""
+        sname, tname = self.rtable.split(".")
         var = self.rtable.split(".")[0]
-        sql = "select gid,fdate,st_nearestvalue(rast,x,y) from {0},{1}_xy where rid=tile and tile={8} and fdate>=date'{2}-{3}-{4}' and fdate<=date'{5}-{6}-{7}' order by gid,fdate".format(
-            self.rtable, var, self.startyear, self.startmonth, self.startday, self.endyear, self.endmonth, self.endday, t)
+        t0 = date(self.startyear, self.startmonth, self.startday)
+        t1 = date(self.endyear, self.endmonth, self.endday)
+        cur.execute("select gid,x,y from {0}_xy where tile={1}".format(var, t))
+        cells = cur.fetchall()
+        sql = "select dates,st_asbinary(rast) from {0}.{1} where rid={2} and fdate<=date'{3}' and dates[array_upper(dates,1)]>=date'{4}' order by fdate".format(
+            sname, dbio.stackedTable(tname), t, t1.strftime("%Y-%m-%d"), t0.strftime("%Y-%m-%d"))
         cur.execute(sql)
-        data = cur.fetchall()
-        return data
+        data = []
+        covered = []
+        for dates, wkb in cur.fetchall():
+            rdata, _ = dbio.rasterFromWKB(str(wkb))
+            bands = [b for b, dt in enumerate(dates) if t0 <= dt <= t1]
+            for gid, x, y in cells:
+                for b in bands:
+                    data.append((gid, dates[b], self._nearestValue(rdata[b], y - 1, x - 1)))
+            covered.append((dates[0], dates[-1]))
+        return data, covered
 
+    def _gaps(self, covered):
+        """Returns the date ranges of the simulation period outside the *covered* ranges."""
+        gaps = []
+        t0 = date(self.startyear, self.startmonth, self.startday)
+        t1 = date(self.endyear, self.endmonth, self.endday)
+        for c0, c1 in sorted(covered):
+            if c0 > t0:
+                gaps.append((t0, min(c0 - timedelta(1), t1)))
+            t0 = max(t0, c1 + timedelta(1))
+        if t0 <= t1:
+            gaps.append((t0, t1))
+        return gaps
 
-def _columnExists(cursor, name, colname):
-    """Tests whether a column exists in a table."""
-    schemaname, tablename = name.split(".")
-    sql = "select column_name from information_schema.columns where table_schema='{0}' and table_name='{1}' and column_name='{2}'".format(
-        schemaname, tablename, colname)
-    cursor.execute(sql)
-    return bool(cursor.rowcount)
-
-
-def stddev(dbname, name):
-    """Calculate ensemble standard deviation from raster."""
-    log = logging.getLogger(__name__)
-    schemaname, tablename = name.split(".")
-    db = dbio.connect(dbname)
-    cur = db.cursor()
-    if _columnExists(cur, name, "ensemble"):
-        cur.execute("select max(ensemble) from {0}".format(name))
-        nens = cur.fetchone()[0]
-        ssql = "select fdate,st_mapalgebra(st_addband(null,array_agg(rast)),ARRAY{0},'st_stddev4ma(float[][],text,text[])'::regprocedure) as rast from {1} group by fdate".format(
-            str(range(1, nens + 1)), name)
-        sql = "select * from information_schema.columns where table_schema='{0}' and table_name='{1}_std'".format(
-            schemaname, tablename)
-        cur.execute(sql)
-        if bool(cur.rowcount):
-            cur.execute("drop table {0}_std".format(name))
-        sql = "create table {0}.{1}_std as ({2})".format(
-            schemaname, tablename, ssql)
-        cur.execute(sql)
-    else:
-        log.warning("Cannot calculate uncertainty maps, no ensemble exists.")
-    db.commit()
-    cur.close()
-    db.close()
-
+    def __call__(self, t):
+        db = dbio.connect(self.dbname)
+        cur = db.cursor()
+        var = self.rtable.split(".")[0]
+        sname, tname = self.rtable.split(".")
+        data, covered = [], []
+        if dbio.tableExists(self.dbname, sname, dbio.stackedTable(tname)):
+            data, covered = self._readStacked(cur, t)
+        gaps = self._gaps(covered)
+        if len(gaps) > 0:
+            dquery = " or ".join(["(fdate>=date'{0}' and fdate<=date'{1}')".format(g0.strftime("%Y-%m-%d"), g1.strftime("%Y-%m-%d")) for g0, g1 in gaps])
+            sql = "select gid,fdate,st_nearestvalue(rast,x,y) from {0},{1}_xy where rid=tile and tile={2} and ({3}) order by gid,fdate".format(
+                self.rtable, var, t, dquery)
+            cur.execute(sql)
+            data += cur.fetchall()
+        cur.close()
+        db.close()
+        return sorted(data)
 
-def mean(dbname, name):
-    """Calculate ensemble average from raster."""
-    log = logging.getLogger(__name__)
-    schemaname, tablename = name.split(".")
-    db = dbio.connect(dbname)
-    cur = db.cursor()
-    if _columnExists(cur, name, "ensemble"):
-        cur.execute("select max(ensemble) from {0}".format(name))
-        nens = cur.fetchone()[0]
-        ssql = "select fdate,st_union(rast,'MEAN') as rast from {0} group by fdate".format(name)
-        sql = "select * from information_schema.columns where table_schema='{0}' and table_name='{1}_mean'".format(
-            schemaname, tablename)
-        cur.execute(sql)
-        if bool(cur.rowcount):
-            cur.execute("drop table {0}_mean".format(name))
-        sql = "create table {0}.{1}_mean as ({2})".format(schemaname, tablename, ssql)
-        cur.execute(sql)
-    else:
-        log.warning("Cannot calculate ensemble average maps, no ensemble exists.")
-    db.commit()
-    cur.close()
-    db.close()
@@ -0,0 +1,156 @@
+""" RHEAS module for regridding datasets
+
+.. module:: regrid
+   :synopsis: Sparse weight matrices that regrid rasters onto the model resolutions
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+import hashlib
+import os
+import rpath
+import logging
+
+
+def _edges(centers):
+    """Returns the cell edges of a sorted axis of cell *centers*."""
+    if len(centers) < 2:
+        return np.array([centers[0] - 0.5, centers[0] + 0.5])
+    mid = 0.5 * (centers[1:] + centers[:-1])
+    return np.concatenate([[2 * centers[0] - mid[0]], mid, [2 * centers[-1] - mid[-1]]])
+
+
+def _spacing(centers):
+    """Returns the typical spacing of an axis of cell *centers*."""
+    return np.median(np.abs(np.diff(centers))) if len(centers) > 1 else 0.0
+
+
+def _axisWeights(src, dst, res, method):
+    """Returns the sparse matrix with dimensions (len(dst), len(src)) that interpolates
+    values at the cell centers *src* of one axis to the centers *dst* of cells with
+    size *res*."""
+    order = np.argsort(src)
+    s = np.asarray(src, dtype="f8")[order]
+    n = len(s)
+    rows, cols, weights = [], [], []
+    if method == "nearest":
+        k = np.clip(np.searchsorted(s, dst), 1, n - 1) if n > 1 else np.zeros(len(dst), dtype=int)
+        k = np.where(np.abs(dst - s[np.maximum(k - 1, 0)]) <= np.abs(s[k] - dst), np.maximum(k - 1, 0), k)
+        rows, cols, weights = np.arange(len(dst)), k, np.ones(len(dst))
+    elif method == "bilinear":
+        k = np.searchsorted(s, dst)
+        lo = np.clip(k - 1, 0, n - 1)
+        hi = np.clip(k, 0, n - 1)
+        f = np.clip((dst - s[lo]) / np.where(hi > lo, s[hi] - s[lo], 1.0), 0.0, 1.0)
+        f = np.where(hi > lo, f, 0.0)
+        rows = np.concatenate([np.arange(len(dst))] * 2)
+        cols = np.concatenate([lo, hi])
+        weights = np.concatenate([1 - f, f])
+    else:
+        # fraction of each target cell that is covered by each source cell
+        e = _edges(s)
+        for r, d in enumerate(dst):
+            a, b = d - res / 2.0, d + res / 2.0
+            i = np.arange(max(np.searchsorted(e, a, "right") - 1, 0), min(np.searchsorted(e, b, "left"), n))
+            overlap = np.minimum(b, e[i + 1]) - np.maximum(a, e[i])
+            i, overlap = i[overlap > 0], overlap[overlap > 0]
+            rows.extend([r] * len(i))
+            cols.extend(i)
+            weights.extend(overlap / overlap.sum() if len(i) > 0 else [])
+    return sparse.coo_matrix((weights, (rows, order[np.asarray(cols, dtype=int)])), shape=(len(dst), n)).tocsr()
+
+
+def method(srcres, res):
+    """Returns the regridding method from the resolution of a dataset to that of the
+    model, similarly to the resampling of rasters within the database."""
+    if np.isclose(srcres, res):
+        return "nearest"
+    elif res < srcres:
+        return "bilinear"
+    else:
+        return "average"
+
+
+class Regridder:
+    """Regrids rasters from the rectilinear grid with cell centers *lat* and *lon* onto
+    regular grids of each of the *resolutions*, which share the upper-left corner of the
+    source grid. The sparse weights of all resolutions are stacked into a single matrix,
+    so that a raster is regridded to every resolution with one multiplication. Matrices
+    are cached in *directory* by the grids and methods they were computed for."""
+
+    _matrices = {}
+
+    def __init__(self, lat, lon, resolutions, methods=None, directory=None):
+        log = logging.getLogger(__name__)
+        if directory is None:
+            directory = "{0}/regrid".format(os.path.dirname(rpath.data))
+        lat = np.asarray(lat, dtype="f8")
+        lon = np.asarray(lon, dtype="f8")
+        if methods is None:
+            srcres = 0.5 * (_spacing(lat) + _spacing(lon))
+            methods = [method(srcres, res) for res in resolutions]
+        self.shape = (len(lat), len(lon))
+        late, lone = _edges(np.sort(lat)), _edges(np.sort(lon))
+        self.targets = []
+        for res in resolutions:
+            nrows = max(int(round((late[-1] - late[0]) / res)), 1)
+            ncols = max(int(round((lone[-1] - lone[0]) / res)), 1)
+            self.targets.append((res, lone[0], late[-1], nrows, ncols))
+        h = hashlib.sha1()
+        h.update(lat.tostring())
+        h.update(lon.tostring())
+        h.update(str(list(zip(resolutions, methods))))
+        key = h.hexdigest()
+        if key not in Regridder._matrices:
+            filename = "{0}/{1}.npz".format(directory, key)
+            if os.path.isfile(filename):
+                f = np.load(filename)
+                matrix = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            else:
+                log.info("Computing regridding weights for {0} x {1} grid.".format(len(lat), len(lon)))
+                blocks = []
+                for (res, ulx, uly, nrows, ncols), m in zip(self.targets, methods):
+                    wlat = _axisWeights(lat, uly - res * (np.arange(nrows) + 0.5), res, m)
+                    wlon = _axisWeights(lon, ulx + res * (np.arange(ncols) + 0.5), res, m)
+                    blocks.append(sparse.kron(wlat, wlon))
+                matrix = sparse.vstack(blocks).tocsr()
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                # write into a temporary file first, so that an interrupted write is never loaded
+                tmpfilename = "{0}/{1}.tmp.npz".format(directory, key)
+                np.savez(tmpfilename, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=matrix.shape)
+                os.rename(tmpfilename, filename)
+            Regridder._matrices[key] = matrix
+        self.matrix = Regridder._matrices[key]
+
+    def __call__(self, data):
+        """Regrid *data* with dimensions ([band,] lat, lon), returning a list of arrays
+        for each resolution. Masked and NaN values are left out of the weights, and cells
+        without any valid source value are NaN."""
+        data = np.ma.masked_invalid(np.ma.asarray(data, dtype="f8"))
+        nbands = data.shape[0] if data.ndim > 2 else 1
+        x = data.reshape((nbands, -1)).T
+        valid = (~np.ma.getmaskarray(x)).astype("f8")
+        num = self.matrix.dot(x.filled(0.0))
+        den = self.matrix.dot(valid)
+        out = np.where(den > 0, num / np.where(den > 0, den, 1.0), np.nan)
+        grids = []
+        offset = 0
+        for res, _, _, nrows, ncols in self.targets:
+            grid = out[offset:offset + nrows * ncols].T.reshape((nbands, nrows, ncols))
+            grids.append(grid if data.ndim > 2 else grid[0])
+            offset += nrows * ncols
+        return grids
+
+
+def regular(data, lat, lon, res, method=None):
+    """Regrid *data* with dimensions ([time,] lat, lon) from the rectilinear grid with
+    cell centers *lat* and *lon* (e.g. non-square or equal-area grids) onto a regular
+    grid of resolution *res*, returning the data along with the cell centers of the
+    regular grid."""
+    rg = Regridder(lat, lon, [res], None if method is None else [method])
+    _, ulx, uly, nrows, ncols = rg.targets[0]
+    return rg(data)[0], uly - res * (np.arange(nrows) + 0.5), ulx + res * (np.arange(ncols) + 0.5)
@@ -0,0 +1,112 @@
+""" RHEAS module for ensemble statistics
+
+.. module:: stats
+   :synopsis: Streaming statistics over the members of an ensemble
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import numpy as np
+
+
+class Moments:
+    """Ensemble mean and standard deviation that are updated one member at a
+    time with Welford's algorithm."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def add(self, data):
+        """Update statistics with the array *data* of an ensemble member."""
+        data = np.asarray(data, dtype="f8")
+        if self.mean is None:
+            self.mean = np.zeros(data.shape)
+            self.m2 = np.zeros(data.shape)
+        self.n += 1
+        delta = data - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (data - self.mean)
+
+    def std(self):
+        """Returns the sample standard deviation of the ensemble."""
+        if self.n < 2:
+            return np.zeros(self.m2.shape)
+        return np.sqrt(self.m2 / (self.n - 1))
+
+
+class Quantiles:
+    """Mergeable quantile sketch of an ensemble that is updated one member at a
+    time. Members are kept in levels that hold up to *capacity* arrays each; a
+    full level is sorted and every other value is passed on to the next level
+    with twice the weight. Quantiles are exact as long as the ensemble fits in
+    the first level."""
+
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.levels = []
+        self.shape = None
+
+    def _insert(self, level, data):
+        while len(self.levels) <= level:
+            self.levels.append([])
+        self.levels[level].append(data)
+        if len(self.levels[level]) >= self.capacity:
+            values = np.sort(np.array(self.levels[level]), axis=0)
+            self.levels[level] = []
+            for v in values[np.random.randint(2)::2]:
+                self._insert(level + 1, v)
+
+    def add(self, data):
+        """Update sketch with the array *data* of an ensemble member."""
+        self.shape = np.shape(data)
+        self._insert(0, np.asarray(data, dtype="f4"))
+
+    def merge(self, other):
+        """Merge the sketch of another part of the ensemble into this one."""
+        self.shape = other.shape
+        for level, items in enumerate(other.levels):
+            for data in items:
+                self._insert(level, data)
+
+    def quantile(self, q):
+        """Returns the *q*-th quantile (between 0 and 1) of the ensemble."""
+        if len(self.levels) < 2:
+            # small ensembles are kept in full, so use an exact partial sort
+            return np.percentile(np.array(self.levels[0]), 100.0 * q, axis=0)
+        values = np.array([data for items in self.levels for data in items])
+        weights = np.array([2.0 ** level for level, items in enumerate(self.levels) for _ in items])
+        n = values.shape[0]
+        values = values.reshape((n, -1))
+        order = np.argsort(values, axis=0)
+        cells = np.arange(values.shape[1])
+        cum = np.cumsum(weights[order], axis=0)
+        i = np.minimum((cum < q * cum[-1]).sum(axis=0), n - 1)
+        return values[order[i, cells], cells].reshape(self.shape)
+
+
+class Exceedance:
+    """Probability that the ensemble exceeds (or falls below) a threshold, updated
+    one member at a time."""
+
+    def __init__(self, threshold, below=False):
+        self.threshold = threshold
+        self.below = below
+        self.n = 0
+        self.count = None
+
+    def add(self, data):
+        """Update probability with the array *data* of an ensemble member."""
+        if self.count is None:
+            self.count = np.zeros(np.shape(data))
+        self.n += 1
+        if self.below:
+            self.count += np.asarray(data) < self.threshold
+        else:
+            self.count += np.asarray(data) > self.threshold
+
+    def probability(self):
+        """Returns the fraction of ensemble members beyond the threshold."""
+        return self.count / max(self.n, 1)
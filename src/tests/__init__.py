@@ -9,3 +9,6 @@
 
 from testnowcast import testNowcast
 from testforecast import testForecast
+from testvicoutput import testVICOutput
+from testregrid import testRegrid
+from testbcsd import testBcsd
@@ -0,0 +1,56 @@
+""" RHEAS BCSD testing suite.
+
+   :synopsis: Unit tests for the quantile mapping of BCSD forecasts
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import unittest
+import numpy as np
+import bcsd
+
+
+class testBcsd(unittest.TestCase):
+
+    def setUp(self):
+        """Set forecast and observed quantiles of two leads and three cells."""
+        probs = np.linspace(0.0, 1.0, 5)
+        self.qfcst = np.tile((1.0 + 9.0 * probs)[None, :, None], (2, 1, 3))
+        self.qobs = 2.0 * self.qfcst + 1.0
+        # members, leads and cells spanning values below, inside and above the quantiles
+        self.x = np.tile(np.linspace(0.5, 12.0, 24)[:, None, None], (1, 2, 3))
+
+    def testIdentity(self):
+        """Test that forecasts are unchanged when both distributions are the same."""
+        for ratio in [False, True]:
+            out = bcsd.quantileMap(self.x, self.qfcst, self.qfcst, ratio=ratio)
+            np.testing.assert_allclose(out, self.x)
+
+    def testMonotonic(self):
+        """Test that the mapping preserves the order of the forecasts."""
+        for ratio in [False, True]:
+            out = bcsd.quantileMap(self.x, self.qfcst, self.qobs, ratio=ratio)
+            assert (np.diff(out, axis=0) >= 0).all()
+
+    def testInterpolation(self):
+        """Test that forecasts inside the quantiles are mapped onto the observed ones."""
+        x = self.qfcst[None, :, 2, :]
+        out = bcsd.quantileMap(x, self.qfcst, self.qobs)
+        np.testing.assert_allclose(out, self.qobs[None, :, 2, :])
+        x = 0.5 * (self.qfcst[None, :, 1, :] + self.qfcst[None, :, 2, :])
+        out = bcsd.quantileMap(x, self.qfcst, self.qobs)
+        np.testing.assert_allclose(out, 2.0 * x + 1.0)
+
+    def testExtrapolation(self):
+        """Test that forecasts beyond the tails are extrapolated from the extreme quantiles."""
+        high = self.x[self.x[:, 0, 0] > 10.0]
+        low = self.x[self.x[:, 0, 0] < 1.0]
+        out = bcsd.quantileMap(high, self.qfcst, self.qobs)
+        np.testing.assert_allclose(out, high + 11.0)
+        out = bcsd.quantileMap(low, self.qfcst, self.qobs)
+        np.testing.assert_allclose(out, low + 2.0)
+        out = bcsd.quantileMap(high, self.qfcst, self.qobs, ratio=True)
+        np.testing.assert_allclose(out, high * 2.1)
+        out = bcsd.quantileMap(low, self.qfcst, self.qobs, ratio=True)
+        np.testing.assert_allclose(out, low * 3.0)
@@ -70,6 +70,20 @@ class testForecast(unittest.TestCase):
         self.options['forecast']['method'] = "nmme"
         forecast.execute(self.dbname, self.options)
 
+    def testBcsdVIC(self):
+        """Test forecast VIC simulations using bias-corrected and spatially disaggregated NMME forecasts."""
+        self.options['forecast']['startdate'] = "2017-7-1"
+        self.options['forecast']['enddate'] = "2017-7-31"
+        self.options['forecast']['ensemble size'] = 2
+        self.options['forecast']['method'] = "bcsd"
+        forecast.execute(self.dbname, self.options)
+        db = dbio.connect(self.dbname)
+        cur = db.cursor()
+        cur.execute("select * from information_schema.tables where table_name='bcsd' and table_schema='{0}'".format(self.options['forecast']['name']))
+        assert bool(cur.rowcount) is True
+        cur.close()
+        db.close()
+
     def testEspVICwithAssimilation(self):
         """Test ESP forecast VIC simulation with data assimilation."""
         self.options['forecast']['startdate'] = "2011-4-1"
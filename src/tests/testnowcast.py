@@ -12,6 +12,10 @@ import rpath
 import config
 import dbio
 import tempfile
+import shutil
+import os
+import numpy as np
+import netCDF4 as netcdf4
 import tests.database
 
 
@@ -45,7 +49,7 @@ class testNowcast(unittest.TestCase):
         """Clean up data generated after each unit test."""
         db = dbio.connect(self.dbname)
         cur = db.cursor()
-        cur.execute("drop schema {0} cascade".format(self.options['nowcast']['name']))
+        cur.execute("drop schema if exists {0} cascade".format(self.options['nowcast']['name']))
         db.commit()
         cur.close()
         db.close()
@@ -103,3 +107,77 @@ class testNowcast(unittest.TestCase):
         self.options['nowcast']['startdate'] = "2011-2-1"
         self.options['nowcast']['enddate'] = "2011-2-2"
         nowcast.execute(self.dbname, self.options)
+
+    def _dates(self, tablename):
+        """Returns the number of dates stored in an output table, and whether any
+        tile is stored more than once for a date."""
+        db = dbio.connect(self.dbname)
+        cur = db.cursor()
+        cur.execute("select count(distinct fdate) from basin.{0}".format(tablename))
+        ndates = cur.fetchone()[0]
+        cur.execute("select fdate,rid from basin.{0} group by fdate,rid having count(*) > 1".format(tablename))
+        duplicates = bool(cur.rowcount)
+        cur.close()
+        db.close()
+        return ndates, duplicates
+
+    def testExtendVIC(self):
+        """Test extending a VIC simulation from its latest saved state."""
+        statepath = tempfile.mkdtemp()
+        self.options['vic']['save state'] = statepath
+        self.options['vic']['save'] = "runoff, dryspells"
+        self.options['nowcast']['startdate'] = "2011-1-1"
+        self.options['nowcast']['enddate'] = "2011-2-15"
+        nowcast.execute(self.dbname, self.options)
+        self.options['nowcast']['enddate'] = "2011-3-31"
+        self.options['nowcast']['extend'] = "on"
+        nowcast.execute(self.dbname, self.options)
+        assert self._dates("runoff") == (90, False)
+        assert self._dates("dryspells") == (90, False)
+        # dry spells keep accumulating across the start of the extension
+        db = dbio.connect(self.dbname)
+        cur = db.cursor()
+        cur.execute("select fdate,sum((st_summarystats(rast)).sum) from basin.dryspells group by fdate order by fdate")
+        counts = np.array([r[1] for r in cur.fetchall()])
+        cur.close()
+        db.close()
+        assert (np.diff(counts) >= 0).all()
+        shutil.rmtree(statepath)
+
+    def testSegmentedVIC(self):
+        """Test VIC simulation split into segments at state checkpoints and years."""
+        statepath = tempfile.mkdtemp()
+        self.options['vic']['save state'] = statepath
+        self.options['vic']['state interval'] = "month"
+        self.options['vic']['chunk years'] = 1
+        self.options['nowcast']['startdate'] = "2011-1-1"
+        self.options['nowcast']['enddate'] = "2011-3-31"
+        nowcast.execute(self.dbname, self.options)
+        assert self._dates("runoff") == (90, False)
+        db = dbio.connect(self.dbname)
+        cur = db.cursor()
+        cur.execute("select distinct fdate from basin.state")
+        assert cur.rowcount >= 3
+        cur.close()
+        db.close()
+        shutil.rmtree(statepath)
+
+    def testNetCDFVIC(self):
+        """Test saving VIC output into a NetCDF file that is extended by a later simulation."""
+        outpath = tempfile.mkdtemp()
+        filename = "{0}/basin.nc".format(outpath)
+        self.options['vic']['save to'] = "netcdf:{0}".format(filename)
+        self.options['nowcast']['startdate'] = "2011-1-1"
+        self.options['nowcast']['enddate'] = "2011-1-31"
+        nowcast.execute(self.dbname, self.options)
+        self.options['nowcast']['startdate'] = "2011-1-15"
+        self.options['nowcast']['enddate'] = "2011-2-10"
+        nowcast.execute(self.dbname, self.options)
+        assert os.path.isfile(filename)
+        f = netcdf4.Dataset(filename)
+        times = f.variables["time"][:]
+        assert len(times) == 41
+        assert (np.diff(times) == 1).all()
+        assert f.variables["runoff"].shape[0] == 41
+        f.close()
+        shutil.rmtree(outpath)
@@ -0,0 +1,89 @@
+""" RHEAS regridding testing suite.
+
+   :synopsis: Unit tests for the regridding of ingested datasets
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import regrid
+import dbio
+
+
+class testRegrid(unittest.TestCase):
+
+    def setUp(self):
+        """Create directory for the cached weights."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Delete the cached weights."""
+        shutil.rmtree(self.directory)
+
+    def testNearestWeights(self):
+        """Test that nearest neighbour weights pick the closest source cell."""
+        w = regrid._axisWeights(np.array([0.5, 1.5, 2.5]), np.array([0.6, 2.4]), 1.0, "nearest").toarray()
+        np.testing.assert_allclose(w, [[1, 0, 0], [0, 0, 1]])
+
+    def testBilinearWeights(self):
+        """Test that bilinear weights interpolate between neighbouring cells."""
+        w = regrid._axisWeights(np.array([2.5, 1.5, 0.5]), np.array([1.0, 2.25]), 0.5, "bilinear").toarray()
+        np.testing.assert_allclose(w, [[0, 0.5, 0.5], [0.75, 0.25, 0]])
+
+    def testAverageWeights(self):
+        """Test that conservative weights are the fraction of each target cell covered."""
+        w = regrid._axisWeights(np.array([0.5, 1.5, 2.5, 3.5]), np.array([1.0, 3.0]), 2.0, "average").toarray()
+        np.testing.assert_allclose(w, [[0.5, 0.5, 0, 0], [0, 0, 0.5, 0.5]])
+        np.testing.assert_allclose(w.sum(axis=1), 1.0)
+
+    def testMethod(self):
+        """Test choice of regridding method from the resolutions."""
+        assert regrid.method(0.25, 0.25) == "nearest"
+        assert regrid.method(0.25, 0.05) == "bilinear"
+        assert regrid.method(0.05, 0.25) == "average"
+
+    def testMaskedAverage(self):
+        """Test that masked and NaN values are left out of the regridded averages."""
+        lat = np.array([1.5, 0.5])
+        lon = np.array([0.5, 1.5])
+        rg = regrid.Regridder(lat, lon, [2.0], directory=self.directory)
+        data = np.ma.masked_array([[1.0, 2.0], [3.0, 100.0]], mask=[[False, False], [False, True]])
+        out = rg(data)[0]
+        assert out.shape == (1, 1)
+        np.testing.assert_allclose(out, [[2.0]])
+        out = rg(np.array([[np.nan, np.nan], [np.nan, np.nan]]))[0]
+        assert np.isnan(out).all()
+
+    def testMultipleResolutions(self):
+        """Test regridding to several resolutions with a single matrix."""
+        lat = 2.0 - 0.5 * (np.arange(4) + 0.5)
+        lon = 0.5 * (np.arange(4) + 0.5)
+        data = np.arange(16, dtype="f8").reshape((4, 4))
+        rg = regrid.Regridder(lat, lon, [0.5, 1.0], directory=self.directory)
+        same, coarse = rg(data)
+        np.testing.assert_allclose(same, data)
+        np.testing.assert_allclose(coarse, [[2.5, 4.5], [10.5, 12.5]])
+        # weights are loaded from the cache when the grid is seen again
+        regrid.Regridder._matrices = {}
+        same, coarse = regrid.Regridder(lat, lon, [0.5, 1.0], directory=self.directory)(data[np.newaxis])
+        assert coarse.shape == (1, 2, 2)
+        np.testing.assert_allclose(coarse[0], [[2.5, 4.5], [10.5, 12.5]])
+
+    def testResampledTiles(self):
+        """Test that tiles are numbered like the rasters resampled in the database."""
+        ulx, uly, srcres, res = 10.0, 5.0, 0.1, 0.05
+        # the database tiles the 25 x 25 source raster into 10 x 10 cells and ranks
+        # each tile by its upper-left corner in order of longitude and latitude
+        corners = [(ulx + j * 10 * srcres, uly - i * 10 * srcres) for i in range(3) for j in range(3)]
+        ranks = dict((c, r + 1) for r, c in enumerate(sorted(corners)))
+        tiles = dbio.resampledTiles(50, 50, ulx, uly, res, srcres)
+        assert len(tiles) == 9
+        for tid, (si, sj), x, y in tiles:
+            c = [k for k in corners if np.isclose(k[0], x) and np.isclose(k[1], y)]
+            assert len(c) == 1
+            assert ranks[c[0]] == tid
+            assert sj.stop - sj.start == 20 and si.stop - si.start == 20
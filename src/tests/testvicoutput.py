@@ -0,0 +1,60 @@
+""" RHEAS VIC output testing suite.
+
+   :synopsis: Unit tests for reading VIC output files
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import unittest
+import struct
+import tempfile
+import os
+import numpy as np
+from vic import output as vicoutput
+
+
+class testVICOutput(unittest.TestCase):
+
+    def setUp(self):
+        """Set the variables of the snow and frozen soil output file."""
+        self.varnames = ["snow_cover", "fdepth", "tdepth", "salbedo", "snow_depth"]
+        self.nlayers = 3
+
+    def _columns(self, rtype):
+        """Returns the column of each variable in a row of floats."""
+        return dict((v, rtype.fields[v][1] // 4) for v in self.varnames)
+
+    def testRecordType(self):
+        """Test record type of binary output with and without frozen soil."""
+        rtype = vicoutput.recordType(self.varnames, self.nlayers)
+        assert rtype.itemsize == 32
+        assert self._columns(rtype) == {"snow_cover": 3, "fdepth": 4, "tdepth": 5, "salbedo": 6, "snow_depth": 7}
+        rtype = vicoutput.recordType(self.varnames, self.nlayers, frozen=True)
+        assert rtype.itemsize == 48
+        assert self._columns(rtype) == {"snow_cover": 3, "fdepth": 4, "tdepth": 7, "salbedo": 10, "snow_depth": 11}
+
+    def testElements(self):
+        """Test number of values written for each variable."""
+        assert vicoutput.elements("soil_moist", self.nlayers) == self.nlayers
+        assert vicoutput.elements("fdepth", self.nlayers) == 1
+        assert vicoutput.elements("fdepth", self.nlayers, frozen=True) == vicoutput.MAX_FRONTS
+        assert vicoutput.elements("salbedo", self.nlayers, frozen=True) == 1
+
+    def testReadBinary(self):
+        """Test reading synthetic binary records written without frozen soil."""
+        rtype = vicoutput.recordType(self.varnames, self.nlayers)
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as fout:
+            for day in range(1, 4):
+                fout.write(struct.pack("<3i5f", 2011, 1, day, 0.5, 0.1 * day, 0.2 * day, 0.8, 10.0 * day))
+        records = np.memmap(filename, dtype=rtype, mode="r")
+        data = records.view("f4").reshape((len(records), rtype.itemsize // 4))
+        columns = self._columns(rtype)
+        assert len(records) == 3
+        assert list(records["day"]) == [1, 2, 3]
+        np.testing.assert_allclose(data[:, columns["fdepth"]], [0.1, 0.2, 0.3], rtol=1e-6)
+        np.testing.assert_allclose(data[:, columns["salbedo"]], [0.8, 0.8, 0.8], rtol=1e-6)
+        np.testing.assert_allclose(data[:, columns["snow_depth"]], [10.0, 20.0, 30.0], rtol=1e-6)
+        del records, data
+        os.remove(filename)
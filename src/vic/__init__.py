@@ -8,6 +8,7 @@
 """
 
 
-from vic import VIC
+from vic import VIC, OutputReader, readOutputParallel
 import output
 import state
+import cache
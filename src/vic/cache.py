@@ -0,0 +1,105 @@
+""" RHEAS module for caching VIC simulations
+
+.. module:: cache
+   :synopsis: Reuse the output and state of identical VIC simulations
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import hashlib
+import shutil
+import os
+import logging
+
+
+def _hashFile(h, filename):
+    """Update hash *h* with the contents of a file."""
+    with open(filename, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            h.update(block)
+
+
+def _directorySize(path):
+    """Returns the total size in bytes of the files under *path*."""
+    size = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(root, filename))
+    return size
+
+
+class RunCache:
+    """Cache of VIC simulations keyed by a hash of their inputs. Each entry holds the
+    output directory and saved state file of a simulation, and the least recently used
+    entries are removed when the cache grows beyond *maxsize* bytes."""
+
+    def __init__(self, directory, maxsize):
+        self.directory = directory
+        self.maxsize = maxsize
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, model, vicexec):
+        """Returns the key of a simulation from its global parameter, soil, forcing and
+        initial state files as well as the VIC executable. Paths under the model directory
+        are left out so that identical simulations in different directories match."""
+        h = hashlib.sha1()
+        params = model.globalParams()
+        with open(model.model_path + "/global.txt") as fin:
+            for line in fin:
+                if len(line.split()) > 0 and line.split()[0] in ["INIT_STATE", "STATENAME"]:
+                    continue
+                h.update(line.replace(model.model_path, ""))
+        if "INIT_STATE" in params:
+            _hashFile(h, params["INIT_STATE"])
+        _hashFile(h, model.model_path + "/soil.txt")
+        forcings = model.model_path + "/forcings"
+        for filename in sorted(os.listdir(forcings)):
+            h.update(filename)
+            _hashFile(h, "{0}/{1}".format(forcings, filename))
+        _hashFile(h, vicexec)
+        return h.hexdigest()
+
+    def restore(self, key, model):
+        """Copies the output and state file of a cached simulation into the model
+        directory, returning whether the simulation was found in the cache."""
+        entry = "{0}/{1}".format(self.directory, key)
+        if not os.path.isdir(entry):
+            return False
+        if os.path.isdir(model.model_path + "/output"):
+            shutil.rmtree(model.model_path + "/output")
+        shutil.copytree(entry + "/output", model.model_path + "/output")
+        statefile = model.stateFilePath()
+        if statefile is not None and os.path.isfile(entry + "/state"):
+            shutil.copy(entry + "/state", statefile)
+        # mark the entry as recently used
+        os.utime(entry, None)
+        return True
+
+    def store(self, key, model):
+        """Adds the output and state file of a simulation to the cache, removing the
+        least recently used entries if the cache becomes too large."""
+        log = logging.getLogger(__name__)
+        entry = "{0}/{1}".format(self.directory, key)
+        if os.path.isdir(entry):
+            return
+        # copy into a temporary entry first, so that an interrupted copy is never restored
+        tmpentry = entry + ".tmp"
+        if os.path.isdir(tmpentry):
+            shutil.rmtree(tmpentry)
+        shutil.copytree(model.model_path + "/output", tmpentry + "/output")
+        statefile = model.stateFilePath()
+        if statefile is not None and os.path.isfile(statefile):
+            shutil.copy(statefile, tmpentry + "/state")
+        os.rename(tmpentry, entry)
+        entries = [os.path.join(self.directory, e) for e in os.listdir(self.directory) if not e.endswith(".tmp")]
+        entries = sorted(entries, key=os.path.getmtime)
+        sizes = dict((e, _directorySize(e)) for e in entries)
+        total = sum(sizes.values())
+        for e in entries:
+            if total <= self.maxsize or e == entry:
+                break
+            log.info("Removing simulation {0} from the VIC cache.".format(os.path.basename(e)))
+            shutil.rmtree(e)
+            total -= sizes[e]
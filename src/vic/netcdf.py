@@ -0,0 +1,95 @@
+""" RHEAS module for saving VIC output into NetCDF files.
+
+.. module:: netcdf
+   :synopsis: Write VIC output into chunked and compressed NetCDF4 files
+
+.. moduleauthor:: Kostas Andreadis <kandread@jpl.nasa.gov>
+
+"""
+
+import netCDF4 as netcdf4
+import numpy as np
+from datetime import datetime
+import os
+import logging
+
+
+timeUnits = "days since 1900-01-01"
+
+
+def _createFile(filename, model):
+    """Create NetCDF file with the coordinates of the model domain."""
+    nrows, ncols, _, _ = model._cellIndices()
+    f = netcdf4.Dataset(filename, "w", format="NETCDF4")
+    f.Conventions = "CF-1.6"
+    f.source = "RHEAS VIC simulation {0}".format(model.name)
+    f.createDimension("time", None)
+    f.createDimension("lat", nrows)
+    f.createDimension("lon", ncols)
+    t = f.createVariable("time", "f8", ("time",))
+    t.units = timeUnits
+    t.calendar = "standard"
+    lat = f.createVariable("lat", "f8", ("lat",))
+    lat.units = "degrees_north"
+    lat[:] = max(model.lat) - np.arange(nrows) * model.res
+    lon = f.createVariable("lon", "f8", ("lon",))
+    lon.units = "degrees_east"
+    lon[:] = min(model.lon) + np.arange(ncols) * model.res
+    return f
+
+
+def _variable(f, varname, data, nodata):
+    """Return variable from NetCDF file, creating it with the dimensions of *data*
+    with shape (time, layer, [member,] cell) if it does not exist."""
+    if varname not in f.variables:
+        dims = ["time"]
+        chunks = [30]
+        if data.shape[1] > 1:
+            if "layer" not in f.dimensions:
+                f.createDimension("layer", data.shape[1])
+            dims.append("layer")
+            chunks.append(data.shape[1])
+        if data.ndim > 3:
+            if "ensemble" not in f.dimensions:
+                f.createDimension("ensemble", data.shape[2])
+            dims.append("ensemble")
+            chunks.append(data.shape[2])
+        dims += ["lat", "lon"]
+        chunks += [min(len(f.dimensions["lat"]), 64), min(len(f.dimensions["lon"]), 64)]
+        f.createVariable(varname, "f4", tuple(dims), zlib=True, complevel=4,
+                         chunksizes=tuple(chunks), fill_value=nodata)
+    return f.variables[varname]
+
+
+def write(filename, model, varname, data, t0):
+    """Write *data* with dimensions (time, layer, [member,] cell) starting on date
+    *t0* into NetCDF file, appending new dates and overwriting existing ones."""
+    log = logging.getLogger(__name__)
+    nrows, ncols, ci, cj = model._cellIndices()
+    if os.path.isfile(filename):
+        f = netcdf4.Dataset(filename, "a")
+    else:
+        f = _createFile(filename, model)
+    if len(f.dimensions["lat"]) != nrows or len(f.dimensions["lon"]) != ncols:
+        log.error("Domain of NetCDF file {0} does not match the simulation. Not saving {1}!".format(filename, varname))
+        f.close()
+        return
+    times = f.variables["time"]
+    t = netcdf4.date2num(datetime(t0.year, t0.month, t0.day), times.units, times.calendar)
+    existing = times[:]
+    i = np.searchsorted(existing, t)
+    # existing dates can only be overwritten if they are the consecutive days of the data
+    overlap = existing[i:i + data.shape[0]]
+    if len(overlap) > 0 and not np.array_equal(overlap, t + np.arange(len(overlap))):
+        log.error("Cannot insert {0} from {1} into NetCDF file {2} without reordering its dates.".format(varname, t0.strftime("%Y-%m-%d"), filename))
+    else:
+        if i < len(existing):
+            log.info("Overwriting {0} in {1} from {2}".format(varname, filename, t0.strftime("%Y-%m-%d")))
+        var = _variable(f, varname, data, model.nodata)
+        grid = np.zeros(data.shape[:-1] + (nrows, ncols), dtype="f4") + model.nodata
+        grid[..., ci, cj] = data
+        if data.shape[1] < 2:
+            grid = grid[:, 0]
+        var[i:i + data.shape[0]] = grid
+        times[i:i + data.shape[0]] = t + np.arange(data.shape[0])
+    f.close()
@@ -7,6 +7,17 @@
 
 """
 
+import re
+import numpy as np
+from collections import OrderedDict
+
+
+layerVariables = ["soil_moist", "soil_temp", "smliqfrac", "smfrozfrac"]
+
+frontVariables = ["fdepth", "tdepth"]
+
+MAX_FRONTS = 3
+
 ebTemplate = """OUTFILE         eb      12
 OUTVAR          OUT_NET_SHORT           %.4f    *       *
 OUTVAR          OUT_NET_LONG            %.4f    *       *
@@ -80,25 +91,109 @@ OUTVAR          OUT_SNOW_DEPTH  %.4f    *       *
 """
 
 
-def template(varlist):
-    """Returns string of VIC output template."""
-    out = "N_OUTFILES\t{0}\n".format(len(varlist))
+templates = OrderedDict([("eb", ebTemplate), ("csp", cspTemplate), ("wb", wbTemplate),
+                         ("sur", surTemplate), ("sub", subTemplate), ("eva", evaTemplate)])
+
+droughtDependencies = {"spi": ["rainf"], "sri": ["runoff"], "severity": ["soil_moist", "runoff"],
+                       "smdi": ["soil_moist"], "cdi": ["rainf", "soil_moist", "par"], "dryspells": ["rainf"]}
+
+# variables that are read from the forcing files rather than the output files
+forcingVariables = ["rainf", "tmax", "tmin"]
+
+# variables that are calculated from saved outputs rather than read from VIC
+droughtVariables = ["spi1", "spi3", "spi6", "spi12", "sri1", "sri3", "sri6", "sri12",
+                    "severity", "dryspells", "smdi", "cdi"]
+
+
+def _outputLines(tmpl):
+    """Returns the variable names and lines of an output template."""
+    lines = [line for line in tmpl.splitlines() if line.startswith("OUTVAR")]
+    return [(line.split()[1].replace("OUT_", "").lower(), line) for line in lines]
+
+
+def _typedTemplate(tmpl):
+    """Sets the binary data type and multiplier of each variable in the output template."""
+    return re.sub(r"\*[ \t]+\*[ \t]*$", "OUT_TYPE_FLOAT  1", tmpl, flags=re.M)
+
+
+def requiredVariables(savevars):
+    """Returns list of variables that VIC needs to write in order to save *savevars*,
+    after expanding variable groups and adding the dependencies of drought indices."""
+    args = variableGroup(list(savevars))
+    out = []
+    for v in args:
+        deps = [droughtDependencies[d] for d in droughtDependencies if v.startswith(d)]
+        for dv in [v] + [dv for d in deps for dv in d]:
+            if dv not in out and dv not in forcingVariables:
+                out.append(dv)
+    return out
+
+
+def selectTemplates(savevars):
+    """Returns the output templates that only contain the variables needed to save *savevars*."""
+    varnames = requiredVariables(savevars)
+    selected = OrderedDict()
+    written = []
+    for prefix in templates:
+        lines = [line for v, line in _outputLines(templates[prefix]) if v in varnames and v not in written]
+        written += [v for v, _ in _outputLines(templates[prefix]) if v in varnames]
+        if len(lines) > 0:
+            selected[prefix] = "OUTFILE         {0}      {1}\n{2}\n".format(prefix, len(lines), "\n".join(lines))
+    if not bool(selected):
+        # VIC needs at least one output file to run
+        selected["wb"] = "OUTFILE         wb      1\n{0}\n".format(dict(_outputLines(wbTemplate))["runoff"])
+    return selected
+
+
+def template(varlist, binary=False, savevars=None):
+    """Returns string of VIC output template. If *savevars* are provided, the
+    template only contains the output files and variables needed to save them."""
+    if savevars is None:
+        selected = OrderedDict([(p, templates[p]) for p in templates if p in varlist])
+    else:
+        selected = selectTemplates(savevars)
+    out = "N_OUTFILES\t{0}\n".format(len(selected))
     out += "\n"
-    if "eb" in varlist:
-        out += ebTemplate
-    if "csp" in varlist:
-        out += cspTemplate
-    if "wb" in varlist:
-        out += wbTemplate
-    if "sur" in varlist:
-        out += surTemplate
-    if "sub" in varlist:
-        out += subTemplate
-    if "eva" in varlist:
-        out += evaTemplate
+    for prefix in selected:
+        if binary:
+            out += _typedTemplate(selected[prefix])
+        else:
+            out += selected[prefix]
     return out
 
 
+def elements(varname, nlayers, frozen=False):
+    """Returns number of values written by VIC for output variable *varname*.
+    Freezing and thawing fronts are only written for each front when VIC is
+    run with *frozen* soil."""
+    if varname in layerVariables:
+        n = nlayers
+    elif varname in frontVariables and frozen:
+        n = MAX_FRONTS
+    else:
+        n = 1
+    return n
+
+
+def recordType(varnames, nlayers, frozen=False):
+    """Returns the NumPy record type of a daily binary VIC output file that
+    contains variables *varnames*. Each record starts with the year, month and
+    day as integers, followed by the values of each variable as floats."""
+    fields = [("year", "i4"), ("month", "i4"), ("day", "i4")]
+    for varname in varnames:
+        n = elements(varname, nlayers, frozen)
+        if n > 1:
+            fields.append((varname, "f4", (n,)))
+        else:
+            fields.append((varname, "f4"))
+    return np.dtype(fields)
+
+
+def parsedTarget(saveto):
+    """Returns whether output saved to *saveto* is parsed, rather than copied as raw files."""
+    return saveto == "db" or (saveto is not None and saveto.startswith("netcdf:"))
+
+
 def variableGroup(args):
     """Returns new list of variables by expanding variable that corresponds to group name."""
     groupvars = {'snow': ["swe", "salbedo", "snow_cover", "snow_depth"],
@@ -106,7 +201,7 @@ def variableGroup(args):
                  'soil': ["soil_moist", "soil_temp"],
                  'eb': ["net_short", "net_long", "latent", "sensible", "grnd_flux"],
                  'wb': ["rainf", "snowf", "evap", "runoff", "baseflow"]}
-    for v in args:
+    for v in list(args):
         if v in groupvars:
             args.remove(v)
             for gv in groupvars[v]:
@@ -9,7 +9,12 @@
 
 
 from collections import OrderedDict
+from datetime import date, timedelta
+from dateutil.relativedelta import relativedelta
 import numpy as np
+import os
+import dbio
+import logging
 
 
 def readStateFile(filename):
@@ -174,3 +179,52 @@ def writeStateFile(filename, state, header):
         for k in state.keys():
             for line in state[k]:
                 fout.write("{0}\n".format(line.strip()))
+
+
+def nextCheckpoint(t, interval):
+    """Returns the first date after *t* at which the model state is saved, when
+    checkpoints are taken every *interval* ("dekad", "month" or number of days)."""
+    if interval == "month":
+        t1 = date(t.year, t.month, 1) + relativedelta(months=1) - timedelta(1)
+        if t1 <= t:
+            t1 = date(t.year, t.month, 1) + relativedelta(months=2) - timedelta(1)
+    elif interval == "dekad":
+        monthend = date(t.year, t.month, 1) + relativedelta(months=1) - timedelta(1)
+        dekads = [d for d in [date(t.year, t.month, 10), date(t.year, t.month, 20), monthend] if d > t]
+        t1 = dekads[0] if len(dekads) > 0 else monthend + timedelta(10)
+    else:
+        t1 = t + timedelta(int(interval))
+    return t1
+
+
+def checkpoints(startdate, enddate, interval):
+    """Returns the checkpoint dates between *startdate* and *enddate*."""
+    dates = []
+    t = nextCheckpoint(startdate, interval)
+    while t < enddate:
+        dates.append(t)
+        t = nextCheckpoint(t, interval)
+    return dates
+
+
+def pruneStates(dbname, name, retention):
+    """Removes state files older than *retention* days before the latest state of
+    simulation *name* from the state catalog and the disk, except those on the last
+    day of a month which are kept for initializing ensembles from past years."""
+    log = logging.getLogger(__name__)
+    if dbio.tableExists(dbname, name, "state"):
+        db = dbio.connect(dbname)
+        cur = db.cursor()
+        cur.execute("select max(fdate) from {0}.state".format(name))
+        latest = cur.fetchone()[0]
+        if latest is not None:
+            t = latest - timedelta(retention)
+            cur.execute("select filename, fdate from {0}.state where fdate < date '{1}' and date_part('day', fdate + 1) != 1".format(name, t.strftime("%Y-%m-%d")))
+            for filename, fdate in cur.fetchall():
+                if os.path.isfile(filename):
+                    os.remove(filename)
+                log.debug("Removed state file {0} from {1}.".format(filename, fdate.strftime("%Y-%m-%d")))
+            cur.execute("delete from {0}.state where fdate < date '{1}' and date_part('day', fdate + 1) != 1".format(name, t.strftime("%Y-%m-%d")))
+            db.commit()
+        cur.close()
+        db.close()
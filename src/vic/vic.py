@@ -9,7 +9,8 @@
 
 from __future__ import division
 import output as vicoutput
-from osgeo import ogr, gdal, osr
+import netcdf as vicnetcdf
+from osgeo import ogr
 import decimal
 import sys
 import subprocess
@@ -25,6 +26,7 @@ import pandas
 import dbio
 import rpath
 import random
+import itertools
 from raster import TileReader
 import logging
 
@@ -68,6 +70,24 @@ class VIC:
         self.skipyear = 0
         self.elev = OrderedDict()
         self.statefile = ""
+        self.outfiles = OrderedDict()
+        self.binary_output = False
+        self.frozen_soil = False
+        self.tilesize = (100, 100)
+        self.partition = None
+        self.bulk = None
+        self.savechunk = None
+        self.nprocs = mp.cpu_count()
+        self.subdomains = 1
+        self.cache = None
+        self.droughtlookback = 0
+
+    def setDates(self, startyear, startmonth, startday, endyear, endmonth, endday):
+        """Set simulation dates."""
+        self.startyear, self.startmonth, self.startday = startyear, startmonth, startday
+        self.endyear, self.endmonth, self.endday = endyear, endmonth, endday
+        self.startdate = datetime(startyear, startmonth, startday)
+        self.enddate = datetime(endyear, endmonth, endday)
 
     def paramFromDB(self):
         """Retrieve file parameters from database."""
@@ -198,8 +218,10 @@ class VIC:
         cur.close()
         db.close()
 
-    def writeParamFile(self, nodes=3, time_step=24, save_state="", init_state=False, state_file="", save_state_to_db=False):
-        """Write VIC global parameter file for current simulation."""
+    def writeParamFile(self, nodes=3, time_step=24, save_state="", init_state=False, state_file="", save_state_to_db=False, binary_output=False, save_vars=None):
+        """Write VIC global parameter file for current simulation. Binary output files
+        are read directly by memory-mapping when saving to the database, and if
+        *save_vars* is given only the outputs needed to save them are written."""
         db = dbio.connect(self.dbname)
         cur = db.cursor()
         cur.execute(
@@ -280,11 +302,14 @@ class VIC:
             "SNOW_BAND\t{0:d}\t{1}/{2}\n".format(nbands, rpath.data, snowbands))
         fout.write("RESULT_DIR\t{0}/output\n".format(self.model_path))
         fout.write("OUT_STEP\t24\n")
-        fout.write("BINARY_OUTPUT\tFALSE\n")
+        if binary_output:
+            fout.write("BINARY_OUTPUT\tTRUE\n")
+        else:
+            fout.write("BINARY_OUTPUT\tFALSE\n")
         fout.write("MOISTFRACT\tFALSE\n")
         fout.write(
             "COMPRESS\tFALSE\nALMA_OUTPUT\tFALSE\nPTR_HEADER\tFALSE\nPRT_SNOW_BAND\tFALSE\n")
-        fout.write(vicoutput.template(["eb", "wb", "sub", "sur", "csp", "eva"]))
+        fout.write(vicoutput.template(["eb", "wb", "sub", "sur", "csp", "eva"], binary_output, save_vars))
         fout.close()
 
     def createIndexTable(self, dataset):
@@ -373,13 +398,32 @@ class VIC:
         self.wind = options['wind']
         return data['precip'], data['tmax'], data['tmin'], data['wind']
 
+    def _writeForcingArrays(self, prec, tmax, tmin, wind, ndays):
+        """Write VIC meteorological forcing data files from arrays with dimensions
+        (day, cell), with cells in the order of the soil file."""
+        log = logging.getLogger(__name__)
+        data = [np.asarray(v) for v in [prec, tmax, tmin, wind]]
+        if any(v.shape != (ndays, len(self.gid)) for v in data) or any(np.isnan(v).any() for v in data):
+            log.error("Missing meteorological data in database for VIC simulation. Exiting...")
+            sys.exit()
+        for c, gid in enumerate(self.gid):
+            filename = "data_{0:.{2}f}_{1:.{2}f}".format(
+                self.gid[gid][0], self.gid[gid][1], self.grid_decimal)
+            log.debug("writing " + filename)
+            np.savetxt("{0}/forcings/{1}".format(self.model_path, filename),
+                       np.column_stack([v[:, c] for v in data]), fmt=["%f", "%.2f", "%.2f", "%.1f"])
+
     def writeForcings(self, prec, tmax, tmin, wind, lai=None):
-        """Write VIC meteorological forcing data files."""
+        """Write VIC meteorological forcing data files. Forcings are either lists of
+        (gid, date, value) records, or arrays with dimensions (day, cell)."""
         log = logging.getLogger(__name__)
         if not os.path.exists(self.model_path + '/forcings'):
             os.mkdir(self.model_path + '/forcings')
         ndays = (date(self.endyear, self.endmonth, self.endday) -
                  date(self.startyear, self.startmonth, self.startday)).days + 1
+        if isinstance(prec, np.ndarray):
+            self._writeForcingArrays(prec, tmax, tmin, wind, ndays)
+            return
         try:
             assert len(prec) == len(self.lat) * ndays and len(tmax) == len(self.lat) * ndays and len(tmin) == len(self.lat) * ndays and len(wind) == len(self.lat) * ndays
         except AssertionError:
@@ -404,190 +448,429 @@ class VIC:
                 fout.write("{0:f} {1:.2f} {2:.2f} {3:.1f}\n".format(
                     prec[i][2], tmax[i][2], tmin[i][2], wind[i][2]))
 
+    def globalParams(self):
+        """Returns the options of the global parameter file as a dictionary."""
+        params = {}
+        with open(self.model_path + "/global.txt") as fin:
+            for line in fin:
+                if len(line.split()) > 1 and line[0] != "#":
+                    params[line.split()[0]] = line.split()[1]
+        return params
+
+    def stateFilePath(self):
+        """Returns the path of the state file written by the simulation, if any."""
+        params = self.globalParams()
+        if "STATENAME" in params:
+            return "{0}_{1:04d}{2:02d}{3:02d}".format(params["STATENAME"], int(params["STATEYEAR"]),
+                                                     int(params["STATEMONTH"]), int(params["STATEDAY"]))
+        else:
+            return None
+
+    def _decompose(self, nsub):
+        """Splits the soil file into *nsub* contiguous chunks with a balanced number of
+        cells, and writes the soil and global parameter files of each chunk into its
+        own sub-directory. Forcings, parameter libraries and the initial state file are
+        shared by all chunks. Returns the sub-directories and the path of the state
+        file that the whole domain would have written."""
+        with open(self.model_path + "/soil.txt") as fin:
+            soil = fin.readlines()
+        with open(self.model_path + "/global.txt") as fin:
+            params = fin.readlines()
+        statefile = self.stateFilePath()
+        bounds = [int(b) for b in np.linspace(0, len(soil), nsub + 1)]
+        paths = []
+        for k in range(nsub):
+            path = "{0}/subdomain{1}".format(self.model_path, k)
+            if not os.path.isdir(path + "/output"):
+                os.makedirs(path + "/output")
+            with open(path + "/soil.txt", "w") as fout:
+                fout.writelines(soil[bounds[k]:bounds[k + 1]])
+            with open(path + "/global.txt", "w") as fout:
+                for line in params:
+                    key = line.split()[0] if len(line.split()) > 0 else None
+                    if key == "SOIL":
+                        line = "SOIL\t{0}/soil.txt\n".format(path)
+                    elif key == "RESULT_DIR":
+                        line = "RESULT_DIR\t{0}/output\n".format(path)
+                    elif key == "STATENAME":
+                        line = "STATENAME\t{0}/vic.state\n".format(path)
+                    fout.write(line)
+            paths.append(path)
+        return paths, statefile
+
+    def _merge(self, paths, statefile):
+        """Moves the output of each sub-domain into the output directory of the model,
+        and concatenates their state files in the order of the soil file."""
+        for path in paths:
+            for filename in os.listdir(path + "/output"):
+                shutil.move("{0}/output/{1}".format(path, filename), "{0}/output/{1}".format(self.model_path, filename))
+        if statefile is not None:
+            suffix = statefile.split("_")[-1]
+            with open(statefile, "w") as fout:
+                for k, path in enumerate(paths):
+                    with open("{0}/vic.state_{1}".format(path, suffix)) as fin:
+                        lines = fin.readlines()
+                    # the date and layer/node header is only written once
+                    fout.writelines(lines if k == 0 else lines[2:])
+        for path in paths:
+            shutil.rmtree(path)
+
     def run(self, vicexec):
-        """Run VIC model."""
+        """Run VIC model. If *subdomains* is greater than one, the domain is split into
+        chunks of cells that are simulated by separate VIC processes and merged back.
+        Simulations found in the run *cache* are restored instead of being run."""
         log = logging.getLogger(__name__)
+        if self.cache is not None:
+            key = self.cache.key(self, vicexec)
+            if self.cache.restore(key, self):
+                log.info("Restored VIC simulation from cache.")
+                return
         log.info("Running VIC...")
         if not os.path.exists(self.model_path + '/output'):
             os.mkdir(self.model_path + '/output')
-        proc = subprocess.Popen([vicexec, "-g", "{0}/global.txt".format(self.model_path)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        for line in iter(proc.stdout.readline, ''):
-            log.debug(line.strip())
+        nsub = min(self.subdomains, len(self.lat))
+        if nsub > 1:
+            paths, statefile = self._decompose(nsub)
+            procs = []
+            for path in paths:
+                # write the messages of each process to a file so that they run unblocked
+                with open(path + "/vic.log", "w") as flog:
+                    procs.append(subprocess.Popen([vicexec, "-g", "{0}/global.txt".format(path)], stdout=flog, stderr=subprocess.STDOUT))
+            for path, proc in zip(paths, procs):
+                proc.wait()
+                with open(path + "/vic.log") as flog:
+                    for line in flog:
+                        log.debug(line.strip())
+            self._merge(paths, statefile)
+        else:
+            proc = subprocess.Popen([vicexec, "-g", "{0}/global.txt".format(self.model_path)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for line in iter(proc.stdout.readline, ''):
+                log.debug(line.strip())
+            proc.wait()
+        if self.cache is not None:
+            if len(os.listdir(self.model_path + "/output")) > 0:
+                self.cache.store(key, self)
+            else:
+                log.warning("VIC did not write any output, not adding simulation to cache.")
 
     def getOutputStruct(self, globalfile):
         """Creates a dictionary with output variable-file pairs."""
         fin = open(globalfile)
         prefix = None
         skipyear = 0
+        binary_output = False
+        frozen_soil = False
         c = 3  # Assumes daily output
         out = {}
+        outfiles = OrderedDict()
         for line in fin:
             if line.find("OUTFILE") == 0:
                 prefix = line.split()[1]
+                outfiles["output/" + prefix] = []
                 c = 3
             elif line.find("SKIPYEAR") == 0:
                 skipyear = int(line.split()[1])
+            elif line.find("BINARY_OUTPUT") == 0:
+                binary_output = line.split()[1].upper() == "TRUE"
+            elif line.find("FROZEN_SOIL") == 0:
+                frozen_soil = line.split()[1].upper() == "TRUE"
             else:
                 if len(line) > 1 and line[0] != "#" and prefix:
                     varname = line.split()[1].replace("OUT_", "").lower()
                     out[varname] = ("output/" + prefix, c)
-                    if varname in ["soil_moist", "soil_temp", "smliqfrac", "smfrozfrac"]:
-                        c += self.nlayers
-                    else:
-                        c += 1
+                    outfiles["output/" + prefix].append(varname)
+                    c += vicoutput.elements(varname, self.nlayers, frozen_soil)
         fin.close()
         out['tmax'] = ("forcings/data", 1)
         out['tmin'] = ("forcings/data", 2)
         out['rainf'] = ("forcings/data", 0)
         self.skipyear = skipyear
+        self.binary_output = binary_output
+        self.frozen_soil = frozen_soil
+        self.outfiles = outfiles
         return out
 
-    def saveToDB(self, args, initialize=True, skipsave=0):
-        """Reads VIC output for selected variables."""
+    def _readOutputFile(self, filename, prefix):
+        """Reads VIC output file into an array with a column for each value written.
+        Binary output files are memory-mapped using the record type derived from the
+        output template, while forcing and text output files are parsed."""
+        if self.binary_output and prefix in self.outfiles:
+            rtype = vicoutput.recordType(self.outfiles[prefix], self.nlayers, self.frozen_soil)
+            records = np.memmap(filename, dtype=rtype, mode='r')
+            # all fields are 4-byte values so each record maps onto a row of floats
+            # that has the same column layout as the text output
+            data = records.view("f4").reshape((len(records), rtype.itemsize // 4))
+        else:
+            data = pandas.read_csv(filename, delim_whitespace=True, header=None).values
+        return data
+
+    def _cellIndices(self):
+        """Returns the grid size and the row and column of each simulated cell."""
+        nrows = int(np.round((max(self.lat) - min(self.lat)) / self.res) + 1)
+        ncols = int(np.round((max(self.lon) - min(self.lon)) / self.res) + 1)
+        ci = [int((max(self.lat) + self.res / 2.0 - self.lat[c]) / self.res) for c in range(len(self.lat))]
+        cj = [int((self.lon[c] - min(self.lon) + self.res / 2.0) / self.res) for c in range(len(self.lon))]
+        return nrows, ncols, np.array(ci), np.array(cj)
+
+    def readOutput(self, args, start=0, end=None, cells=None):
+        """Reads VIC output files for selected variables into arrays with dimensions
+        (time, layer, cell), optionally for the time steps from *start* to *end* and
+        a subset of *cells*. Cells are in the order they were simulated."""
         log = logging.getLogger(__name__)
-        droughtvars = ["spi1", "spi3", "spi6", "spi12", "sri1", "sri3", "sri6", "sri12", "severity", "dryspells", "smdi", "cdi"]
-        layervars = ["soil_moist", "soil_temp", "smliqfrac", "smfrozfrac"]
+        layervars = vicoutput.layerVariables
         outvars = self.getOutputStruct(self.model_path + "/global.txt")
-        outdata = {}
+        outdata = OrderedDict()
+        varnames = []
+        for var in args:
+            if var in outvars:
+                varnames.append(var)
+            else:
+                log.warning("Variable {0} not found in output files. Skipping import.".format(var))
+        if cells is None:
+            cells = range(len(self.lat))
+        prefix = set([outvars[v][0] for v in varnames])
+        for i, c in enumerate(cells):
+            pdata = {}
+            for p in prefix:
+                filename = "{0}/{1}_{2:.{4}f}_{3:.{4}f}".format(self.model_path, p, self.lat[c], self.lon[c], self.grid_decimal)
+                pdata[p] = self._readOutputFile(filename, p)[start:end]
+            for v in varnames:
+                nl = self.nlayers if v in layervars else 1
+                if v not in outdata:
+                    # allocate each variable once the number of records read is known
+                    outdata[v] = np.zeros((pdata[outvars[v][0]].shape[0], nl, len(cells)), dtype="f4")
+                col = outvars[v][1]
+                outdata[v][:, :, i] = pdata[outvars[v][0]][:, col:col + nl]
+            log.debug("Read output for {0}|{1}".format(self.lat[c], self.lon[c]))
+        return outdata
+
+    def _outputGroups(self, args):
+        """Groups selected variables by the output file they are read from, and returns
+        the groups along with the number of output records and the records to read at a time."""
+        log = logging.getLogger(__name__)
+        outvars = self.getOutputStruct(self.model_path + "/global.txt")
+        groups = OrderedDict()
+        for var in args:
+            if var in outvars:
+                groups.setdefault(outvars[var][0], []).append(var)
+            elif var not in vicoutput.droughtVariables:
+                log.warning("Variable {0} not found in output files. Skipping import.".format(var))
+        nt = (date(self.endyear, self.endmonth, self.endday) -
+              date(self.startyear + self.skipyear, self.startmonth, self.startday)).days + 1
+        chunk = nt if self.savechunk is None else self.savechunk
+        return groups, nt, chunk
+
+    def saveToDB(self, args, initialize=True, skipsave=0):
+        """Reads VIC output for selected variables and writes it into the database,
+        one output file (and time chunk if *savechunk* is set) at a time."""
+        log = logging.getLogger(__name__)
         if len(self.lat) > 0 and len(self.lon) > 0:
-            nrows = int(np.round((max(self.lat) - min(self.lat)) / self.res) + 1)
-            ncols = int(np.round((max(self.lon) - min(self.lon)) / self.res) + 1)
-            mask = np.zeros((nrows, ncols), dtype='bool')
-            nt = (date(self.endyear, self.endmonth, self.endday) -
-                  date(self.startyear + self.skipyear, self.startmonth, self.startday)).days + 1
             args = vicoutput.variableGroup(args)
             if len(args) > 0:
-                for var in args:
-                    if var in outvars or var in droughtvars:
-                        if var in layervars:
-                            outdata[var] = np.zeros((nt, self.nlayers, nrows, ncols)) + self.nodata
-                        else:
-                            outdata[var] = np.zeros((nt, 1, nrows, ncols)) + self.nodata
-                    else:
-                        log.warning("Variable {0} not found in output files. Skipping import.".format(var))
-                prefix = set([outvars[v][0] for v in outdata.keys() if v not in droughtvars])
-                startdate = "{0}-{1}-{2}".format(self.startyear, self.startmonth, self.startday)
-                enddate = "{0}-{1}-{2}".format(self.endyear, self.endmonth, self.endday)
-                dates = pandas.date_range(startdate, enddate).values
-                for c in range(len(self.lat)):
-                    pdata = {}
-                    for p in prefix:
-                        filename = "{0}/{1}_{2:.{4}f}_{3:.{4}f}".format(self.model_path, p, self.lat[c], self.lon[c], self.grid_decimal)
-                        pdata[p] = pandas.read_csv(filename, delim_whitespace=True, header=None).values
-                    i = int((max(self.lat) + self.res / 2.0 - self.lat[c]) / self.res)
-                    j = int((self.lon[c] - min(self.lon) + self.res / 2.0) / self.res)
-                    mask[i, j] = True
-                    for v in [v for v in outdata if v not in droughtvars]:
-                        if v in layervars:
-                            for lyr in range(self.nlayers):
-                                outdata[v][:, lyr, i, j] = pdata[outvars[v][0]][:, outvars[v][1] + lyr]
-                        else:
-                            outdata[v][:, 0, i, j] = pdata[outvars[v][0]][:, outvars[v][1]]
-                    log.info("Read output for {0}|{1}".format(self.lat[c], self.lon[c]))
-                for var in args:
-                    if var in droughtvars:
-                        dout = drought.calc(var, self)
-                        if dout is not None:
-                            mi, mj = np.where(mask)
-                            outdata[var][:, 0, mi, mj] = dout
-                        else:
-                            outdata[var] = None
-                    if outdata[var] is not None:
-                        self.writeToDB(outdata[var], dates, "{0}".format(var), initialize, skipsave=skipsave)
+                groups, nt, chunk = self._outputGroups(args)
+                # defer index maintenance to the end of the save unless the caller
+                # already opened a bulk write session
+                session = self.bulk is None
+                if session:
+                    self.bulk = dbio.BulkWrite(self.dbname)
+                try:
+                    for prefix in groups:
+                        for k in range(0, nt, chunk):
+                            for _, outdata in readOutputParallel([self], groups[prefix], k, min(k + chunk, nt), self.nprocs):
+                                for var in outdata:
+                                    self.writeToDB(outdata[var], None, var, initialize and k == 0, skipsave=skipsave, offset=k)
+                finally:
+                    if session:
+                        # drought indices query the tables that were just loaded
+                        self.bulk.commit()
+                        self.bulk = None
+                self.saveDrought(args, initialize, skipsave)
         else:
             log.info("No pixels simulated, not saving any output!")
-        return outdata
 
-    def _writeRaster(self, data, filename):
-        """Writes GeoTIFF raster temporarily so that it can be imported into the database."""
-        nrows, ncols = data.shape
-        driver = gdal.GetDriverByName("GTiff")
-        ods = driver.Create(filename, ncols, nrows, 1, gdal.GDT_Float32)
-        ods.SetGeoTransform([min(self.lon) - self.res / 2.0, self.res,
-                             0, max(self.lat) + self.res / 2.0, 0, -self.res])
-        srs = osr.SpatialReference()
-        srs.SetWellKnownGeogCS("WGS84")
-        ods.SetProjection(srs.ExportToWkt())
-        ods.GetRasterBand(1).WriteArray(data)
-        ods.GetRasterBand(1).SetNoDataValue(self.nodata)
-        ods = None
-
-    def writeToDB(self, data, dates, tablename, initialize, ensemble=False, skipsave=0):
-        """Writes output data into database."""
+    def saveDrought(self, args, initialize=True, skipsave=0, ensemble=False):
+        """Calculates the selected drought indices and writes them into the database,
+        returning the saved arrays of each index. If *droughtlookback* is set, the
+        indices are calculated from that many days before the simulation start so that
+        their accumulation periods are filled from the stored output, but only the
+        simulation period is saved."""
+        _, _, ci, cj = self._cellIndices()
+        saved = OrderedDict()
+        ndays = (date(self.endyear, self.endmonth, self.endday) - date(self.startyear, self.startmonth, self.startday)).days + 1
+        for var in [v for v in args if v in vicoutput.droughtVariables]:
+            startyear, startmonth, startday = self.startyear, self.startmonth, self.startday
+            t = date(startyear, startmonth, startday) - timedelta(self.droughtlookback)
+            self.startyear, self.startmonth, self.startday = t.year, t.month, t.day
+            try:
+                dout = drought.calc(var, self)
+            finally:
+                self.startyear, self.startmonth, self.startday = startyear, startmonth, startday
+            if dout is not None:
+                stored = None
+                if var == "dryspells" and self.droughtlookback > 0 and dout.shape[0] > ndays:
+                    stored = drought.storedValues(self, var, date(startyear, startmonth, startday) - timedelta(1))
+                if stored is not None and stored.shape == dout.shape[1:]:
+                    # dry spells are counted from the start of the lookback period, so
+                    # the count continues from the one stored before the simulation
+                    dout = dout[-ndays:] - dout[-ndays - 1] + stored
+                else:
+                    # all indices end on the last simulated day
+                    dout = dout[-ndays:]
+                # drought indices are returned for the cells in row-major order
+                out = np.zeros((dout.shape[0], 1, len(ci)), dtype="f4")
+                out[:, 0, np.lexsort((cj, ci))] = dout
+                self.writeToDB(out, None, var, initialize, ensemble=ensemble, skipsave=skipsave)
+                saved[var] = out
+        return saved
+
+    def saveToNetCDF(self, filename, args, skipsave=0):
+        """Reads VIC output for selected variables and writes it into a NetCDF file."""
+        log = logging.getLogger(__name__)
+        if len(self.lat) > 0 and len(self.lon) > 0:
+            args = vicoutput.variableGroup(args)
+            for var in [v for v in args if v in vicoutput.droughtVariables]:
+                log.warning("Drought indices are only calculated for output saved in the database. Skipping {0}.".format(var))
+            groups, nt, chunk = self._outputGroups(args)
+            for prefix in groups:
+                for k in range(0, nt, chunk):
+                    for _, outdata in readOutputParallel([self], groups[prefix], k, min(k + chunk, nt), self.nprocs):
+                        for var in outdata:
+                            self.writeToNetCDF(filename, outdata[var], var, skipsave=skipsave, offset=k)
+        else:
+            log.info("No pixels simulated, not saving any output!")
+
+    def writeToNetCDF(self, filename, data, varname, skipsave=0, offset=0):
+        """Writes output data with dimensions (time, layer, [member,] cell) into NetCDF
+        file, with the first time step being *offset* days after the simulation start."""
+        skip = max(skipsave - offset, 0)
+        if data.shape[0] > skip:
+            t0 = date(self.startyear, self.startmonth, self.startday) + timedelta(offset + skip)
+            vicnetcdf.write(filename, self, varname, data[skip:], t0)
+
+    def _prepareTable(self, db, cur, tablename, initialize, layered, ensemble=False, bands=False):
+        """Creates output table if needed, or deletes the rasters of the simulation
+        period when initializing an existing one."""
         log = logging.getLogger(__name__)
-        db = dbio.connect(self.dbname)
-        cur = db.cursor()
         if dbio.tableExists(self.dbname, self.name, tablename) and ensemble and not dbio.columnExists(self.dbname, self.name, tablename, "ensemble"):
             log.warning("Table {0} exists but does not contain ensemble information. Overwriting entire table!".format(tablename))
             cur.execute("drop table {0}.{1}".format(self.name, tablename))
             db.commit()
+        if dbio.tableExists(self.dbname, self.name, tablename) and not dbio.columnExists(self.dbname, self.name, tablename, "rid"):
+            log.warning("Table {0} does not contain raster tiles. Overwriting entire table!".format(tablename))
+            cur.execute("drop table {0}.{1}".format(self.name, tablename))
+            db.commit()
+        if dbio.tableExists(self.dbname, self.name, tablename) and bands and dbio.columnExists(self.dbname, self.name, tablename, "ensemble"):
+            log.warning("Table {0} stores ensemble members in rows. Overwriting entire table!".format(tablename))
+            cur.execute("drop table {0}.{1}".format(self.name, tablename))
+            db.commit()
         if dbio.tableExists(self.dbname, self.name, tablename):
             if initialize:
-                for dt in [self.startdate + timedelta(t) for t in range((self.enddate - self.startdate).days+1)]:
-                    dbio.deleteRasters(self.dbname, "{0}.{1}".format(self.name, tablename), dt)
+                dbio.deleteRasterRange(cur, self.name, tablename, self.startdate, self.enddate)
         else:
-            sql = "create table {0}.{1} (id serial not null primary key, rid int not null, fdate date not null, rast raster)".format(
-                self.name, tablename)
+            partition = self.partition
+            if partition is not None and not dbio.supportsPartitions(cur):
+                log.warning("Partitioned tables require PostgreSQL 10 or later. Creating table {0} without partitions.".format(tablename))
+                partition = None
+            if partition is None:
+                sql = "create table {0}.{1} (id serial not null primary key, rid int not null, fdate date not null, rast raster)".format(
+                    self.name, tablename)
+            else:
+                sql = "create table {0}.{1} (id serial not null, rid int not null, fdate date not null, rast raster) partition by range (fdate)".format(
+                    self.name, tablename)
             cur.execute(sql)
-            if data.shape[1] > 1:
+            if layered:
                 cur.execute("alter table {0}.{1} add column layer int".format(self.name, tablename))
             if ensemble:
                 cur.execute("alter table {0}.{1} add column ensemble int".format(self.name, tablename))
             db.commit()
-        startyear, startmonth, startday = self.startyear, self.startmonth, self.startday
-        if skipsave > 0:
-            ts = date(self.startyear, self.startmonth,
-                      self.startday) + timedelta(skipsave)
-            data = data[skipsave:]
-            startyear, startmonth, startday = ts.year, ts.month, ts.day
-        tiffiles = []
+        columns = ["rid", "fdate"]
+        if layered:
+            columns.append("layer")
+        if ensemble:
+            columns.append("ensemble")
+        return columns
+
+    def _records(self, data, t0, ensemble=False):
+        """Yields the column values and raster of each tile, date and layer of *data*
+        with dimensions (time, layer, [member,] cell) starting on date *t0*."""
+        nrows, ncols, ci, cj = self._cellIndices()
+        ulx = min(self.lon) - self.res / 2.0
+        uly = max(self.lat) + self.res / 2.0
+        tiles = dbio.tiles(nrows, ncols, ulx, uly, self.res, self.tilesize)
+        # cells are scattered onto the grid one time step and layer at a time
+        grid = np.zeros(data.shape[2:-1] + (nrows, ncols), dtype="f4")
         for t in range(data.shape[0]):
-            dt = date(startyear, startmonth, startday) + timedelta(t)
+            dt = t0 + timedelta(t)
             for lyr in range(data.shape[1]):
-                filename = "{0}/{1}_{2}{3:02d}{4:02d}_{5:02d}.tif".format(
-                    self.model_path, tablename, dt.year, dt.month, dt.day, lyr + 1)
-                self._writeRaster(data[t, lyr, :, :], filename)
-                tiffiles.append(filename)
-        cmd = " ".join(["{0}/raster2pgsql".format(rpath.bins), "-s", "4326", "-F", "-d", "-t", "auto"] + tiffiles + ["temp", "|", "{0}/psql".format(rpath.bins), "-d", self.dbname])
-        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        sout, err = proc.communicate()
-        log.debug(sout)
-        cur.execute("alter table temp add column fdate date")
-        cur.execute("update temp set fdate = date (concat_ws('-',substring(filename from {0} for 4),substring(filename from {1} for 2),substring(filename from {2} for 2)))".format(
-            len(tablename) + 2, len(tablename) + 6, len(tablename) + 8))
-        if data.shape[1] > 1:
-            cur.execute("alter table temp add column layer int")
-            cur.execute("update temp set layer=(substring(filename from {0} for 2))::int".format(
-                len(tablename) + 11))
-        cur.execute("select count(*) from temp")
-        n = int(cur.fetchone()[0])
-        ntiles = n / data.shape[0]
-        if data.shape[1] > 1:
-            cur.execute(
-                "insert into {0}.{1} (rid,fdate,layer,rast) select ((rid+{2}) % {2})+1,fdate,layer,rast from temp".format(self.name, tablename, ntiles))
-        else:
-            cur.execute(
-                "insert into {0}.{1} (rid,fdate,rast) select ((rid+{2}) % {2})+1,fdate,rast from temp".format(self.name, tablename, ntiles))
-        if bool(ensemble):
-            sql = "update {0}.{1} set ensemble = {2} where ensemble is null".format(
-                self.name, tablename, int(ensemble))
-            cur.execute(sql)
-        cur.execute("drop index if exists {0}.{1}_dtidx".format(
-            self.name, tablename))
-        cur.execute("create index {1}_dtidx on {0}.{1}(fdate)".format(
-            self.name, tablename))
-        cur.execute("drop index if exists {0}.{1}_spidx".format(
-            self.name, tablename))
-        cur.execute("create index {1}_spidx on {0}.{1} using gist(st_convexhull(rast))".format(
-            self.name, tablename))
+                grid[:] = self.nodata
+                grid[..., ci, cj] = data[t, lyr]
+                for rid, (si, sj), tulx, tuly in tiles:
+                    values = [rid, dt]
+                    if data.shape[1] > 1:
+                        values.append(lyr + 1)
+                    if bool(ensemble):
+                        values.append(int(ensemble))
+                    yield values, dbio.rasterToWKB(grid[..., si, sj], tulx, tuly, self.res, self.nodata)
+
+    def _loadRecords(self, cur, tablename, columns, records):
+        """Streams raster records into output table."""
+        log = logging.getLogger(__name__)
+        if self.bulk is not None:
+            self.bulk.add(cur, self.name, tablename)
+        n = dbio.copyRasters(cur, "{0}.{1}".format(self.name, tablename), columns, records)
+        log.debug("Loaded {0} rasters into {1}.{2}".format(n, self.name, tablename))
+        if self.bulk is None:
+            dbio.createRasterIndexes(cur, self.name, tablename)
+
+    def writeToDB(self, data, dates, tablename, initialize, ensemble=False, skipsave=0, offset=0):
+        """Writes output data with dimensions (time, layer, cell) into database, with
+        the first time step being *offset* days after the simulation start. Data with
+        dimensions (time, layer, member, cell) are stored with one raster band per
+        ensemble member."""
+        db = dbio.connect(self.dbname)
+        cur = db.cursor()
+        columns = self._prepareTable(db, cur, tablename, initialize, data.shape[1] > 1, ensemble, data.ndim > 3)
+        skip = max(skipsave - offset, 0)
+        data = data[skip:]
+        t0 = date(self.startyear, self.startmonth, self.startday) + timedelta(offset + skip)
+        if data.shape[0] > 0:
+            dbio.createPartitions(cur, self.name, tablename, t0, t0 + timedelta(data.shape[0] - 1), self.partition or "year")
+            self._loadRecords(cur, tablename, columns, self._records(data, t0, ensemble))
+        db.commit()
+        cur.close()
+        db.close()
+
+    def writeMembersToDB(self, members, tablename, initialize, skipsave=0, offset=0):
+        """Writes the output of ensemble members into database with a single bulk load,
+        where *members* yields the ensemble number and data with dimensions (time,
+        layer, cell) of each member as they become available."""
+        db = dbio.connect(self.dbname)
+        cur = db.cursor()
+        members = iter(members)
+        e, data = next(members)
+        columns = self._prepareTable(db, cur, tablename, initialize, data.shape[1] > 1, True)
+        skip = max(skipsave - offset, 0)
+        t0 = date(self.startyear, self.startmonth, self.startday) + timedelta(offset + skip)
+        if data.shape[0] > skip:
+            dbio.createPartitions(cur, self.name, tablename, t0, t0 + timedelta(data.shape[0] - skip - 1), self.partition or "year")
+
+        def records():
+            for e, data in itertools.chain([(e, data)], members):
+                for record in self._records(data[skip:], t0, e):
+                    yield record
+        self._loadRecords(cur, tablename, columns, records())
         db.commit()
         cur.close()
         db.close()
 
     def save(self, saveto, args, initialize=True, skipsave=0):
-        """Reads and saves selected output data variables into the database or a user-defined directory."""
+        """Reads and saves selected output data variables into the database, a NetCDF file
+        or a user-defined directory."""
         if saveto == "db":
             self.saveToDB(args, initialize=initialize, skipsave=skipsave)
+        elif saveto.startswith("netcdf:"):
+            # dates already in the file are overwritten, so runs can be appended
+            self.saveToNetCDF(saveto.split(":", 1)[1], args, skipsave=skipsave)
         else:
             if initialize:
                 if os.path.isdir(saveto):
@@ -599,3 +882,70 @@ class VIC:
             # shutil.move(self.model_path+"/forcings", saveto)
             shutil.copytree(self.model_path, saveto,
                             ignore=shutil.ignore_patterns("*.txt"))
+
+
+_sharedOutput = {}
+
+
+def _initOutputReader(shared):
+    """Makes the shared output arrays available to a reader process."""
+    _sharedOutput.update(shared)
+
+
+def _sharedArray(shared):
+    """Returns a shared output buffer as an array with dimensions (member, time, layer, cell)."""
+    buf, shape = shared
+    return np.frombuffer(buf, dtype="f4").reshape(shape)
+
+
+class OutputReader:
+    """Helper class to read the output of a VIC model for a block of cells in a
+    separate process, writing it into the shared output arrays."""
+
+    def __init__(self, args, start=0, end=None):
+        self.args = args
+        self.start = start
+        self.end = end
+
+    def __call__(self, task):
+        model, e, c0, c1 = task
+        outdata = model.readOutput(self.args, self.start, self.end, range(c0, c1))
+        nt = None
+        for var in outdata:
+            nt = outdata[var].shape[0]
+            _sharedArray(_sharedOutput[var])[e, :nt, :, c0:c1] = outdata[var]
+        return e, nt
+
+
+def readOutputParallel(models, args, start, end, nprocs):
+    """Reads the output of *models* for the selected variables and the time steps from
+    *start* to *end* with at most *nprocs* processes, which split the cells and members
+    between them and return the arrays through shared memory. Yields the index and
+    output of each model as soon as all of its cells have been read, so the calling
+    process is free to load the output of other models in the meantime."""
+    outvars = models[0].getOutputStruct(models[0].model_path + "/global.txt")
+    ncells = len(models[0].lat)
+    shared = OrderedDict()
+    for var in args:
+        if var in outvars:
+            nl = models[0].nlayers if var in vicoutput.layerVariables else 1
+            shape = (len(models), end - start, nl, ncells)
+            shared[var] = (mp.RawArray("f", int(np.prod(shape))), shape)
+    # split each model into enough contiguous blocks of cells to keep all processes busy
+    nblocks = max(1, min(ncells, -(-nprocs // len(models))))
+    bounds = [int(b) for b in np.linspace(0, ncells, nblocks + 1)]
+    tasks = [(model, e, bounds[b], bounds[b + 1]) for e, model in enumerate(models) for b in range(nblocks)]
+    # the shared arrays are handed to the processes when they are started
+    pool = mp.Pool(min(nprocs, len(tasks)), _initOutputReader, (shared,))
+    remaining = [nblocks] * len(models)
+    nrecords = [end - start] * len(models)
+    try:
+        for e, nt in pool.imap_unordered(OutputReader(list(shared), start, end), tasks):
+            remaining[e] -= 1
+            if nt is not None:
+                nrecords[e] = min(nrecords[e], nt)
+            if remaining[e] == 0:
+                yield e, OrderedDict((var, _sharedArray(shared[var])[e, :nrecords[e]]) for var in shared)
+    finally:
+        pool.terminate()
+        pool.join()